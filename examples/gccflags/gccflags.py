@@ -15,8 +15,12 @@ import shutil
 import subprocess
 import sys
 
+from opentuner.measurement.interface import resource_usage
 from opentuner.resultsdb.models import Result, TuningRun
 from opentuner.search import manipulator
+from opentuner.search.objective import (MinimizeCPUTime, MinimizeMaxRSS,
+                                        MinimizeTime,
+                                        ThresholdMemoryMinimizeTime)
 
 FLAGS_WORKING_CACHE_FILE = 'cc_flags.json'
 PARAMS_DEFAULTS_CACHE_FILE = 'cc_param_defaults.json'
@@ -52,6 +56,13 @@ argparser.add_argument('--flags-histogram', action='store_true',
 argparser.add_argument('--flag-importance',
                        help='Test the importance of different flags from a '
                             'given json file.')
+argparser.add_argument('--objective', default='time',
+                       choices=('time', 'cpu-time', 'max-rss'),
+                       help='minimize wall time, cpu time (less noisy on '
+                            'shared hosts) or peak memory of the program')
+argparser.add_argument('--memory-target', type=int, metavar='BYTES',
+                       help='minimize time of programs using at most this '
+                            'much memory')
 
 
 class GccFlagsTuner(opentuner.measurement.MeasurementInterface):
@@ -59,6 +70,7 @@ class GccFlagsTuner(opentuner.measurement.MeasurementInterface):
     super(GccFlagsTuner, self).__init__(program_name=args.source, *pargs,
                                         **kwargs)
     self.gcc_version = self.extract_gcc_version()
+    self.source_hash = self.file_hash(args.source)
     self.cc_flags = self.extract_working_flags()
     self.cc_param_defaults = self.extract_param_defaults()
     self.cc_params = self.extract_working_params()
@@ -245,6 +257,15 @@ class GccFlagsTuner(opentuner.measurement.MeasurementInterface):
   def get_tmpdir(self, result_id):
     return './tmp/%d' % result_id
 
+  def artifact_path(self, result_id):
+    return '%s/%s' % (self.get_tmpdir(result_id), args.output)
+
+  def build_fingerprint(self, config_data):
+    # flags are normalized by cfg_to_flags, so configurations that differ
+    # only in ignored parameters share a binary
+    return (self.gcc_version, args.cc, args.compile_template,
+            self.source_hash, self.cfg_to_flags(config_data))
+
   def cleanup(self, result_id):
     tmp_dir = self.get_tmpdir(result_id)
     shutil.rmtree(tmp_dir)
@@ -279,7 +300,14 @@ class GccFlagsTuner(opentuner.measurement.MeasurementInterface):
         log.error('program error')
         return Result(state='ERROR', time=float('inf'))
 
-    return Result(time=run_result['time'])
+    return Result(time=run_result['time'], **resource_usage(run_result))
+
+  def objective(self):
+    if self.args.memory_target:
+      return ThresholdMemoryMinimizeTime(self.args.memory_target)
+    return {'time': MinimizeTime,
+            'cpu-time': MinimizeCPUTime,
+            'max-rss': MinimizeMaxRSS}[self.args.objective]()
 
   def debug_gcc_error(self, flags):
     def fails(subflags):
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+#
+# Benchmark server for sort_tuner.py: times a merge sort that switches to
+# insertion sort below a tunable cutoff, for configurations sent by
+# ServerMeasurementInterface.  The input list is generated once, when the
+# server starts.
+#
+
+import adddeps  # fix sys.path
+
+import argparse
+import random
+import time
+
+from opentuner.measurement.server import serve
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--size', type=int, default=2000)
+parser.add_argument('--seed', type=int, default=0)
+
+
+def insertion_sort(items, lo, hi):
+  for i in xrange(lo + 1, hi):
+    value = items[i]
+    j = i - 1
+    while j >= lo and items[j] > value:
+      items[j + 1] = items[j]
+      j -= 1
+    items[j + 1] = value
+
+
+def merge_sort(items, lo, hi, cutoff, scratch):
+  if hi - lo <= cutoff:
+    insertion_sort(items, lo, hi)
+    return
+  mid = (lo + hi) // 2
+  merge_sort(items, lo, mid, cutoff, scratch)
+  merge_sort(items, mid, hi, cutoff, scratch)
+  scratch[lo:hi] = items[lo:hi]
+  i, j = lo, mid
+  for k in xrange(lo, hi):
+    if j >= hi or (i < mid and scratch[i] <= scratch[j]):
+      items[k] = scratch[i]
+      i += 1
+    else:
+      items[k] = scratch[j]
+      j += 1
+
+
+def main(args):
+  random.seed(args.seed)
+  data = [random.random() for i in xrange(args.size)]
+
+  def measure(config):
+    items = list(data)
+    t0 = time.time()
+    merge_sort(items, 0, len(items), config['cutoff'], list(items))
+    return {'time': time.time() - t0}
+
+  serve(measure)
+
+
+if __name__ == '__main__':
+  main(parser.parse_args())
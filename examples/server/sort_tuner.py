@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+#
+# Tune the insertion sort cutoff of a merge sort measured in long-lived
+# sort_server.py processes (one per measurement slot) rather than starting
+# a process for every test.
+#
+
+import adddeps  # fix sys.path
+
+import argparse
+import os
+import sys
+
+import opentuner
+from opentuner.measurement.server import ServerMeasurementInterface
+from opentuner.search.manipulator import ConfigurationManipulator
+from opentuner.search.manipulator import IntegerParameter
+
+parser = argparse.ArgumentParser(parents=opentuner.argparsers())
+parser.add_argument('--size', type=int, default=2000,
+                    help='number of items to sort')
+
+
+class SortTuner(ServerMeasurementInterface):
+  def server_command(self):
+    return [sys.executable,
+            os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         'sort_server.py'),
+            '--size', str(self.args.size)]
+
+  def manipulator(self):
+    manipulator = ConfigurationManipulator()
+    manipulator.add_parameter(IntegerParameter('cutoff', 1, 256))
+    return manipulator
+
+  def save_final_config(self, configuration):
+    print 'best cutoff:', configuration.data['cutoff']
+
+
+if __name__ == '__main__':
+  SortTuner.main(parser.parse_args())
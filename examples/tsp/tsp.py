@@ -12,6 +12,7 @@ import logging
 
 import opentuner
 from opentuner.search.manipulator import (ConfigurationManipulator,
+                                          CopyOnWriteConfig,
                                           PermutationParameter)
 from opentuner.search.objective import MinimizeTime
 from opentuner.measurement import MeasurementInterface
@@ -21,6 +22,8 @@ from opentuner.tuningrunmain import TuningRunMain
 
 parser = argparse.ArgumentParser(parents=opentuner.argparsers())
 parser.add_argument('data', help='distance matrix file')
+parser.add_argument('--copy-on-write', action='store_true',
+                    help='use CopyOnWriteConfig configurations')
 
 class TSP(MeasurementInterface):
     def __init__(self, args):
@@ -43,7 +46,10 @@ class TSP(MeasurementInterface):
         return out
 
     def manipulator(self):
-        manipulator = ConfigurationManipulator()
+        if self.args.copy_on_write:
+            manipulator = ConfigurationManipulator(config_type=CopyOnWriteConfig)
+        else:
+            manipulator = ConfigurationManipulator()
         manipulator.add_parameter(PermutationParameter(0, range(len(self.distance))))
         return manipulator
 
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+#
+# Compare memory use and throughput of plain dict configurations (deep
+# copied) with CopyOnWriteConfig on the permutations of the TSP example.
+#
+# Runs the copy-then-mutate loop of EvolutionaryTechnique over a population
+# and reports the bytes held by the population and candidates per second.
+#
+
+import adddeps #fix sys.path
+
+import argparse
+import random
+import sys
+import time
+
+from opentuner.search.manipulator import (ConfigurationManipulator,
+                                          CopyOnWriteConfig,
+                                          PermutationParameter)
+
+parser = argparse.ArgumentParser()
+parser.add_argument('data', nargs='?', default='att48_d.txt',
+                    help='distance matrix file')
+parser.add_argument('--tours', type=int, default=8,
+                    help='number of PermutationParameters in a config')
+parser.add_argument('--population', type=int, default=1000)
+parser.add_argument('--mutation-rate', type=float, default=0.1)
+parser.add_argument('--seed', type=int, default=0)
+
+
+def make_manipulator(cities, tours, config_type):
+  manipulator = ConfigurationManipulator(config_type=config_type)
+  for i in xrange(tours):
+    manipulator.add_parameter(PermutationParameter(i, range(cities)))
+  return manipulator
+
+
+def evolve(manipulator, population_size, mutation_rate):
+  """grow a population by copying random parents and mutating some tours"""
+  population = [manipulator.random()]
+  params = manipulator.params
+  while len(population) < population_size:
+    cfg = manipulator.copy(random.choice(population))
+    random.choice(params).op1_small_random_change(cfg)
+    for param in params:
+      if random.random() < mutation_rate:
+        param.op1_small_random_change(cfg)
+    population.append(cfg)
+  return population
+
+
+def population_bytes(population):
+  """
+  bytes held by the configs and the distinct tour lists they reference (the
+  city numbers themselves are shared small ints)
+  """
+  seen = set()
+  total = 0
+  for cfg in population:
+    total += sys.getsizeof(cfg)
+    for value in cfg.itervalues():
+      if id(value) not in seen:
+        seen.add(id(value))
+        total += sys.getsizeof(value)
+  return total
+
+
+def main(args):
+  cities = len(open(args.data).readlines())
+  print '%d cities, %d tours per config, population %d' % (
+    cities, args.tours, args.population)
+  print '%-20s %12s %16s' % ('config_type', 'KiB', 'candidates/s')
+  for config_type in (dict, CopyOnWriteConfig):
+    random.seed(args.seed)
+    manipulator = make_manipulator(cities, args.tours, config_type)
+    t0 = time.time()
+    population = evolve(manipulator, args.population, args.mutation_rate)
+    elapsed = time.time() - t0
+    print '%-20s %12.1f %16.0f' % (config_type.__name__,
+                                   population_bytes(population) / 1024.0,
+                                   len(population) / elapsed)
+
+
+if __name__ == '__main__':
+  main(parser.parse_args())
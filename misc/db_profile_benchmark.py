@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""
+time a fixed number of api iterations (get_next_desired_result and
+report_result) against a fresh sqlite file with each --db-profile
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import opentuner
+from opentuner.api import TuningRunManager
+from opentuner.measurement.interface import DefaultMeasurementInterface
+from opentuner.resultsdb.models import Result
+from opentuner.search.manipulator import ConfigurationManipulator
+from opentuner.search.manipulator import FloatParameter
+
+parser = argparse.ArgumentParser(parents=opentuner.argparsers())
+parser.add_argument('--iterations', type=int, default=300)
+parser.add_argument('--profiles', nargs='+',
+                    default=['none', 'safe', 'fast', 'memory-then-dump'])
+
+
+def run(args, profile, path):
+  random.seed(0)
+  args.database = path
+  args.db_profile = None if profile == 'none' else profile
+  manipulator = ConfigurationManipulator()
+  manipulator.add_parameter(FloatParameter('x', -100.0, 100.0))
+  manipulator.add_parameter(FloatParameter('y', -100.0, 100.0))
+  interface = DefaultMeasurementInterface(args=args,
+                                          manipulator=manipulator,
+                                          project_name='misc',
+                                          program_name='db_profile_benchmark',
+                                          program_version='0.1')
+  t0 = time.time()
+  api = TuningRunManager(interface, args)
+  for i in xrange(args.iterations):
+    desired_result = api.get_next_desired_result()
+    cfg = desired_result.configuration.data
+    api.report_result(desired_result,
+                      Result(time=cfg['x'] ** 2 + cfg['y'] ** 2))
+  api.finish()
+  return time.time() - t0
+
+
+def main(args):
+  logging.disable(logging.WARNING)
+  print '%-18s %10s %14s' % ('profile', 'seconds', 'ms/iteration')
+  for profile in args.profiles:
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    os.unlink(path)
+    try:
+      elapsed = run(args, profile, path)
+    finally:
+      for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+          os.unlink(path + suffix)
+    print '%-18s %10.2f %14.2f' % (profile, elapsed,
+                                   1000.0 * elapsed / args.iterations)
+
+
+if __name__ == '__main__':
+  main(parser.parse_args())
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+"""
+compare the time of ConfigurationManipulator.hash_config with the previous
+per-parameter sha256 implementation for manipulators of various sizes
+"""
+import argparse
+import hashlib
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from opentuner.search.manipulator import ConfigurationManipulator
+from opentuner.search.manipulator import EnumParameter
+from opentuner.search.manipulator import FloatParameter
+from opentuner.search.manipulator import IntegerParameter
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--sizes', type=int, nargs='+', default=[10, 1000, 10000])
+parser.add_argument('--repeat', type=int, default=3)
+
+
+def old_hash_config(manipulator, config):
+  """hash_config before the cached ordering and binary encoding"""
+  m = hashlib.sha256()
+  params = list(manipulator.parameters(config))
+  params.sort(key=lambda p: p.name)
+  for i, p in enumerate(params):
+    m.update(str(p.name))
+    m.update(p.hash_value(config))
+    m.update(str(i))
+    m.update("|")
+  return m.hexdigest()
+
+
+def make_manipulator(size):
+  manipulator = ConfigurationManipulator()
+  for i in xrange(size):
+    if i % 3 == 0:
+      manipulator.add_parameter(IntegerParameter('int%d' % i, 0, 1000))
+    elif i % 3 == 1:
+      manipulator.add_parameter(FloatParameter('float%d' % i, 0.0, 1.0))
+    else:
+      manipulator.add_parameter(EnumParameter('enum%d' % i, ['a', 'b', 'c']))
+  return manipulator
+
+
+def main(args):
+  print '%8s %8s %12s %12s %8s' % ('params', 'calls', 'old (ms)', 'new (ms)',
+                                   'speedup')
+  for size in args.sizes:
+    manipulator = make_manipulator(size)
+    config = manipulator.random()
+    calls = max(1, 10000 / size)
+    old = min(timeit.repeat(lambda: old_hash_config(manipulator, config),
+                            number=calls, repeat=args.repeat)) / calls
+    new = min(timeit.repeat(lambda: manipulator.hash_config(config),
+                            number=calls, repeat=args.repeat)) / calls
+    print '%8d %8d %12.4f %12.4f %7.1fx' % (size, calls, old * 1000.0,
+                                            new * 1000.0, old / new)
+
+
+if __name__ == '__main__':
+  main(parser.parse_args())
@@ -26,6 +26,7 @@ def argparsers():
   """
   return [
       measurement.driver.argparser,
+      resultsdb.persistence.argparser,
       search.driver.argparser,
       search.plugin.argparser,
       search.technique.argparser,
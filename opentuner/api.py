@@ -60,8 +60,7 @@ class TuningRunManager(tuningrunmain.TuningRunMain):
       self.tuning_run.final_config = self.search_driver.best_result.configuration
     self.tuning_run.state = 'COMPLETE'
     self.tuning_run.end_date = datetime.now()
-    self.commit(force=True)
-    self.session.close()
+    self.close()
 
 
 
@@ -1,6 +1,56 @@
 from opentuner.resultsdb.models import *
 
 
+class ResultIndex(object):
+  """
+  in-memory index of the Results of a tuning run by Configuration, shared by
+  MeasurementDriver and SearchDriver so hot paths do not need a
+  results_query(config=...) round-trip
+  """
+
+  def __init__(self, objective):
+    self.objective = objective
+    self.results_by_config = dict()
+    self.best_by_config = dict()
+    self.best_result = None
+    self.indexed = set()
+
+  def add(self, result):
+    """
+    add a Result, adding the same Result twice is a no-op.  Results on
+    reduced fidelity inputs are not comparable and not indexed.
+    """
+    if id(result) in self.indexed or result.fidelity is not None:
+      return
+    self.indexed.add(id(result))
+    config = result.configuration
+    self.results_by_config.setdefault(config, []).append(result)
+    best = self.best_by_config.get(config)
+    if best is None or self.objective.result_compare(result, best) < 0:
+      self.best_by_config[config] = result
+      if (self.best_result is None or
+              self.objective.result_compare(result, self.best_result) < 0):
+        self.best_result = result
+
+  def contains(self, result):
+    """True if result was already added"""
+    return id(result) in self.indexed
+
+  def results(self, config):
+    """all Results for config"""
+    return self.results_by_config.get(config, [])
+
+  def count(self, config):
+    return len(self.results(config))
+
+  def has_results(self, config):
+    return config in self.results_by_config
+
+  def best(self, config):
+    """the best Result for config according to the objective, or None"""
+    return self.best_by_config.get(config)
+
+
 class DriverBase(object):
   """
   shared base class between MeasurementDriver and SearchDriver
@@ -12,9 +62,13 @@ class DriverBase(object):
                objective,
                tuning_run_main,
                args,
+               result_index=None,
                **kwargs):
     self.args = args
     self.objective = objective
+    if result_index is None:
+      result_index = ResultIndex(objective)
+    self.result_index = result_index
     self.session = session
     self.tuning_run_main = tuning_run_main
     self.tuning_run = tuning_run
@@ -37,6 +91,7 @@ class DriverBase(object):
       q = q.filter(Result.id.in_(subq.subquery()))
 
     if objective_ordered:
+      q = q.filter(Result.fidelity == None)
       q = self.objective.result_order_by(q)
 
     return q
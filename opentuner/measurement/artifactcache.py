@@ -0,0 +1,154 @@
+"""
+an on-disk cache of compiled artifacts keyed by a fingerprint of everything
+that went into the build, shared by all processes using the same directory
+"""
+import cPickle as pickle
+import errno
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+
+try:
+  import fcntl
+except ImportError:
+  fcntl = None
+
+log = logging.getLogger(__name__)
+
+
+class ArtifactCache(object):
+  """
+  files stored under the sha256 of their build fingerprint, the least
+  recently used are evicted once the cache grows past max_bytes
+  """
+
+  def __init__(self, directory, max_bytes=1024 ** 3):
+    self.directory = os.path.abspath(directory)
+    self.max_bytes = max_bytes
+    self.hits = 0
+    self.misses = 0
+    _makedirs(self.directory)
+
+  @staticmethod
+  def key(fingerprint):
+    """cache key for a fingerprint (any string or repr()-able value)"""
+    if not isinstance(fingerprint, str):
+      fingerprint = repr(fingerprint)
+    return hashlib.sha256(fingerprint).hexdigest()
+
+  def path(self, key):
+    return os.path.join(self.directory, key[:2], key)
+
+  def get(self, key, dest):
+    """
+    put the artifact stored for key at dest and return (True, the value
+    stored with it), or (False, None) if it is not cached
+    """
+    path = self.path(key)
+    try:
+      with open(path + '.value', 'rb') as fd:
+        value = pickle.load(fd)
+      _makedirs(os.path.dirname(os.path.abspath(dest)))
+      # a copy rather than a link, so writing to dest cannot change the cache
+      shutil.copy2(path, dest)
+      # mtime orders entries for eviction
+      os.utime(path, None)
+    except (IOError, OSError, EOFError, pickle.UnpicklingError):
+      # missing, or evicted by another process while we read it
+      self.misses += 1
+      return False, None
+    self.hits += 1
+    return True, value
+
+  def put(self, key, src, value=None):
+    """store a copy of the file src (and value) under key"""
+    path = self.path(key)
+    _makedirs(os.path.dirname(path))
+    try:
+      data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError, TypeError):
+      log.warning('not caching %s, value %r cannot be pickled', src, value)
+      return
+    # write to temporary names and rename so readers never see partial files
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+    os.close(fd)
+    shutil.copy2(src, tmp)
+    os.rename(tmp, path)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'wb') as fileobj:
+      fileobj.write(data)
+    os.rename(tmp, path + '.value')
+    self.evict()
+
+  def entries(self):
+    """list of (mtime, size of artifact and value, path) of all artifacts"""
+    rv = []
+    for subdir in os.listdir(self.directory):
+      subdir = os.path.join(self.directory, subdir)
+      if not os.path.isdir(subdir):
+        continue
+      for name in os.listdir(subdir):
+        if name.endswith('.value') or name.startswith('tmp'):
+          continue
+        path = os.path.join(subdir, name)
+        try:
+          st = os.stat(path)
+        except OSError:
+          continue
+        size = st.st_size
+        try:
+          size += os.path.getsize(path + '.value')
+        except OSError:
+          pass
+        rv.append((st.st_mtime, size, path))
+    return rv
+
+  def evict(self):
+    """remove least recently used artifacts until under max_bytes"""
+    with self.lock():
+      entries = self.entries()
+      total = sum(size for mtime, size, path in entries)
+      if total <= self.max_bytes:
+        return
+      for mtime, size, path in sorted(entries):
+        if total <= self.max_bytes:
+          break
+        for name in (path, path + '.value'):
+          try:
+            os.unlink(name)
+          except OSError:
+            pass
+        total -= size
+        log.debug('evicted %s from artifact cache', path)
+
+  def lock(self):
+    return _FileLock(os.path.join(self.directory, '.lock'))
+
+
+class _FileLock(object):
+  """an exclusive flock() held for a with block"""
+
+  def __init__(self, path):
+    self.path = path
+    self.fd = None
+
+  def __enter__(self):
+    self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+    if fcntl is not None:
+      fcntl.flock(self.fd, fcntl.LOCK_EX)
+    return self
+
+  def __exit__(self, *exc_info):
+    if fcntl is not None:
+      fcntl.flock(self.fd, fcntl.LOCK_UN)
+    os.close(self.fd)
+
+
+def _makedirs(path):
+  try:
+    os.makedirs(path)
+  except OSError, e:
+    if e.errno != errno.EEXIST:
+      raise
@@ -1,22 +1,96 @@
 import argparse
 import logging
+import Queue
+import random
+import sys
 import time
 import socket
 import os
 from multiprocessing.pool import ThreadPool
 from datetime import datetime
+from datetime import timedelta
 
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.orm.exc import NoResultFound
 
 from opentuner.driverbase import DriverBase
+from opentuner.measurement.interface import MeasurementSlot
+from opentuner.measurement.interface import RUSAGE_FIELDS
+from opentuner.measurement.interface import ProgressMonitor
+from opentuner.measurement.interface import clear_last_resource_usage
+from opentuner.measurement.interface import last_resource_usage
+from opentuner.measurement.interface import parse_cpu_list
+from opentuner.measurement.interface import set_current_slot
+from opentuner.measurement.interface import set_progress_monitor
+from opentuner.measurement.repeat import RepeatedMeasurement
+from opentuner.measurement.repeat import STUDENT_T
+from opentuner.measurement.repeat import copy_result
 from opentuner.resultsdb.models import *
 
 log = logging.getLogger(__name__)
 
+# measured Result columns copied by --reuse-results
+REUSED_COLUMNS = ('state', 'time', 'accuracy', 'energy', 'size', 'confidence',
+                  'user_time', 'system_time', 'max_rss', 'page_faults',
+                  'context_switches', 'time_stddev', 'repeats',
+                  'failed_repeats')
+
 argparser = argparse.ArgumentParser(add_help=False)
 argparser.add_argument('--machine-class',
                        help="name of the machine class being run on")
+argparser.add_argument('--parallel-measurement', action='store_true',
+                       help="run tests concurrently, one per measurement slot")
+argparser.add_argument('--measurement-slots', type=int,
+                       help="number of concurrent measurement slots "
+                            "(default: --parallelism)")
+argparser.add_argument('--pin-slots', action='append', default=[],
+                       metavar='CPULIST', help="""
+                           Pin the processes started from a measurement slot
+                           to the given cpus (for example 0-3 or 0,2).  Give
+                           once per slot, or 'auto' to pin slot i to cpu i.""")
+argparser.add_argument('--compile-parallelism', type=int,
+                       help="number of concurrent compiles for interfaces "
+                            "with parallel_compile (default: --parallelism), "
+                            "runs start as soon as their compile finishes")
+argparser.add_argument('--artifact-cache', metavar='DIR',
+                       help="reuse compiled artifacts stored in DIR, which "
+                            "may be shared by tuning runs and workers")
+argparser.add_argument('--artifact-cache-size', type=float, default=1024,
+                       metavar='MB',
+                       help="evict least recently used artifacts beyond this")
+argparser.add_argument('--max-repeats', type=int, default=1,
+                       help="measure each configuration up to this many times "
+                            "until --confidence-target is met, stopping "
+                            "early if it is clearly worse than the best")
+argparser.add_argument('--min-repeats', type=int, default=2,
+                       help="measure at least this many times when "
+                            "--max-repeats is more than 1")
+argparser.add_argument('--confidence-target', type=float, default=0.02,
+                       help="stop repeating once the confidence interval of "
+                            "the mean time is within this fraction of it")
+argparser.add_argument('--confidence-level', type=float, default=0.95,
+                       choices=sorted(STUDENT_T),
+                       help="confidence level of the intervals")
+argparser.add_argument('--early-termination', type=float, metavar='MARGIN',
+                       help="stop tests whose reported progress projects a "
+                            "result worse than MARGIN times the best (for "
+                            "example 1.5), see "
+                            "MeasurementInterface.report_progress()")
+argparser.add_argument('--early-termination-after', type=float, default=0.1,
+                       metavar='FRACTION',
+                       help="do not project tests less than FRACTION done")
+argparser.add_argument('--reuse-results', action='store_true',
+                       help="satisfy tests from the Results of earlier tuning "
+                            "runs of the same program version, machine class "
+                            "and input class instead of measuring again")
+argparser.add_argument('--reuse-ttl', type=float, metavar='SECONDS',
+                       help="only reuse Results measured within this many "
+                            "seconds (default: any age)")
+argparser.add_argument('--reuse-revalidate', type=float, default=0.0,
+                       metavar='FRACTION',
+                       help="measure this fraction of reusable tests anyway, "
+                            "keeping the stored Results honest")
 
 
 class MeasurementDriver(DriverBase):
@@ -41,6 +115,22 @@ class MeasurementDriver(DriverBase):
 
     self.laptime = time.time()
     self.machine = self.get_machine()
+    self.slot_pool = None
+    self.compile_pool = None
+    self.free_slots = None
+    self.finished = Queue.Queue()
+    self.in_flight = 0
+    # called with each new Result before it is indexed
+    self.result_hooks = list()
+    self.warned_rusage = False
+    if getattr(self.args, 'max_repeats', 1) > 1:
+      self.repeater = RepeatedMeasurement(self.objective,
+                                          self.args.min_repeats,
+                                          self.args.max_repeats,
+                                          self.args.confidence_target,
+                                          self.args.confidence_level)
+    else:
+      self.repeater = None
 
   def get_machine(self):
     """
@@ -69,6 +159,11 @@ class MeasurementDriver(DriverBase):
   def run_time_limit(self, desired_result, default=3600.0 * 24 * 365 * 10):
     """return a time limit to apply to a test run (in seconds)"""
     best = self.results_query(objective_ordered=True).first()
+    # Results reported since the last flush are only in the index
+    indexed = self.result_index.best_result
+    if indexed is not None and (best is None or
+                                self.objective.lt(indexed, best)):
+      best = indexed
     if best is None:
       if desired_result.limit:
         return desired_result.limit
@@ -86,21 +181,32 @@ class MeasurementDriver(DriverBase):
     result.machine = self.machine
     result.tuning_run = self.tuning_run
     result.collection_date = datetime.now()
+    result.fidelity = self.result_fidelity(desired_result)
     self.session.add(result)
     desired_result.result = result
     desired_result.state = 'COMPLETE'
     self.input_manager.after_run(desired_result, input)
-    result.collection_cost = self.lap_timer()
-    self.session.flush()  # populate result.id
+    if result.collection_cost is None:
+      result.collection_cost = self.lap_timer()
+    for hook in self.result_hooks:
+      hook(result)
+    self.result_index.add(result)
     log.debug(
-        'Result(id=%d, cfg=%d, time=%.4f, accuracy=%.2f, collection_cost=%.2f)',
-        result.id,
+        'Result(cfg=%s, time=%.4f, accuracy=%.2f, collection_cost=%.2f)',
         result.configuration.id,
         result.time,
         result.accuracy if result.accuracy is not None else float('NaN'),
         result.collection_cost)
     self.commit()
 
+  def result_fidelity(self, desired_result):
+    """the fidelity of desired_result's Result, None for the full input"""
+    fidelity = desired_result.fidelity
+    if fidelity is None or (fidelity >=
+                            self.input_manager.fidelity_levels() - 1):
+      return None
+    return fidelity
+
   def run_desired_result(self, desired_result, compile_result=None,
                          exec_id=None):
     """
@@ -110,22 +216,155 @@ class MeasurementDriver(DriverBase):
     Optional exec_id paramater can be passed to run_precompiled in case of
     locating a specific executable
     """
+    input = self.prepare_desired_result(desired_result)
+    if self.reuse_result(desired_result, input):
+      return
+
+    result = self.measure(
+      lambda: self.interface.run_precompiled(desired_result, input,
+                                             desired_result.limit,
+                                             compile_result, exec_id),
+      self.race_target())
+
+    self.report_result(desired_result, result, input)
+
+  def measure(self, run_once, best=None):
+    """
+    call run_once() to get a Result, repeatedly with --max-repeats, racing
+    against best
+    """
+    run_once = self.with_resource_usage(run_once)
+    if getattr(self.args, 'early_termination', None) and best is not None:
+      run_once = self.monitored(run_once, best)
+    if self.repeater is None:
+      return run_once()
+    return self.repeater.measure(run_once, best)
+
+  def with_resource_usage(self, run_once):
+    """
+    run_once with the RUSAGE_FIELDS its Result leaves unset filled in from
+    the last call_program() it made
+    """
+    def run():
+      clear_last_resource_usage()
+      result = run_once()
+      usage = last_resource_usage()
+      if usage is not None:
+        for column in RUSAGE_FIELDS:
+          if getattr(result, column) is None:
+            setattr(result, column, usage[column])
+      self.check_resource_usage(result)
+      return result
+    return run
+
+  def check_resource_usage(self, result):
+    """complain once if the objective ranks on resource usage result lacks"""
+    if self.warned_rusage or result.state != 'OK':
+      return
+    missing = [column for column in self.objective.rusage_columns
+               if getattr(result, column) is None]
+    if missing:
+      self.warned_rusage = True
+      log.error('%s ranks on %s, but run() neither set them nor used '
+                'call_program(), they rank as worst',
+                self.objective.__class__.__name__, ', '.join(missing))
+
+  def monitored(self, run_once, best):
+    """run_once with a ProgressMonitor for --early-termination against best"""
+    def run():
+      set_progress_monitor(ProgressMonitor(self.objective, best,
+                                           self.args.early_termination,
+                                           self.args.early_termination_after))
+      try:
+        return run_once()
+      finally:
+        set_progress_monitor(None)
+    return run
+
+  def race_target(self):
+    """
+    a copy of the best Result so far to race (--max-repeats) or project
+    (--early-termination) against in measure(), or None
+    """
+    best = self.result_index.best_result
+    if best is None or (self.repeater is None and
+                        not getattr(self.args, 'early_termination', None)):
+      return None
+    return copy_result(best)
+
+  def prepare_desired_result(self, desired_result):
+    """
+    set the time limit and select the input for desired_result, returns the
+    input to run on.  Uses the session, so must be called from the thread
+    that reports results.
+    """
     desired_result.limit = self.run_time_limit(desired_result)
 
     input = self.input_manager.select_input(desired_result)
     self.session.add(input)
-    self.session.flush()
+    if input.id is None:
+      self.session.flush()
 
     log.debug('running desired result %s on input %s', desired_result.id,
               input.id)
 
     self.input_manager.before_run(desired_result, input)
+    # load the configuration so measurement slots never need the session
+    desired_result.configuration.data
+    return input
 
-    result = self.interface.run_precompiled(desired_result, input,
-                                            desired_result.limit,
-                                            compile_result, exec_id)
-
+  def reusable_result(self, desired_result, input):
+    """
+    the newest Result measured by an earlier tuning run of this program
+    version for desired_result's configuration, on this machine class, input
+    class and fidelity, within --reuse-ttl, or None
+    """
+    q = (self.session.query(Result)
+         .join(TuningRun, Result.tuning_run_id == TuningRun.id)
+         .join(Machine, Result.machine_id == Machine.id)
+         .join(Input, Result.input_id == Input.id)
+         .filter(Result.configuration_id == desired_result.configuration_id,
+                 Result.tuning_run_id != self.tuning_run.id,
+                 Result.state == 'OK',
+                 Result.fidelity == self.result_fidelity(desired_result),
+                 Result.reused_from_id == None,
+                 TuningRun.program_version_id ==
+                 self.tuning_run.program_version_id,
+                 Machine.machine_class_id == self.machine.machine_class_id,
+                 Input.input_class_id == input.input_class_id))
+    if self.args.reuse_ttl is not None:
+      q = q.filter(Result.collection_date >=
+                   datetime.now() - timedelta(seconds=self.args.reuse_ttl))
+    return q.order_by(Result.collection_date.desc()).first()
+
+  def reuse_result(self, desired_result, input):
+    """
+    with --reuse-results, report a copy of a stored Result for
+    desired_result instead of measuring it, returns True if it did
+    """
+    if not self.args.reuse_results:
+      return False
+    source = self.reusable_result(desired_result, input)
+    if source is None:
+      return False
+    if random.random() < self.args.reuse_revalidate:
+      log.debug('revalidating reusable result %d', source.id)
+      return False
+    result = Result(reused_from=source, collection_cost=0.0)
+    for column in REUSED_COLUMNS:
+      setattr(result, column, getattr(source, column))
+    if source.drift_factor is not None and source.raw_time is not None:
+      # undo the drift correction of the source's run, this run corrects
+      # the copy with its own drift factor
+      result.time = source.raw_time
+      for column in ('confidence', 'time_stddev'):
+        if getattr(result, column) is not None:
+          setattr(result, column,
+                  getattr(result, column) * source.drift_factor)
+    log.debug('reusing result %d for desired result %d', source.id,
+              desired_result.id)
     self.report_result(desired_result, result, input)
+    return True
 
   def lap_timer(self):
     """return the time elapsed since the last call to lap_timer"""
@@ -140,13 +379,26 @@ class MeasurementDriver(DriverBase):
     return True if the result was claimed for this process
     """
     self.commit()
+    self.session.flush()
     try:
-      self.session.refresh(desired_result)
-      if desired_result.state == 'REQUESTED':
-        desired_result.state = 'RUNNING'
-        desired_result.start_date = datetime.now()
-        self.commit()
-        return True
+      # a conditional update, so only one of several processes sharing the
+      # database can win the REQUESTED->RUNNING transition
+      start_date = datetime.now()
+      claimed = (self.session.query(DesiredResult)
+                 .filter_by(id=desired_result.id, state='REQUESTED')
+                 .update({'state': 'RUNNING',
+                          'start_date': start_date},
+                         synchronize_session=False))
+      self.commit()
+      if claimed == 1:
+        # update the loaded object without scanning the whole identity map
+        # (synchronize_session='evaluate') or writing it again
+        set_committed_value(desired_result, 'state', 'RUNNING')
+        set_committed_value(desired_result, 'start_date', start_date)
+      else:
+        # claimed by another process, reload its state on next access
+        self.session.expire(desired_result)
+      return claimed == 1
     except SQLAlchemyError:
       self.session.rollback()
     return False
@@ -166,43 +418,190 @@ class MeasurementDriver(DriverBase):
     self.lap_timer()  # reset timer
     q = self.query_pending_desired_results()
 
-    if self.interface.parallel_compile:
-      desired_results = []
-      thread_args = []
+    if self.args.parallel_measurement or self.interface.parallel_compile:
+      self.process_all_concurrent(q.all())
+    else:
+      for dr in q.all():
+        if self.claim_desired_result(dr):
+          self.run_desired_result(dr)
 
-      def compile_result(args):
-        interface, data, result_id = args
-        return interface.compile(data, result_id)
+  def process_all_concurrent(self, desired_results):
+    """
+    run desired_results at the same time, one per measurement slot (a single
+    slot without --parallel-measurement), compiling them first in the compile
+    pool if interface.parallel_compile.  Slot and compile threads only call
+    the measurement interface, the calling thread is the single writer that
+    reports Results to the session.
+    """
+    self.start_desired_results(desired_results)
+    while self.in_flight:
+      self.collect_results()
 
-      for dr in q.all():
+  def start_desired_results(self, desired_results):
+    """
+    claim desired_results and start measuring them in the measurement slots
+    (after compiling them in the compile pool if interface.parallel_compile)
+    without waiting for them, returns the number started
+    """
+    if self.slot_pool is None:
+      self.init_measurement_slots()
+    started = 0
+    try:
+      for dr in desired_results:
         if self.claim_desired_result(dr):
-          desired_results.append(dr)
-          thread_args.append((self.interface, dr.configuration.data, dr.id))
-      thread_pool = ThreadPool(len(desired_results))
-      # print 'Compiling %d results' % len(thread_args)
-      try:
-        # Use map_async instead of map because of bug where keyboardinterrupts are ignored
-        # See http://stackoverflow.com/questions/1408356/keyboard-interrupts-with-pythons-multiprocessing-pool
-        compile_results = thread_pool.map_async(compile_result,
-                                                thread_args).get(9999999)
-      except Exception:
-        # Need to kill other processes because only one thread receives
-        # exception
-        self.interface.kill_all()
-        raise
-      # print 'Running %d results' % len(thread_args)
-      for dr, compile_result in zip(desired_results, compile_results):
-        # Make sure compile was successful
-        self.run_desired_result(dr, compile_result, dr.id)
+          input = self.prepare_desired_result(dr)
+          if self.reuse_result(dr, input):
+            continue
+          if self.interface.parallel_compile:
+            self.compile_pool.apply_async(self.compile_in_pool,
+                                          (dr, input, self.race_target()),
+                                          callback=self.start_compiled)
+          else:
+            self.slot_pool.apply_async(self.measure_in_slot,
+                                       (dr, input, self.race_target()),
+                                       callback=self.finished.put)
+          self.in_flight += 1
+          started += 1
+    except:
+      self.interface.kill_all()
+      raise
+    return started
+
+  def collect_results(self, block=True):
+    """
+    report the Results of finished measurements, waiting for at least one if
+    block is set, returns the number reported
+    """
+    reported = 0
+    try:
+      while self.in_flight:
         try:
-          self.interface.cleanup(dr.id)
-        except RuntimeError, e:
-          print e
-          # print 'Done!'
+          # a timeout is needed for keyboard interrupts to be delivered
+          dr, input, result, exc_info = self.finished.get(block, 9999999)
+        except Queue.Empty:
+          break
+        self.in_flight -= 1
+        if exc_info is not None:
+          raise exc_info[0], exc_info[1], exc_info[2]
+        self.report_result(dr, result, input)
+        reported += 1
+        block = False
+    except:
+      # other slots may still be running processes
+      self.interface.kill_all()
+      raise
+    return reported
+
+  def process_some(self):
+    """
+    start the pending desired_results and wait until at least one
+    measurement finishes, for asynchronous search
+    """
+    if not (self.args.parallel_measurement or
+            self.interface.parallel_compile):
+      # measurements are synchronous, so everything started also finishes
+      self.process_all()
+      return
+    self.lap_timer()
+    self.start_desired_results(self.query_pending_desired_results().all())
+    self.collect_results()
+
+  def compile_in_pool(self, desired_result, input, best):
+    """
+    compile desired_result, called from a compile pool thread.  Returns
+    (desired_result, input, best, compile_result, compile_seconds, exc_info).
+    """
+    t0 = time.time()
+    try:
+      compile_result = self.interface.compile_cached(
+        desired_result.configuration.data, desired_result.id)
+      return (desired_result, input, best, compile_result, time.time() - t0,
+              None)
+    except:
+      return desired_result, input, best, None, None, sys.exc_info()
+
+  def start_compiled(self, compiled):
+    """
+    queue the run of a compiled desired_result for the next free measurement
+    slot, called as each compile finishes
+    """
+    dr, input, best, compile_result, compile_seconds, exc_info = compiled
+    if exc_info is not None:
+      self.finished.put((dr, input, None, exc_info))
     else:
-      for dr in q.all():
-        if self.claim_desired_result(dr):
-          self.run_desired_result(dr)
+      self.slot_pool.apply_async(self.measure_in_slot,
+                                 (dr, input, best, compile_result,
+                                  compile_seconds),
+                                 callback=self.finished.put)
+
+  def measure_in_slot(self, desired_result, input, best=None,
+                      compile_result=None, compile_seconds=0.0):
+    """
+    run desired_result (compiled by compile_in_pool if
+    interface.parallel_compile) in a free measurement slot, called from a
+    slot thread.  Returns (desired_result, input, result, exc_info).
+    """
+    slot = self.free_slots.get()
+    set_current_slot(slot)
+    t0 = time.time()
+    try:
+      if self.interface.parallel_compile:
+        result = self.measure(
+          lambda: self.interface.run_precompiled(desired_result, input,
+                                                 desired_result.limit,
+                                                 compile_result,
+                                                 desired_result.id),
+          best)
+        try:
+          self.interface.cleanup(desired_result.id)
+        except RuntimeError:
+          log.warning('cleanup of %d failed', desired_result.id,
+                      exc_info=True)
+      else:
+        result = self.measure(
+          lambda: self.interface.run_precompiled(desired_result, input,
+                                                 desired_result.limit,
+                                                 None, None),
+          best)
+      result.collection_cost = compile_seconds + time.time() - t0
+      return desired_result, input, result, None
+    except:
+      return desired_result, input, None, sys.exc_info()
+    finally:
+      set_current_slot(None)
+      self.free_slots.put(slot)
+
+  def init_measurement_slots(self):
+    """
+    create the measurement slots and the threads that run them, and the
+    compile pool if interface.parallel_compile
+    """
+    if self.args.parallel_measurement:
+      count = self.args.measurement_slots or self.args.parallelism
+    else:
+      count = 1
+    self.free_slots = Queue.Queue()
+    for slot in self.measurement_slots(count):
+      self.free_slots.put(slot)
+    self.slot_pool = ThreadPool(count)
+    if self.interface.parallel_compile:
+      self.compile_pool = ThreadPool(self.args.compile_parallelism or
+                                     self.args.parallelism)
+
+  def measurement_slots(self, count):
+    """return a list of count MeasurementSlots honoring --pin-slots"""
+    slots = []
+    for i in xrange(count):
+      if self.args.pin_slots == ['auto']:
+        cpus = [i % _cpucount()]
+      elif self.args.pin_slots:
+        cpus = parse_cpu_list(self.args.pin_slots[i % len(self.args.pin_slots)])
+      else:
+        cpus = None
+      slots.append(MeasurementSlot(i, cpus))
+    if self.args.pin_slots:
+      log.info('measurement slots pinned to %s', [s.cpus for s in slots])
+    return slots
 
 
 def _cputype():
@@ -33,6 +33,13 @@ class InputManager(object):
   def get_input_class(self):
     return None
 
+  def fidelity_levels(self):
+    """
+    number of input fidelities, DesiredResult.fidelity ranges over 0 (the
+    cheapest) to fidelity_levels() - 1, None is the full input
+    """
+    return 1
+
 
 class FixedInputManager(InputManager):
   """
@@ -70,7 +77,45 @@ class FixedInputManager(InputManager):
     return self.the_input
 
 
+class FidelityInputManager(InputManager):
+  """
+  an input manager with a ladder of input sizes, the largest is the full
+  input.  DesiredResult.fidelity selects the rung, paths and extras are
+  optional per rung values stored in Input.path and Input.extra.
+  """
 
+  def __init__(self,
+               sizes,
+               input_class_name='fidelity',
+               paths=None,
+               extras=None):
+    self.sizes = list(sizes)
+    self.input_class_name = input_class_name
+    self.paths = paths or [None] * len(self.sizes)
+    self.extras = extras or [None] * len(self.sizes)
+    assert len(self.paths) == len(self.extras) == len(self.sizes)
+    self.inputs = dict()
+    super(FidelityInputManager, self).__init__()
+
+  def fidelity_levels(self):
+    return len(self.sizes)
+
+  def rung(self, fidelity):
+    """index into sizes for a DesiredResult.fidelity"""
+    if fidelity is None:
+      return len(self.sizes) - 1
+    return max(0, min(fidelity, len(self.sizes) - 1))
+
+  def get_input_class(self, fidelity=None):
+    return InputClass.get(self.session,
+                          program=self.program,
+                          name=self.input_class_name,
+                          size=self.sizes[self.rung(fidelity)])
 
-
-
+  def select_input(self, desired_result):
+    rung = self.rung(desired_result.fidelity)
+    if rung not in self.inputs:
+      self.inputs[rung] = Input(input_class=self.get_input_class(rung),
+                                path=self.paths[rung],
+                                extra=self.extras[rung])
+    return self.inputs[rung]
@@ -1,15 +1,18 @@
 import abc
 import argparse
+import ctypes
 import errno
 import hashlib
 import logging
+import math
 import os
 import re
+import select
 import signal
 import subprocess
+import sys
 import threading
 import time
-from multiprocessing.pool import ThreadPool
 
 try:
   import resource
@@ -30,7 +33,7 @@ argparser = argparse.ArgumentParser(add_help=False)
 argparser.add_argument('--parallel-compile', action='store_true',
                        help="present if compiling can be done in parallel")
 
-the_io_thread_pool = None
+the_slot_state = threading.local()
 
 
 class MeasurementInterface(object):
@@ -58,6 +61,7 @@ class MeasurementInterface(object):
     self.pids = []
     self.pid_lock = threading.Lock()
     self.parallel_compile = False
+    self._artifact_cache = None
 
   def compile(self, config_data, id):
     """
@@ -84,6 +88,63 @@ class MeasurementInterface(object):
     """
     pass
 
+  def close(self):
+    """
+    called once when the tuning run ends, stop any processes kept running
+    between tests
+    """
+    pass
+
+  def artifact_path(self, id):
+    """
+    the file compile() writes for id, return it to let --artifact-cache reuse
+    compiled files
+    """
+    return None
+
+  def build_fingerprint(self, config_data):
+    """
+    a value identifying everything that determines the artifact compiled for
+    config_data (override to include compiler versions, source hashes or a
+    normalized command line)
+    """
+    if getattr(self, '_fingerprint_manipulator', None) is None:
+      # manipulator() may build a new ConfigurationManipulator on every call
+      self._fingerprint_manipulator = self.manipulator()
+    return (self.project_name(), self.program_name(), self.program_version(),
+            self._fingerprint_manipulator.hash_config(config_data))
+
+  def artifact_cache(self):
+    """the ArtifactCache selected by --artifact-cache, or None"""
+    if getattr(self, '_artifact_cache', None) is None:
+      directory = getattr(self.args, 'artifact_cache', None)
+      if not directory:
+        return None
+      from .artifactcache import ArtifactCache
+      self._artifact_cache = ArtifactCache(
+        directory, int(self.args.artifact_cache_size * 1024 ** 2))
+    return self._artifact_cache
+
+  def compile_cached(self, config_data, id):
+    """
+    compile() unless the artifact for config_data is in the artifact cache,
+    in which case it is copied to artifact_path(id) and the compile() return
+    value stored with it is returned
+    """
+    cache = self.artifact_cache()
+    path = self.artifact_path(id)
+    if cache is None or path is None:
+      return self.compile(config_data, id)
+    key = cache.key(self.build_fingerprint(config_data))
+    hit, compile_result = cache.get(key, path)
+    if hit:
+      log.debug('artifact cache hit for %s', id)
+      return compile_result
+    compile_result = self.compile(config_data, id)
+    if os.path.exists(path):
+      cache.put(key, path, compile_result)
+    return compile_result
+
   @abc.abstractmethod
   def run(self, desired_result, input, limit):
     """
@@ -175,6 +236,13 @@ class MeasurementInterface(object):
     """
     return []
 
+  def current_slot(self):
+    """
+    the MeasurementSlot the calling thread is measuring in, None outside of
+    concurrent measurement
+    """
+    return current_slot()
+
   def kill_all(self):
     self.pid_lock.acquire()
     for pid in self.pids:
@@ -182,68 +250,72 @@ class MeasurementInterface(object):
     self.pids = []
     self.pid_lock.release()
 
-  def call_program(self, cmd, limit=None, memory_limit=None, **kwargs):
+  def call_program(self, cmd, limit=None, memory_limit=None,
+                   output_limit=None, progress=None, **kwargs):
     """
-    call cmd and kill it if it runs for longer than limit
+    call cmd and kill it if it runs for longer than limit, at most
+    output_limit bytes of stdout and stderr are kept.  progress is an
+    optional function that is given each line of stdout and returns the
+    fraction of the test done so far (or None), with --early-termination
+    tests projected to lose are killed and reported as timeouts.
 
     returns dictionary like
       {'returncode': 0,
        'stdout': '', 'stderr': '',
-       'timeout': False, 'time': 1.89}
+       'timeout': False, 'terminated': False, 'time': 1.89,
+       'user_time': 1.71, 'system_time': 0.12, 'max_rss': 8388608,
+       'page_faults': 1021, 'context_switches': 14}
+
+    terminated is set (together with timeout) if it was killed early because
+    of its progress
+
+    the resource usage (RUSAGE_FIELDS) is that of the process and the
+    children it waited for, None where os.wait4() is unavailable
     """
-    the_io_thread_pool_init(self.args.parallelism)
-    if limit is float('inf'):
-      limit = None
-    if type(cmd) in (str, unicode):
-      kwargs['shell'] = True
-    killed = False
-    t0 = time.time()
-    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                         preexec_fn=preexec_setpgid_setrlimit(memory_limit),
-                         **kwargs)
-    # Add p.pid to list of processes to kill in case of keyboardinterrupt
-    self.pid_lock.acquire()
-    self.pids.append(p.pid)
-    self.pid_lock.release()
+    return self.call_programs([cmd], limit, memory_limit, output_limit,
+                              progress, **kwargs)[0]
 
+  def call_programs(self, cmds, limit=None, memory_limit=None,
+                    output_limit=None, progress=None, **kwargs):
+    """
+    run all of cmds at the same time (from the calling thread) and return a
+    list of call_program() style dictionaries in the same order
+    """
+    slot = current_slot()
+    monitor = current_progress_monitor()
+    runner = ProcessRunner(output_limit)
     try:
-      stdout_result = the_io_thread_pool.apply_async(p.stdout.read)
-      stderr_result = the_io_thread_pool.apply_async(p.stderr.read)
-      while p.returncode is None:
-        if limit is None:
-          goodwait(p)
-        elif limit and time.time() > t0 + limit:
-          killed = True
-          goodkillpg(p.pid)
-          goodwait(p)
-        else:
-          # still waiting...
-          sleep_for = limit - (time.time() - t0)
-          if not stdout_result.ready():
-            stdout_result.wait(sleep_for)
-          elif not stderr_result.ready():
-            stderr_result.wait(sleep_for)
-          else:
-            #TODO(jansel): replace this with a portable waitpid
-            time.sleep(0.001)
-        p.poll()
-    except:
-      if p.returncode is None:
-        goodkillpg(p.pid)
-      raise
+      for cmd in cmds:
+        child = runner.start(cmd, limit, memory_limit,
+                             slot.cpus if slot is not None else None,
+                             progress if monitor is not None else None,
+                             monitor, **kwargs)
+        # Add the pid to list of processes to kill in case of
+        # keyboardinterrupt
+        with self.pid_lock:
+          self.pids.append(child.pid)
+      runner.wait()
     finally:
-      # No longer need to kill p
-      self.pid_lock.acquire()
-      if p.pid in self.pids:
-        self.pids.remove(p.pid)
-      self.pid_lock.release()
-
-    t1 = time.time()
-    return {'time': float('inf') if killed else (t1 - t0),
-            'timeout': killed,
-            'returncode': p.returncode,
-            'stdout': stdout_result.get(),
-            'stderr': stderr_result.get()}
+      # No longer need to kill them
+      with self.pid_lock:
+        for child in runner.children:
+          if child.pid in self.pids:
+            self.pids.remove(child.pid)
+    results = [child.result() for child in runner.children]
+    the_slot_state.resource_usage = combined_resource_usage(results)
+    return results
+
+  def report_progress(self, fraction, partial=None):
+    """
+    called from run() with the fraction of the test done so far and
+    optionally a Result of what was measured so far (default: the elapsed
+    time).  Returns False if the test is projected to lose against the best
+    Result (with --early-termination) and should be stopped.
+    """
+    monitor = current_progress_monitor()
+    if monitor is None:
+      return True
+    return monitor.update(fraction, partial)
 
   def prefix_hook(self, session):
     pass
@@ -260,10 +332,153 @@ class DefaultMeasurementInterface(MeasurementInterface):
     raise RuntimeError('MeasurementInterface.run() not implemented')
 
 
-def preexec_setpgid_setrlimit(memory_limit):
+class MeasurementSlot(object):
+  """
+  one of the concurrent measurement slots used by MeasurementDriver, processes
+  started with call_program() from a slot are pinned to the slot's cpus
+  """
+
+  def __init__(self, index, cpus=None):
+    self.index = index
+    self.cpus = cpus
+
+  def __repr__(self):
+    return 'MeasurementSlot(%d, %s)' % (self.index, self.cpus)
+
+
+def current_slot():
+  """the MeasurementSlot of the calling thread, or None"""
+  return getattr(the_slot_state, 'slot', None)
+
+
+def set_current_slot(slot):
+  the_slot_state.slot = slot
+
+
+def current_progress_monitor():
+  """the ProgressMonitor of the test the calling thread runs, or None"""
+  return getattr(the_slot_state, 'progress_monitor', None)
+
+
+def set_progress_monitor(monitor):
+  the_slot_state.progress_monitor = monitor
+
+
+def last_resource_usage():
+  """
+  the resource usage of the last call_program() or call_programs() of the
+  calling thread as Result() keyword arguments, or None
+  """
+  return getattr(the_slot_state, 'resource_usage', None)
+
+
+def clear_last_resource_usage():
+  the_slot_state.resource_usage = None
+
+
+class ProgressMonitor(object):
+  """
+  decides from the progress a running test reports whether it can still
+  beat best, by projecting its partial Result linearly to completion with
+  SearchObjective.project_compare().  Partial times are measured before
+  drift correction, so they are compared with the raw time of best.
+  """
+
+  def __init__(self, objective, best, margin=1.0, min_fraction=0.1):
+    self.objective = objective
+    self.best = best
+    self.margin = margin
+    self.min_fraction = min_fraction
+    self.start_time = time.time()
+    self.terminated = False
+
+  def update(self, fraction, partial=None):
+    """
+    fraction of the test is done and partial (default: the elapsed time) has
+    been measured, returns False if the test should be stopped
+    """
+    if self.terminated:
+      return False
+    if fraction is None or not self.min_fraction <= fraction < 1.0:
+      return True
+    if partial is None:
+      partial = resultsdb.models.Result(time=time.time() - self.start_time)
+    # time and energy grow from 0 over the test, the rest is kept as is
+    start = resultsdb.models.Result(time=0.0,
+                                    accuracy=partial.accuracy,
+                                    confidence=partial.confidence)
+    if partial.energy is not None:
+      start.energy = 0.0
+    best_time = self.best.time
+    if self.best.raw_time is not None:
+      best_time = self.best.raw_time
+    best = resultsdb.models.Result(time=best_time * self.margin,
+                                   accuracy=self.best.accuracy,
+                                   energy=self.best.energy,
+                                   confidence=self.best.confidence)
+    factor = (1.0 - fraction) / fraction
+    if self.objective.project_compare(start, partial, best, best, factor) > 0:
+      log.debug('stopping test at %.0f%% done, projected to lose',
+                100.0 * fraction)
+      self.terminated = True
+      return False
+    return True
+
+
+def parse_cpu_list(cpu_list):
+  """
+  parse a linux style cpu list such as '0-3,6' into a list of ints
+  """
+  cpus = []
+  for part in cpu_list.split(','):
+    if '-' in part:
+      low, high = part.split('-')
+      cpus.extend(xrange(int(low), int(high) + 1))
+    elif part.strip():
+      cpus.append(int(part))
+  return cpus
+
+
+_the_libc = None
+
+
+def _libc():
+  global _the_libc
+  if _the_libc is None:
+    try:
+      _the_libc = ctypes.CDLL(None, use_errno=True)
+    except (OSError, TypeError):
+      _the_libc = False
+  return _the_libc
+
+
+def set_cpu_affinity(cpus, pid=0):
+  """
+  restrict pid (default: the calling process) to run on cpus, returns False
+  if this is not supported on this platform
+  """
+  if hasattr(os, 'sched_setaffinity'):
+    os.sched_setaffinity(pid, cpus)
+    return True
+  libc = _libc()
+  if not libc or not hasattr(libc, 'sched_setaffinity'):
+    return False
+  # a cpu_set_t, large enough for 1024 cpus
+  mask = (ctypes.c_ulong * (1024 / (8 * ctypes.sizeof(ctypes.c_ulong))))()
+  bits = 8 * ctypes.sizeof(ctypes.c_ulong)
+  for cpu in cpus:
+    mask[cpu // bits] |= 1 << (cpu % bits)
+  return libc.sched_setaffinity(pid, ctypes.sizeof(mask), mask) == 0
+
+
+def preexec_setpgid_setrlimit(memory_limit, cpus=None):
   if resource is not None:
+    if cpus:
+      _libc()  # load before forking
     def _preexec():
       os.setpgid(0, 0)
+      if cpus:
+        set_cpu_affinity(cpus)
       try:
         resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
       except ValueError:
@@ -278,14 +493,6 @@ def preexec_setpgid_setrlimit(memory_limit):
     return _preexec
 
 
-def the_io_thread_pool_init(parallelism=1):
-  global the_io_thread_pool
-  if the_io_thread_pool is None:
-    the_io_thread_pool = ThreadPool(2 * parallelism)
-    # make sure the threads are started up
-    the_io_thread_pool.map(int, range(2 * parallelism))
-
-
 def goodkillpg(pid):
   """
   wrapper around kill to catch errors
@@ -312,3 +519,415 @@ def goodwait(p):
       if e.errno != errno.EINTR:
         raise
 
+
+class ChildProcess(object):
+  """a process started by ProcessRunner and the output read from it"""
+
+  def __init__(self, popen, limit, output_limit, progress=None,
+               monitor=None):
+    self.popen = popen
+    self.pid = popen.pid
+    self.start_time = time.time()
+    self.end_time = None
+    self.deadline = self.start_time + limit if limit else None
+    self.output_limit = output_limit
+    self.killed = False
+    self.returncode = None
+    self.rusage = None
+    self.stdout_fd = popen.stdout.fileno()
+    self.stderr_fd = popen.stderr.fileno()
+    # fd -> list of chunks read so far, and the total size of those
+    self.output = {self.stdout_fd: [], self.stderr_fd: []}
+    self.output_size = dict.fromkeys(self.output, 0)
+    self.open_files = {self.stdout_fd: popen.stdout,
+                       self.stderr_fd: popen.stderr}
+    # see MeasurementInterface.call_program()
+    self.progress = progress
+    self.monitor = monitor
+    self.partial_line = ''
+    self.terminated = False
+    # set by ProcessRunner, a pidfd of the process or None
+    self.exit_fd = None
+
+  def done(self):
+    return self.returncode is not None and not self.open_files
+
+  def read(self, fd):
+    """read available output from fd, returns False at end of file"""
+    try:
+      data = os.read(fd, 65536)
+    except OSError, e:
+      if e.errno in (errno.EINTR, errno.EAGAIN):
+        return True
+      raise
+    if not data:
+      self.open_files.pop(fd).close()
+      return False
+    if self.progress is not None and fd == self.stdout_fd:
+      self.check_progress(data)
+    if self.output_limit is not None:
+      # keep draining so the child never blocks on a full pipe
+      data = data[:max(0, self.output_limit - self.output_size[fd])]
+    if data:
+      self.output[fd].append(data)
+      self.output_size[fd] += len(data)
+    return True
+
+  def check_progress(self, data):
+    """give complete lines of stdout to progress, kill if projected to lose"""
+    lines = (self.partial_line + data).split('\n')
+    # a bounded tail, in case the output has no newlines
+    self.partial_line = lines.pop()[-4096:]
+    for line in lines:
+      fraction = self.progress(line)
+      if (fraction is not None and not self.killed and
+          not self.monitor.update(fraction)):
+        self.terminated = True
+        self.kill()
+
+  def check_exit(self):
+    """reap the child without blocking, returns True if it exited"""
+    if self.returncode is not None:
+      return True
+    if hasattr(os, 'wait4'):
+      try:
+        pid, status, rusage = os.wait4(self.pid, os.WNOHANG)
+      except OSError, e:
+        if e.errno == errno.EINTR:
+          return False
+        if e.errno != errno.ECHILD:
+          raise
+        # reaped by someone else, no resource usage available
+        pid = None
+      if pid == 0:
+        return False
+      if pid is not None:
+        self.rusage = rusage
+        self.popen.returncode = _returncode(status)
+    if self.popen.poll() is None:
+      return False
+    self.returncode = self.popen.returncode
+    self.end_time = time.time()
+    return True
+
+  def kill(self):
+    self.killed = True
+    goodkillpg(self.pid)
+
+  def result(self):
+    """the call_program() dictionary for this process"""
+    rv = {'time': (float('inf') if self.killed
+                   else self.end_time - self.start_time),
+          'timeout': self.killed,
+          'terminated': self.terminated,
+          'returncode': self.returncode,
+          'stdout': ''.join(self.output[self.stdout_fd]),
+          'stderr': ''.join(self.output[self.stderr_fd])}
+    rv.update(rusage_dict(self.rusage))
+    return rv
+
+
+# longest single wait in poll(), callers wake up and wait again until their
+# deadline (the default time limits are years)
+MAX_POLL_SECONDS = 3600.0
+
+
+# how often to check for the exit of a process that closed its output when
+# neither a pidfd nor SIGCHLD can wake us (see ProcessRunner), this bounds
+# the error of its time
+EXIT_POLL_SECONDS = 0.001
+
+# pidfd_open() has the same number on every linux architecture
+PIDFD_OPEN_SYSCALL = 434
+_the_pidfd_support = None
+
+
+def pidfd_open(pid):
+  """
+  a file descriptor that becomes readable when pid exits (linux 5.3 and
+  later), or None where this is not supported
+  """
+  global _the_pidfd_support
+  if _the_pidfd_support is False:
+    return None
+  if hasattr(os, 'pidfd_open'):
+    try:
+      return os.pidfd_open(pid)
+    except OSError, e:
+      err = e.errno
+  else:
+    libc = _libc()
+    if (not sys.platform.startswith('linux') or not libc or
+        not hasattr(libc, 'syscall')):
+      _the_pidfd_support = False
+      return None
+    fd = libc.syscall(ctypes.c_long(PIDFD_OPEN_SYSCALL), ctypes.c_long(pid),
+                      ctypes.c_long(0))
+    if fd >= 0:
+      _the_pidfd_support = True
+      return fd
+    err = ctypes.get_errno()
+  if err in (errno.ENOSYS, errno.EPERM):
+    # old kernel, or blocked by seccomp
+    _the_pidfd_support = False
+  return None
+
+
+def _ignore_signal(signum, frame):
+  pass
+
+
+def _set_nonblocking(fd):
+  fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+
+def poll_milliseconds(seconds):
+  """a poll() timeout for seconds, rounded up since waking early is wasted"""
+  return int(math.ceil(min(max(0, seconds), MAX_POLL_SECONDS) * 1000.0))
+
+
+def _returncode(status):
+  """a subprocess.Popen.returncode from a wait() status"""
+  if os.WIFSIGNALED(status):
+    return -os.WTERMSIG(status)
+  return os.WEXITSTATUS(status)
+
+
+# call_program() keys and resultsdb.models.Result columns for resource usage
+RUSAGE_FIELDS = ('user_time', 'system_time', 'max_rss', 'page_faults',
+                 'context_switches')
+
+
+def rusage_dict(rusage):
+  """
+  RUSAGE_FIELDS from a resource.struct_rusage (all None for None), max_rss
+  is in bytes
+  """
+  if rusage is None:
+    return dict.fromkeys(RUSAGE_FIELDS)
+  # linux reports kilobytes, os x bytes
+  rss_unit = 1 if sys.platform == 'darwin' else 1024
+  return {'user_time': rusage.ru_utime,
+          'system_time': rusage.ru_stime,
+          'max_rss': rusage.ru_maxrss * rss_unit,
+          'page_faults': rusage.ru_minflt + rusage.ru_majflt,
+          'context_switches': rusage.ru_nvcsw + rusage.ru_nivcsw}
+
+
+def resource_usage(run_result):
+  """
+  the resource usage of a call_program() result as Result() keyword
+  arguments, for example: Result(time=r['time'], **resource_usage(r))
+  """
+  return dict((k, run_result.get(k)) for k in RUSAGE_FIELDS)
+
+
+def combined_resource_usage(run_results):
+  """
+  resource_usage() of call_program() results run together: max_rss is the
+  largest, the other fields add up, None where any of them is unmeasured
+  """
+  usages = [resource_usage(r) for r in run_results]
+  combined = dict()
+  for k in RUSAGE_FIELDS:
+    values = [usage[k] for usage in usages]
+    if not values or None in values:
+      combined[k] = None
+    elif k == 'max_rss':
+      combined[k] = max(values)
+    else:
+      combined[k] = sum(values)
+  return combined
+
+
+class ProcessRunner(object):
+  """
+  runs child processes and reads their output from the calling thread with
+  poll(), waking only when output arrives, a process exits or a time limit
+  expires.  Exits are seen through a pidfd per child, or else through a
+  SIGCHLD self-pipe (main thread only), or else by polling every
+  EXIT_POLL_SECONDS once a child closed its output.
+  """
+
+  def __init__(self, output_limit=None):
+    self.output_limit = output_limit
+    self.children = []
+    # fd -> ChildProcess, for every open output pipe
+    self.fds = {}
+    # pidfd -> ChildProcess, for every child not yet reaped
+    self.exit_fds = {}
+    # (read, write) ends of the SIGCHLD wakeup pipe while wait() runs
+    self.sigchld_pipe = None
+    self.poller = select.poll() if hasattr(select, 'poll') else None
+
+  def start(self, cmd, limit=None, memory_limit=None, cpus=None,
+            progress=None, monitor=None, **kwargs):
+    """
+    start cmd in its own process group and return its ChildProcess, see
+    MeasurementInterface.call_program() for progress
+    """
+    if limit == float('inf'):
+      limit = None
+    if type(cmd) in (str, unicode):
+      kwargs['shell'] = True
+    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                         preexec_fn=preexec_setpgid_setrlimit(memory_limit,
+                                                              cpus),
+                         **kwargs)
+    child = ChildProcess(p, limit, self.output_limit, progress, monitor)
+    self.children.append(child)
+    for fd in child.open_files:
+      self.fds[fd] = child
+      self.register(fd)
+    child.exit_fd = pidfd_open(child.pid)
+    if child.exit_fd is not None:
+      self.exit_fds[child.exit_fd] = child
+      self.register(child.exit_fd)
+    return child
+
+  def register(self, fd):
+    if self.poller is not None:
+      self.poller.register(fd, select.POLLIN | select.POLLPRI)
+
+  def unregister(self, fd):
+    if self.poller is not None:
+      self.poller.unregister(fd)
+
+  def wait(self):
+    """run until every started process has exited and closed its output"""
+    if any(child.exit_fd is None for child in self.children):
+      self.watch_sigchld()
+    try:
+      while self.step():
+        pass
+    except:
+      for child in self.children:
+        if not child.check_exit():
+          goodkillpg(child.pid)
+      raise
+    finally:
+      self.unwatch_sigchld()
+      for fd in self.exit_fds.keys():
+        self.close_exit_fd(fd)
+
+  def watch_sigchld(self):
+    """
+    make SIGCHLD wake poll() through signal.set_wakeup_fd(), which is only
+    possible from the main thread and if nothing else uses SIGCHLD or the
+    wakeup fd.  Returns False if it is not possible.
+    """
+    if fcntl is None or not hasattr(signal, 'SIGCHLD'):
+      return False
+    try:
+      if signal.getsignal(signal.SIGCHLD) not in (signal.SIG_DFL, None):
+        return False
+      r, w = os.pipe()
+      _set_nonblocking(r)
+      _set_nonblocking(w)
+      old = signal.set_wakeup_fd(w)
+    except ValueError:
+      return False  # not the main thread
+    if old != -1:
+      signal.set_wakeup_fd(old)
+      os.close(r)
+      os.close(w)
+      return False
+    signal.signal(signal.SIGCHLD, _ignore_signal)
+    # restart reads of the output pipes interrupted by the signal
+    signal.siginterrupt(signal.SIGCHLD, False)
+    self.sigchld_pipe = (r, w)
+    self.register(r)
+    return True
+
+  def unwatch_sigchld(self):
+    if self.sigchld_pipe is None:
+      return
+    r, w = self.sigchld_pipe
+    self.sigchld_pipe = None
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    signal.set_wakeup_fd(-1)
+    self.unregister(r)
+    os.close(r)
+    os.close(w)
+
+  def wakes_on_exit(self, child):
+    return child.exit_fd is not None or self.sigchld_pipe is not None
+
+  def close_exit_fd(self, fd):
+    child = self.exit_fds.pop(fd)
+    child.exit_fd = None
+    self.unregister(fd)
+    os.close(fd)
+
+  def step(self):
+    """wait for the next event, returns False once all children are done"""
+    now = time.time()
+    timeout = None
+    pending = False
+    for child in self.children:
+      if child.done():
+        continue
+      if (child.deadline is not None and not child.killed and
+          now >= child.deadline):
+        child.kill()
+      if not child.open_files and child.check_exit():
+        continue
+      if not child.open_files and not self.wakes_on_exit(child):
+        # the pipes are closed, the process is (almost always) exiting
+        wakeup = EXIT_POLL_SECONDS
+      elif child.deadline is not None and not child.killed:
+        wakeup = child.deadline - now
+      else:
+        wakeup = None
+      pending = True
+      if wakeup is not None:
+        timeout = wakeup if timeout is None else min(timeout, wakeup)
+    if not pending:
+      return False
+
+    for fd in self.poll(timeout):
+      if fd in self.exit_fds:
+        child = self.exit_fds[fd]
+        if child.check_exit():
+          self.close_exit_fd(fd)
+      elif self.sigchld_pipe is not None and fd == self.sigchld_pipe[0]:
+        try:
+          while os.read(fd, 4096):
+            pass
+        except OSError, e:
+          if e.errno not in (errno.EAGAIN, errno.EINTR):
+            raise
+        for child in self.children:
+          child.check_exit()
+      else:
+        child = self.fds[fd]
+        if not child.read(fd):
+          del self.fds[fd]
+          self.unregister(fd)
+          child.check_exit()
+    return True
+
+  def watched_fds(self):
+    fds = self.fds.keys() + self.exit_fds.keys()
+    if self.sigchld_pipe is not None:
+      fds.append(self.sigchld_pipe[0])
+    return fds
+
+  def poll(self, timeout):
+    """the fds that are ready to read (or at end of file, or exited)"""
+    fds = self.watched_fds()
+    if not fds:
+      time.sleep(max(0, timeout))
+      return []
+    try:
+      if self.poller is not None:
+        if timeout is not None:
+          timeout = poll_milliseconds(timeout)
+        return [fd for fd, event in self.poller.poll(timeout)]
+      if timeout is not None:
+        timeout = min(max(0, timeout), MAX_POLL_SECONDS)
+      return select.select(fds, [], [], timeout)[0]
+    except select.error, e:
+      if e.args[0] != errno.EINTR:
+        raise
+      return []
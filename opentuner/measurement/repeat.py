@@ -0,0 +1,152 @@
+import logging
+import math
+
+from opentuner.resultsdb.models import Result
+
+log = logging.getLogger(__name__)
+
+# two sided critical values of Student's t distribution for 1..30 degrees of
+# freedom, the last entry is the normal approximation used beyond that
+STUDENT_T = {
+  0.90: [6.314, 2.920, 2.353, 2.132, 2.015, 1.943, 1.895, 1.860, 1.833, 1.812,
+         1.796, 1.782, 1.771, 1.761, 1.753, 1.746, 1.740, 1.734, 1.729, 1.725,
+         1.721, 1.717, 1.714, 1.711, 1.708, 1.706, 1.703, 1.701, 1.699, 1.697,
+         1.645],
+  0.95: [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262,
+         2.228, 2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093,
+         2.086, 2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045,
+         2.042, 1.960],
+  0.99: [63.657, 9.925, 5.841, 4.604, 4.032, 3.707, 3.499, 3.355, 3.250,
+         3.169, 3.106, 3.055, 3.012, 2.977, 2.947, 2.921, 2.898, 2.878, 2.861,
+         2.845, 2.831, 2.819, 2.807, 2.797, 2.787, 2.779, 2.771, 2.763, 2.756,
+         2.750, 2.576],
+}
+
+# Result columns averaged over repeats, max_rss takes the maximum
+AVERAGED_COLUMNS = ('accuracy', 'energy', 'size', 'user_time', 'system_time',
+                    'page_faults', 'context_switches')
+INTEGER_COLUMNS = ('page_faults', 'context_switches')
+
+
+def student_t(df, level):
+  """critical value for a two sided confidence interval"""
+  values = STUDENT_T[level]
+  return values[min(df, len(values)) - 1]
+
+
+def mean_stddev(values):
+  """mean and sample standard deviation of values"""
+  n = len(values)
+  mean = sum(values) / float(n)
+  if n < 2:
+    return mean, None
+  var = sum((v - mean) ** 2 for v in values) / (n - 1)
+  return mean, math.sqrt(var)
+
+
+def confidence_halfwidth(values, level):
+  """half the width of the confidence interval of the mean of values"""
+  if len(values) < 2:
+    return None
+  mean, stddev = mean_stddev(values)
+  return student_t(len(values) - 1, level) * stddev / math.sqrt(len(values))
+
+
+def copy_result(result):
+  """
+  a new unattached Result with the measurements of result, safe to read from
+  measurement slot threads
+  """
+  copy = Result(time=result.time, confidence=result.confidence,
+                max_rss=result.max_rss, raw_time=result.raw_time)
+  for column in AVERAGED_COLUMNS:
+    setattr(copy, column, getattr(result, column))
+  return copy
+
+
+class RepeatedMeasurement(object):
+  """
+  measures a DesiredResult until the confidence interval of its time is
+  narrow enough, or it is clearly worse than the best result so far (racing)
+  """
+
+  def __init__(self, objective, min_repeats=2, max_repeats=10,
+               target=0.02, level=0.95):
+    self.objective = objective
+    self.min_repeats = min_repeats
+    self.max_repeats = max_repeats
+    self.target = target
+    self.level = level
+
+  def measure(self, run_once, best=None):
+    """
+    call run_once() (returning a Result) until done and return a Result
+    aggregating the repeats, best is the Result to race against
+    """
+    results = []
+    while True:
+      result = run_once()
+      if result.state not in (None, 'OK') or result.time is None:
+        # failures and timeouts are not repeated
+        if not results:
+          return result
+        log.warning('repeat %d failed (%s), keeping the %d OK repeats',
+                    len(results) + 1, result.state, len(results))
+        aggregated = self.aggregate(results)
+        aggregated.failed_repeats = 1
+        return aggregated
+      results.append(result)
+      if self.done(results, best):
+        break
+    return self.aggregate(results)
+
+  def done(self, results, best):
+    n = len(results)
+    if n >= self.max_repeats:
+      return True
+    if n < max(2, self.min_repeats):
+      return False
+    times = [r.time for r in results]
+    mean = sum(times) / n
+    halfwidth = confidence_halfwidth(times, self.level)
+    if halfwidth <= self.target * mean:
+      return True
+    if best is not None and best.time is not None and self.is_worse(
+        results[-1], mean - halfwidth, best):
+      log.debug('stopped after %d repeats, worse than best (%.4f > %.4f)',
+                n, mean - halfwidth, best.time)
+      return True
+    return False
+
+  def is_worse(self, result, optimistic_time, best):
+    """
+    True if result, even at optimistic_time, loses to best at the pessimistic
+    end of its confidence interval
+    """
+    optimistic = copy_result(result)
+    optimistic.time = optimistic_time
+    pessimistic = copy_result(best)
+    pessimistic.time = best.time + (best.confidence or 0.0)
+    return self.objective.lt(pessimistic, optimistic)
+
+  def aggregate(self, results):
+    """a Result with the mean time (and other measurements) of results"""
+    result = results[-1]
+    times = [r.time for r in results]
+    result.time, result.time_stddev = mean_stddev(times)
+    result.repeats = len(results)
+    result.confidence = confidence_halfwidth(times, self.level)
+    for column in AVERAGED_COLUMNS:
+      values = [getattr(r, column) for r in results]
+      if None not in values:
+        mean = mean_stddev(values)[0]
+        if column in INTEGER_COLUMNS:
+          mean = int(round(mean))
+        setattr(result, column, mean)
+    rss = [r.max_rss for r in results if r.max_rss is not None]
+    if rss:
+      result.max_rss = max(rss)
+    costs = [r.collection_cost for r in results]
+    if None not in costs:
+      result.collection_cost = sum(costs)
+    return result
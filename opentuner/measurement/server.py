@@ -0,0 +1,286 @@
+"""
+measurement through long-lived benchmark server processes.  Instead of
+starting a process per test, ServerMeasurementInterface keeps one server per
+measurement slot running and sends it configurations over its stdin/stdout
+as frames of a 4 byte big endian length followed by that many bytes of JSON:
+
+  request:  {"config": {...}, "limit": 1.5}     (limit is null if unlimited)
+  reply:    {"time": 0.0012, "accuracy": ...}   (any Result columns)
+     or:    {"error": "message"}
+
+before the reply a server may send any number of progress frames
+{"progress": 0.25} with the fraction of the test done, see
+MeasurementInterface.report_progress().
+
+A server written in python can use serve() (and progress()), for example:
+
+  from opentuner.measurement.server import serve
+  serve(lambda config: {'time': benchmark(**config)})
+"""
+import abc
+import atexit
+import errno
+import json
+import logging
+import os
+import select
+import struct
+import subprocess
+import sys
+import threading
+import time
+import weakref
+
+from opentuner.measurement.interface import MeasurementInterface
+from opentuner.measurement.interface import goodkillpg
+from opentuner.measurement.interface import poll_milliseconds
+from opentuner.measurement.interface import preexec_setpgid_setrlimit
+from opentuner.resultsdb.models import Result
+
+log = logging.getLogger(__name__)
+
+_header = struct.Struct('>I')
+
+
+class ServerError(Exception):
+  """the server crashed, closed its output or sent an invalid reply"""
+  pass
+
+
+class ServerTimeout(Exception):
+  pass
+
+
+def write_frame(fileobj, message):
+  data = json.dumps(message)
+  fileobj.write(_header.pack(len(data)) + data)
+  fileobj.flush()
+
+
+def read_frame(fileobj):
+  """read a message from fileobj, None at end of file"""
+  header = fileobj.read(_header.size)
+  if len(header) < _header.size:
+    return None
+  length, = _header.unpack(header)
+  return json.loads(fileobj.read(length))
+
+
+_the_outfile = None
+
+
+def progress(fraction):
+  """called by a serve() handler to report the fraction of the test done"""
+  if _the_outfile is not None:
+    write_frame(_the_outfile, {'progress': fraction})
+
+
+def serve(handler, infile=None, outfile=None):
+  """
+  server side of the protocol: call handler(config) for each request until
+  end of file and reply with the dictionary it returns
+  """
+  global _the_outfile
+  infile = infile or sys.stdin
+  if outfile is None:
+    # keep prints of the benchmark out of the replies
+    outfile = sys.stdout
+    sys.stdout = sys.stderr
+  _the_outfile = outfile
+  while True:
+    request = read_frame(infile)
+    if request is None:
+      return
+    try:
+      reply = handler(request['config'])
+    except Exception, e:
+      log.exception('error measuring %s', request['config'])
+      reply = {'error': '%s: %s' % (e.__class__.__name__, e)}
+    write_frame(outfile, reply)
+
+
+class BenchmarkServer(object):
+  """a running server process and the client side of the protocol"""
+
+  def __init__(self, cmd, memory_limit=None, cpus=None, **kwargs):
+    if type(cmd) in (str, unicode):
+      kwargs['shell'] = True
+    self.process = subprocess.Popen(
+      cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+      preexec_fn=preexec_setpgid_setrlimit(memory_limit, cpus), **kwargs)
+    self.pid = self.process.pid
+    self.fd = self.process.stdout.fileno()
+    self.requests = 0
+
+  def alive(self):
+    return self.process.poll() is None
+
+  def request(self, message, limit=None, on_progress=None):
+    """
+    send message and return the reply, waiting at most limit seconds.
+    Progress frames are given to on_progress(fraction), which returns False
+    to give up on the request (raising ServerTimeout).
+    """
+    deadline = time.time() + limit if limit else None
+    try:
+      write_frame(self.process.stdin, message)
+    except IOError, e:
+      raise ServerError('server %d: %s' % (self.pid, e))
+    while True:
+      length, = _header.unpack(self.read(_header.size, deadline))
+      try:
+        reply = json.loads(self.read(length, deadline))
+      except ValueError:
+        raise ServerError('server %d sent an invalid reply' % self.pid)
+      if not (isinstance(reply, dict) and reply.keys() == ['progress']):
+        break
+      if on_progress is not None and not on_progress(reply['progress']):
+        raise ServerTimeout()
+    self.requests += 1
+    return reply
+
+  def read(self, size, deadline):
+    """read exactly size bytes of output before deadline"""
+    chunks = []
+    poller = select.poll()
+    poller.register(self.fd, select.POLLIN | select.POLLPRI)
+    while size > 0:
+      if deadline is None:
+        timeout = None
+      else:
+        timeout = poll_milliseconds(deadline - time.time())
+      try:
+        ready = poller.poll(timeout)
+      except select.error, e:
+        if e.args[0] == errno.EINTR:
+          continue
+        raise
+      if not ready:
+        if time.time() >= deadline:
+          raise ServerTimeout()
+        continue
+      data = os.read(self.fd, size)
+      if not data:
+        raise ServerError('server %d exited with %s' % (
+          self.pid, self.process.wait()))
+      chunks.append(data)
+      size -= len(data)
+    return ''.join(chunks)
+
+  def close(self, kill=False):
+    if self.alive():
+      if kill:
+        goodkillpg(self.pid)
+      else:
+        # end of file on stdin asks the server to exit
+        self.process.stdin.close()
+    try:
+      self.process.wait()
+    except OSError:
+      pass
+
+
+class ServerMeasurementInterface(MeasurementInterface):
+  """
+  a MeasurementInterface that measures configurations in a benchmark server
+  (one per measurement slot) started with server_command() and restarted if
+  it crashes or exceeds the time limit
+  """
+  __metaclass__ = abc.ABCMeta
+
+  def __init__(self, *pargs, **kwargs):
+    super(ServerMeasurementInterface, self).__init__(*pargs, **kwargs)
+    # slot index (None outside of concurrent measurement) -> BenchmarkServer
+    self.servers = {}
+    self.servers_lock = threading.Lock()
+    self.memory_limit = None
+    # normally stopped by close() from TuningRunMain.close(), a weak
+    # reference so atexit does not keep the interface alive
+    atexit.register(_close_servers_at_exit, weakref.ref(self))
+
+  @abc.abstractmethod
+  def server_command(self):
+    """the command (list or shell string) that starts a benchmark server"""
+    return []
+
+  def server_request(self, desired_result, input, limit):
+    """the message sent to the server for desired_result"""
+    return {'config': desired_result.configuration.data, 'limit': limit}
+
+  def result_from_reply(self, reply, elapsed):
+    """
+    a Result from a server reply, elapsed is the round trip time used if the
+    reply has no time
+    """
+    if 'error' in reply:
+      log.warning('benchmark server error: %s', reply['error'])
+      return Result(state='ERROR', time=float('inf'))
+    reply.setdefault('time', elapsed)
+    columns = Result.__table__.columns
+    return Result(**dict((str(k), v) for k, v in reply.iteritems()
+                         if k in columns))
+
+  def get_server(self):
+    """the running server of the calling thread's slot, started if needed"""
+    slot = self.current_slot()
+    key = slot.index if slot is not None else None
+    with self.servers_lock:
+      server = self.servers.get(key)
+    if server is not None and server.alive():
+      return server
+    if server is not None:
+      log.warning('restarting benchmark server %d after %d requests',
+                  server.pid, server.requests)
+      self.forget_server(key, server)
+    server = BenchmarkServer(self.server_command(), self.memory_limit,
+                             slot.cpus if slot is not None else None)
+    with self.servers_lock:
+      self.servers[key] = server
+    with self.pid_lock:
+      self.pids.append(server.pid)
+    return server
+
+  def forget_server(self, key, server, kill=False):
+    server.close(kill)
+    with self.servers_lock:
+      if self.servers.get(key) is server:
+        del self.servers[key]
+    with self.pid_lock:
+      if server.pid in self.pids:
+        self.pids.remove(server.pid)
+
+  def run(self, desired_result, input, limit):
+    if limit == float('inf'):
+      limit = None
+    server = self.get_server()
+    slot = self.current_slot()
+    key = slot.index if slot is not None else None
+    t0 = time.time()
+    try:
+      reply = server.request(self.server_request(desired_result, input,
+                                                 limit), limit,
+                             self.report_progress)
+    except ServerTimeout:
+      self.forget_server(key, server, kill=True)
+      return Result(state='TIMEOUT', time=float('inf'))
+    except ServerError, e:
+      log.warning('%s', e)
+      self.forget_server(key, server, kill=True)
+      return Result(state='ERROR', time=float('inf'))
+    return self.result_from_reply(reply, time.time() - t0)
+
+  def close_servers(self):
+    """stop all servers, they are restarted if needed"""
+    with self.servers_lock:
+      servers = self.servers.items()
+    for key, server in servers:
+      self.forget_server(key, server)
+
+  def close(self):
+    self.close_servers()
+
+
+def _close_servers_at_exit(ref):
+  interface = ref()
+  if interface is not None:
+    interface.close_servers()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+"""
+opentuner-worker: measures the DesiredResults of an existing TuningRun from a
+shared results database.  Start the search with --distributed-measurement and
+then any number of workers (on this or other hosts) with:
+
+  opentuner-worker --database URL --tuning-run UUID --interface MODULE:CLASS
+"""
+import argparse
+import copy
+import imp
+import importlib
+import logging
+import os
+import sys
+import time
+
+import opentuner
+from opentuner import resultsdb
+from opentuner.driverbase import ResultIndex
+from opentuner.measurement.driver import MeasurementDriver
+from opentuner.resultsdb.models import TuningRun
+
+log = logging.getLogger(__name__)
+
+argparser = argparse.ArgumentParser(
+    description='measure DesiredResults of a TuningRun from a shared database')
+argparser.add_argument('--database', required=True,
+                       help='database the tuning run is stored in')
+argparser.add_argument('--tuning-run', required=True, metavar='UUID',
+                       help='uuid of the TuningRun to work on')
+argparser.add_argument('--interface', required=True,
+                       metavar='MODULE:CLASS', help="""
+                           MeasurementInterface to measure with, either
+                           package.module:Class or path/to/file.py:Class.
+                           It is constructed with the args of the tuning
+                           run.""")
+argparser.add_argument('--poll-interval', type=float, default=0.25,
+                       help='seconds to sleep when there is no work')
+argparser.add_argument('--exit-when-idle', type=float, metavar='SECONDS',
+                       help='exit after being idle for this many seconds')
+
+
+class MeasurementWorker(object):
+  """
+  stands in for TuningRunMain in a worker process, owning the session and
+  MeasurementDriver that claim and measure DesiredResults
+  """
+
+  def __init__(self, interface_cls, database, tuning_run_uuid):
+    self.engine, self.Session = resultsdb.connect(database)
+    # as in TuningRunMain, objects are kept loaded across commits
+    self.session = self.Session()
+    self.session.expire_on_commit = False
+    self.tuning_run = (self.session.query(TuningRun)
+                       .filter_by(uuid=tuning_run_uuid).one())
+    self.args = copy.copy(self.tuning_run.args)
+    self.args.database = database
+    self.measurement_interface = interface_cls(self.args)
+    self.input_manager = self.measurement_interface.input_manager()
+    self.objective = self.measurement_interface.objective()
+
+    self.measurement_driver = MeasurementDriver(
+      args=self.args,
+      input_manager=self.input_manager,
+      measurement_interface=self.measurement_interface,
+      objective=self.objective,
+      result_index=ResultIndex(self.objective),
+      session=self.session,
+      tuning_run_main=self,
+      tuning_run=self.tuning_run)
+    self.measurement_interface.set_driver(self.measurement_driver)
+    self.input_manager.set_driver(self.measurement_driver)
+    self.commit()
+
+  def commit(self, force=False):
+    """Results must be visible to the search process, so always commit"""
+    self.session.commit()
+
+  def running(self):
+    """True while the tuning run may still request more tests"""
+    self.session.refresh(self.tuning_run)
+    return self.tuning_run.state in ('QUEUED', 'RUNNING')
+
+  def process_pending(self):
+    """measure the currently pending DesiredResults, return how many"""
+    driver = self.measurement_driver
+    count = 0
+    for dr in driver.query_pending_desired_results().all():
+      if driver.claim_desired_result(dr):
+        driver.lap_timer()
+        driver.run_desired_result(dr)
+        count += 1
+    # end the transaction so the next poll sees new requests
+    self.commit()
+    return count
+
+  def main(self, poll_interval=0.25, exit_when_idle=None):
+    log.info('measuring tuning run %s', self.tuning_run.uuid)
+    idle_since = time.time()
+    try:
+      while True:
+        if self.process_pending():
+          idle_since = time.time()
+        elif not self.running():
+          log.info('tuning run %s is %s, exiting', self.tuning_run.uuid,
+                   self.tuning_run.state)
+          break
+        elif (exit_when_idle is not None and
+              time.time() - idle_since > exit_when_idle):
+          log.info('idle for %.0f seconds, exiting', exit_when_idle)
+          break
+        else:
+          time.sleep(poll_interval)
+    finally:
+      self.measurement_interface.kill_all()
+      self.measurement_interface.close()
+      self.session.close()
+
+
+def load_interface(spec):
+  """load a MeasurementInterface subclass given as MODULE:CLASS"""
+  path, _, name = spec.rpartition(':')
+  if not path or not name:
+    raise ValueError('expected MODULE:CLASS, got %r' % spec)
+  if path.endswith('.py'):
+    sys.path.insert(0, os.path.dirname(os.path.abspath(path)))
+    module = imp.load_source('opentuner_worker_interface', path)
+  else:
+    module = importlib.import_module(path)
+  return getattr(module, name)
+
+
+def main(argv=None):
+  opentuner.init_logging()
+  args = argparser.parse_args(argv)
+  if '://' not in args.database:
+    args.database = 'sqlite:///' + args.database
+  worker = MeasurementWorker(load_interface(args.interface),
+                             args.database,
+                             args.tuning_run)
+  worker.main(args.poll_interval, args.exit_when_idle)
+
+
+if __name__ == '__main__':
+  main()
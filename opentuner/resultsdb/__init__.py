@@ -1,6 +1,7 @@
 
-from connect import connect
+from connect import connect, dump, SQLITE_PROFILES
 
 import models
+import persistence
 
 
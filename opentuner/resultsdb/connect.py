@@ -1,13 +1,91 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine.url import make_url
 from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import SingletonThreadPool, StaticPool
 from models import Base, _Meta
 import logging
 import time
+import weakref
 from pprint import pprint
 
 log = logging.getLogger(__name__)
 
-DB_VERSION = "0.0"
+DB_VERSION = "0.7"
+
+
+def _migrate_rehash_configurations(connection):
+  """
+  hash_config() changed encoding, the old digests are marked as legacy and
+  TuningRunMain recomputes a program's hashes the next time it is tuned
+  """
+  connection.execute('ALTER TABLE configuration ADD COLUMN legacy_hash '
+                     'VARCHAR(64)')
+  connection.execute('UPDATE configuration SET legacy_hash = hash')
+
+
+def _migrate_add_rusage(connection):
+  """Result gained resource usage columns"""
+  for name, sqltype in (('user_time', 'FLOAT'),
+                        ('system_time', 'FLOAT'),
+                        ('max_rss', 'FLOAT'),
+                        ('page_faults', 'INTEGER'),
+                        ('context_switches', 'INTEGER')):
+    connection.execute('ALTER TABLE result ADD COLUMN %s %s' % (name, sqltype))
+
+
+def _migrate_add_repeats(connection):
+  """Result gained statistics of repeated measurements"""
+  connection.execute('ALTER TABLE result ADD COLUMN time_stddev FLOAT')
+  connection.execute('ALTER TABLE result ADD COLUMN repeats INTEGER')
+
+
+def _migrate_add_drift(connection):
+  """Result gained drift correction columns"""
+  connection.execute('ALTER TABLE result ADD COLUMN raw_time FLOAT')
+  connection.execute('ALTER TABLE result ADD COLUMN drift_factor FLOAT')
+
+
+def _migrate_add_fidelity(connection):
+  """DesiredResult and Result gained an input fidelity"""
+  connection.execute('ALTER TABLE desired_result ADD COLUMN fidelity INTEGER')
+  connection.execute('ALTER TABLE result ADD COLUMN fidelity INTEGER')
+
+
+def _migrate_add_reused_from(connection):
+  """Result gained the provenance of --reuse-results"""
+  connection.execute('ALTER TABLE result ADD COLUMN reused_from_id INTEGER '
+                     'REFERENCES result (id)')
+
+
+def _migrate_add_failed_repeats(connection):
+  """Result gained the count of failed repeats"""
+  connection.execute('ALTER TABLE result ADD COLUMN failed_repeats INTEGER')
+
+
+# old version -> (new version, function(connection) upgrading the schema)
+MIGRATIONS = {
+  "0.0": ("0.1", _migrate_rehash_configurations),
+  "0.1": ("0.2", _migrate_add_rusage),
+  "0.2": ("0.3", _migrate_add_repeats),
+  "0.3": ("0.4", _migrate_add_drift),
+  "0.4": ("0.5", _migrate_add_fidelity),
+  "0.5": ("0.6", _migrate_add_reused_from),
+  "0.6": ("0.7", _migrate_add_failed_repeats),
+}
+
+
+def migrate(engine, Session, version):
+  """upgrade a database from version to DB_VERSION, returns the new version"""
+  while version != DB_VERSION and version in MIGRATIONS:
+    new_version, upgrade = MIGRATIONS[version]
+    log.info('migrating opentuner database from version %s to %s',
+             version, new_version)
+    with engine.begin() as connection:
+      upgrade(connection)
+    _Meta.set_version(Session, new_version)
+    Session.commit()
+    version = new_version
+  return version
 
 if False:  # profiling of queries
   import atexit
@@ -32,8 +110,163 @@ if False:  # profiling of queries
     pprint(the_query_totals.most_common(10))
 
 
-def connect(dbstr):
-  engine = create_engine(dbstr, echo = False)
+# --db-profile name -> pragmas set on every new sqlite connection
+SQLITE_PROFILES = {
+  'safe': [('journal_mode', 'WAL'),
+           ('synchronous', 'FULL'),
+           ('cache_size', -16384)],
+  'fast': [('journal_mode', 'WAL'),
+           ('synchronous', 'NORMAL'),
+           ('cache_size', -65536),
+           ('mmap_size', 268435456),
+           ('temp_store', 'MEMORY')],
+  # the run is kept in an in-memory database copied to the file by dump()
+  'memory-then-dump': [('journal_mode', 'MEMORY'),
+                       ('synchronous', 'OFF'),
+                       ('cache_size', -65536),
+                       ('temp_store', 'MEMORY')],
+}
+
+# in-memory engine -> database file it is dumped to
+the_dump_paths = weakref.WeakKeyDictionary()
+
+# in-memory engine -> {table name: (highest id in the file, ids of rows that
+# may still change)}, so dump() only copies new and changing rows
+the_dump_watermarks = weakref.WeakKeyDictionary()
+
+# table name -> SQL condition of the rows that are still updated after they
+# are inserted, rows of other tables are written once
+CHANGING_ROWS = {
+  'desired_result': "state NOT IN ('COMPLETE', 'ABORTED')",
+  'result': 'was_new_best IS NULL',
+  'tuning_run': "state IN ('QUEUED', 'RUNNING')",
+}
+
+
+def set_sqlite_pragmas(engine, pragmas):
+  """run PRAGMA name=value for each of pragmas on new connections of engine"""
+  def on_connect(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas:
+      cursor.execute('PRAGMA %s=%s' % (name, value))
+    cursor.close()
+  event.listen(engine, 'connect', on_connect)
+
+
+def copy_tables(engine, path, to_file, watermarks=None):
+  """
+  copy all rows between the in-memory database of engine and the sqlite
+  file at path (which must have the same tables) in one transaction.
+
+  watermarks (see the_dump_watermarks) is updated to the copied rows, and
+  if it has an entry for a table only the rows above its highest id and the
+  rows that could have changed since are copied.
+  """
+  connection = engine.raw_connection()
+  try:
+    cursor = connection.cursor()
+    cursor.execute('ATTACH DATABASE ? AS disk', (path,))
+    try:
+      if to_file:
+        src, dst = 'main', 'disk'
+      else:
+        src, dst = 'disk', 'main'
+      for table in Base.metadata.sorted_tables:
+        columns = ', '.join('"%s"' % c.name for c in table.columns)
+        if watermarks is not None and table.name in watermarks:
+          last_id, changing = watermarks[table.name]
+          where = 'id > %d' % last_id
+          if changing:
+            where += ' OR id IN (%s)' % ','.join(map(str, changing))
+          cursor.execute(
+            'INSERT OR REPLACE INTO %s."%s" (%s) SELECT %s FROM %s."%s" '
+            'WHERE %s' % (dst, table.name, columns, columns, src, table.name,
+                          where))
+        else:
+          cursor.execute('DELETE FROM %s."%s"' % (dst, table.name))
+          cursor.execute('INSERT INTO %s."%s" (%s) SELECT %s FROM %s."%s"' % (
+            dst, table.name, columns, columns, src, table.name))
+        if watermarks is not None:
+          cursor.execute('SELECT MAX(id) FROM %s."%s"' % (src, table.name))
+          last_id = cursor.fetchone()[0] or 0
+          changing = ()
+          if table.name in CHANGING_ROWS:
+            cursor.execute('SELECT id FROM %s."%s" WHERE %s' % (
+              src, table.name, CHANGING_ROWS[table.name]))
+            changing = [row[0] for row in cursor.fetchall()]
+          watermarks[table.name] = (last_id, changing)
+      connection.commit()
+    except:
+      connection.rollback()
+      if watermarks is not None:
+        watermarks.clear()
+      raise
+    finally:
+      cursor.execute('DETACH DATABASE disk')
+  finally:
+    connection.close()
+
+
+def dump(engine, full=False):
+  """
+  write an engine created by --db-profile=memory-then-dump to its database
+  file, a no-op for other engines.  Only new rows and rows that may have
+  changed are written unless full is set, which is needed after updating
+  or deleting other rows.  Call between session transactions.
+  """
+  path = the_dump_paths.get(engine)
+  if path is None:
+    return
+  watermarks = the_dump_watermarks.setdefault(engine, dict())
+  if full:
+    watermarks.clear()
+  t0 = time.time()
+  copy_tables(engine, path, to_file=True, watermarks=watermarks)
+  log.debug('dumped in-memory database to %s in %.3fs', path,
+            time.time() - t0)
+
+
+def connect_memory_then_dump(dbstr):
+  """
+  bring the sqlite file dbstr up to date, load it into an in-memory
+  database and return an engine for that which dump() writes back
+  """
+  file_engine, _ = connect(dbstr)
+  file_engine.dispose()
+  path = make_url(dbstr).database
+  # one connection shared by all threads, each new connection to sqlite://
+  # would be a separate empty database
+  engine = create_engine('sqlite://', echo=False, poolclass=StaticPool,
+                         connect_args={'check_same_thread': False})
+  set_sqlite_pragmas(engine, SQLITE_PROFILES['memory-then-dump'])
+  Base.metadata.create_all(engine)
+  watermarks = dict()
+  copy_tables(engine, path, to_file=False, watermarks=watermarks)
+  the_dump_paths[engine] = path
+  the_dump_watermarks[engine] = watermarks
+  return engine
+
+
+def create_profiled_engine(dbstr, profile):
+  url = make_url(dbstr)
+  if profile is None:
+    return create_engine(dbstr, echo = False)
+  if url.get_backend_name() != 'sqlite':
+    log.warning('--db-profile=%s only applies to sqlite, ignored', profile)
+    return create_engine(dbstr, echo = False)
+  if profile == 'memory-then-dump':
+    if not url.database or url.database == ':memory:':
+      raise Exception('--db-profile=memory-then-dump needs a database file')
+    return connect_memory_then_dump(dbstr)
+  # keep connections open (one per thread) rather than reconnecting and
+  # re-running the pragmas for every transaction
+  engine = create_engine(dbstr, echo = False, poolclass=SingletonThreadPool)
+  set_sqlite_pragmas(engine, SQLITE_PROFILES[profile])
+  return engine
+
+
+def connect(dbstr, profile=None):
+  engine = create_profiled_engine(dbstr, profile)
   connection = engine.connect()
 
   #handle case that the db was initialized before a version table existed yet
@@ -49,7 +282,7 @@ def connect(dbstr):
     Session = scoped_session(sessionmaker(autocommit=False,
                                           autoflush=False,
                                           bind=engine))
-    version = _Meta.get_version(Session)
+    version = migrate(engine, Session, _Meta.get_version(Session))
     if not DB_VERSION == version:
       raise Exception('Your opentuner database version {} is out of date with the current version {}'.format(version, DB_VERSION))
 
@@ -59,7 +292,7 @@ def connect(dbstr):
                                         autoflush=False,
                                         bind=engine))
   # mark database with current version
-  _Meta.add_version(Session, DB_VERSION)
+  _Meta.set_version(Session, DB_VERSION)
   Session.commit()
 
   return engine, Session
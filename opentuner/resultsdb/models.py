@@ -66,6 +66,15 @@ class _Meta(Base):
     if not cls.has_version(session, version):
       session.add(_Meta(db_version=version))
 
+  @classmethod
+  def set_version(cls, session, version):
+    session.flush()
+    meta = session.query(_Meta).first()
+    if meta is None:
+      session.add(_Meta(db_version=version))
+    else:
+      meta.db_version = version
+
 
 class Program(Base):
   project = Column(String(128))
@@ -119,11 +128,15 @@ class Configuration(Base):
   program = relationship(Program)
   hash = Column(String(64))
   data = Column(PickleType(pickler=CompressedPickler))
+  # the hash_config() digest from before database version 0.1, set until
+  # TuningRunMain rehashes the configuration
+  legacy_hash = Column(String(64))
 
   @classmethod
-  def get(cls, session, program, hashv, datav):
+  def get(cls, session, program, hashv, datav, flush=True):
     try:
-      session.flush()
+      if flush:
+        session.flush()
       return (session.query(Configuration)
               .filter_by(program=program, hash=hashv).one())
     except sqlalchemy.orm.exc.NoResultFound:
@@ -253,9 +266,36 @@ class Result(Base):
   accuracy = Column(Float)
   energy = Column(Float)
   size = Column(Float)
+  #half width of the confidence interval of time, for repeated measurements
   confidence = Column(Float)
   #extra = Column(PickleType)
 
+  #resource usage, see MeasurementInterface.call_program()
+  user_time = Column(Float)
+  system_time = Column(Float)
+  max_rss = Column(Float)
+  page_faults = Column(Integer)
+  context_switches = Column(Integer)
+
+  #set by MeasurementDriver when a measurement is repeated, time is the mean
+  time_stddev = Column(Float)
+  repeats = Column(Integer)
+  #repeats that failed or timed out after the OK ones, which are kept
+  failed_repeats = Column(Integer)
+
+  #set by DriftCorrectionPlugin, time is raw_time / drift_factor
+  raw_time = Column(Float)
+  drift_factor = Column(Float)
+
+  #set by MeasurementDriver for --reuse-results, the Result of an earlier
+  #tuning run this one was copied from instead of measuring
+  reused_from_id = Column(ForeignKey('result.id'))
+  reused_from = relationship('Result', remote_side='Result.id')
+
+  #set by MeasurementDriver from DesiredResult.fidelity, None for the full
+  #input.  Only full input Results are compared with each other.
+  fidelity = Column(Integer)
+
   #set by SearchDriver
   was_new_best = Column(Boolean)
 
@@ -268,6 +308,8 @@ class DesiredResult(Base):
   configuration_id = Column(ForeignKey(Configuration.id))
   configuration = relationship(Configuration)
   limit = Column(Float)
+  #rung of the InputManager's input ladder, None for the full input
+  fidelity = Column(Integer)
 
   #set by the search driver
   priority = Column(Float)
@@ -312,6 +354,25 @@ class BanditSubTechnique(Base):
   name = Column(String(128))
 
 
+# statistics of a bandit sub-technique, recorded every --bandit-stats-interval
+# tests and at the end of the tuning run
+class BanditArmStats(Base):
+  bandit_sub_technique_id = Column(ForeignKey(BanditSubTechnique.id),
+                                   index=True)
+  bandit_sub_technique = relationship(BanditSubTechnique, backref='stats')
+  # SearchDriver.test_count when recorded
+  test_count = Column(Integer)
+  collection_date = Column(DateTime, default=func.now())
+  # results in the bandit window, and requests without a result yet
+  # (--batch-bandit only)
+  uses = Column(Integer)
+  pending = Column(Integer)
+  exploitation = Column(Float)
+  exploration = Column(Float)
+  # mean Result.collection_cost in the window (--batch-bandit only)
+  mean_cost = Column(Float)
+
+
 if __name__ == '__main__':
   #test:
   engine = create_engine('sqlite:///:memory:', echo=True)
@@ -0,0 +1,149 @@
+import abc
+import argparse
+import logging
+import time
+
+from sqlalchemy import event
+
+from opentuner.resultsdb.models import Result
+
+log = logging.getLogger(__name__)
+
+argparser = argparse.ArgumentParser(add_help=False)
+argparser.add_argument('--commit-every-seconds', type=float, default=30.0,
+                       metavar='SECONDS',
+                       help='commit results to the database at least this often')
+argparser.add_argument('--commit-every-results', type=int, metavar='COUNT',
+                       help='also commit after this many new results')
+argparser.add_argument('--commit-every-rows', type=int, metavar='COUNT',
+                       help='also commit once this many new rows are pending')
+
+
+class WriteStats(object):
+  """
+  counters for the writes made by a session, kept up to date by session
+  events
+  """
+
+  def __init__(self, session):
+    self.rows_written = 0
+    self.flushes = 0
+    self.flush_seconds = 0.0
+    self.max_flush_seconds = 0.0
+    self.commits = 0
+    self.commit_seconds = 0.0
+    # reset on every commit
+    self.pending_rows = 0
+    self.pending_results = 0
+    self.last_commit_time = time.time()
+
+    self._flush_start = None
+    self._commit_start = None
+    event.listen(session, 'after_attach', self.after_attach)
+    event.listen(session, 'before_flush', self.before_flush)
+    event.listen(session, 'after_flush_postexec', self.after_flush_postexec)
+    event.listen(session, 'before_commit', self.before_commit)
+    event.listen(session, 'after_commit', self.after_commit)
+
+  def after_attach(self, session, instance):
+    self.pending_rows += 1
+    if isinstance(instance, Result):
+      self.pending_results += 1
+
+  def before_flush(self, session, flush_context, instances):
+    self._flush_start = time.time()
+    self.rows_written += (len(session.new) + len(session.dirty) +
+                          len(session.deleted))
+
+  def after_flush_postexec(self, session, flush_context):
+    if self._flush_start is None:
+      return
+    elapsed = time.time() - self._flush_start
+    self._flush_start = None
+    self.flushes += 1
+    self.flush_seconds += elapsed
+    self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+
+  def before_commit(self, session):
+    self._commit_start = time.time()
+
+  def after_commit(self, session):
+    now = time.time()
+    if self._commit_start is not None:
+      self.commit_seconds += now - self._commit_start
+      self._commit_start = None
+    self.commits += 1
+    self.pending_rows = 0
+    self.pending_results = 0
+    self.last_commit_time = now
+
+  def summary(self):
+    return ('%d rows written in %d flushes (%.3fs total, %.3fs max) '
+            'and %d commits (%.3fs total)' % (
+              self.rows_written, self.flushes, self.flush_seconds,
+              self.max_flush_seconds, self.commits, self.commit_seconds))
+
+
+class CommitPolicy(object):
+  """
+  decides when TuningRunMain.commit() writes to the database, between
+  commits new objects stay in the session (write-behind)
+  """
+  __metaclass__ = abc.ABCMeta
+
+  @abc.abstractmethod
+  def should_commit(self, stats):
+    """True if the session should be committed now, given WriteStats"""
+    return True
+
+
+class TimeCommitPolicy(CommitPolicy):
+  """commit when the last commit is older than seconds"""
+
+  def __init__(self, seconds):
+    self.seconds = seconds
+
+  def should_commit(self, stats):
+    return time.time() - stats.last_commit_time > self.seconds
+
+
+class ResultCountCommitPolicy(CommitPolicy):
+  """commit once count new Results are pending"""
+
+  def __init__(self, count):
+    self.count = count
+
+  def should_commit(self, stats):
+    return stats.pending_results >= self.count
+
+
+class RowCountCommitPolicy(CommitPolicy):
+  """commit once count new objects of any kind are pending"""
+
+  def __init__(self, count):
+    self.count = count
+
+  def should_commit(self, stats):
+    return stats.pending_rows >= self.count
+
+
+class AnyCommitPolicy(CommitPolicy):
+  """commit when any of policies would"""
+
+  def __init__(self, policies):
+    self.policies = list(policies)
+
+  def should_commit(self, stats):
+    return any(p.should_commit(stats) for p in self.policies)
+
+
+def commit_policy_from_args(args):
+  """the CommitPolicy selected by the --commit-every-* arguments"""
+  policies = [TimeCommitPolicy(args.commit_every_seconds)]
+  if args.commit_every_results:
+    policies.append(ResultCountCommitPolicy(args.commit_every_results))
+  if args.commit_every_rows:
+    policies.append(RowCountCommitPolicy(args.commit_every_rows))
+  if len(policies) == 1:
+    return policies[0]
+  return AnyCommitPolicy(policies)
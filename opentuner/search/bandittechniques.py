@@ -73,6 +73,13 @@ class BanditQueue(object):
   def on_pop_history(self, key, value):
     self.use_counts[key] -= 1
 
+  def arm_stats(self, key):
+    """statistics of key stored in BanditArmStats"""
+    exploration = self.exploration_term(key)
+    return {'uses': self.use_counts[key],
+            'exploitation': self.exploitation_term(key),
+            'exploration': exploration if exploration < float('inf') else None}
+
 
 class AUCBanditQueue(BanditQueue):
   """
@@ -141,23 +148,110 @@ class AUCBanditQueue(BanditQueue):
       self.auc_decay[key] -= 1
 
 
+class BatchAUCBanditQueue(AUCBanditQueue):
+  """
+  AUCBanditQueue for many tests in flight (see --batch-bandit).  Requests
+  still pending count as uses without credit, so the requests of a
+  generation are spread over the keys instead of all going to the best
+  one before any results arrive.  Credit is scaled by how cheap the tests
+  of a key are compared to the average (Result.collection_cost), which
+  makes it credit per second of measurement rather than per test.
+  """
+
+  def __init__(self, *args, **kwargs):
+    super(BatchAUCBanditQueue, self).__init__(*args, **kwargs)
+    self.pending = dict(((k, 0) for k in self.keys))
+    self.costs = deque()
+    self.cost_sum = dict(((k, 0.0) for k in self.keys))
+    self.cost_count = dict(((k, 0) for k in self.keys))
+
+  def on_request(self, key):
+    self.pending[key] += 1
+
+  def cost_ratio(self, key):
+    """average cost of all tests over the average cost of tests of key"""
+    total = sum(self.cost_sum.itervalues())
+    count = sum(self.cost_count.itervalues())
+    if not self.cost_count[key] or not self.cost_sum[key] or not total:
+      return 1.0
+    return ((total / count) /
+            (self.cost_sum[key] / self.cost_count[key]))
+
+  def exploitation_term(self, key):
+    uses = self.use_counts[key] + self.pending[key]
+    if not uses:
+      return 0.0
+    return (self.auc_sum[key] * 2.0 / (uses * (uses + 1.0)) *
+            self.cost_ratio(key))
+
+  def exploration_term(self, key):
+    uses = self.use_counts[key] + self.pending[key]
+    if uses > 0:
+      total = len(self.history) + sum(self.pending.itervalues())
+      return math.sqrt((2.0 * math.log(total, 2.0)) / uses)
+    else:
+      return float('inf')
+
+  def on_result(self, key, value, cost=None):
+    self.pending[key] = max(0, self.pending[key] - 1)
+    super(BatchAUCBanditQueue, self).on_result(key, value)
+    # reused Results cost nothing and say nothing about the cost of key
+    if cost:
+      self.costs.append((key, cost))
+      self.cost_sum[key] += cost
+      self.cost_count[key] += 1
+      if len(self.costs) > self.window:
+        key, cost = self.costs.popleft()
+        self.cost_sum[key] -= cost
+        self.cost_count[key] -= 1
+
+  def on_no_request(self, key):
+    """key was asked for a test but did not request one"""
+    super(BatchAUCBanditQueue, self).on_result(key, 0)
+
+  def arm_stats(self, key):
+    stats = super(BatchAUCBanditQueue, self).arm_stats(key)
+    stats['pending'] = self.pending[key]
+    if self.cost_count[key]:
+      stats['mean_cost'] = self.cost_sum[key] / self.cost_count[key]
+    return stats
+
 
 class AUCBanditMetaTechnique(MetaSearchTechnique):
   def __init__(self, techniques, bandit_kwargs=dict(), **kwargs):
     super(AUCBanditMetaTechnique, self).__init__(techniques, **kwargs)
     self.bandit = AUCBanditQueue([t.name for t in techniques], **bandit_kwargs)
+    self.bandit_kwargs = bandit_kwargs
     self.name_to_technique = dict(((t.name, t) for t in self.techniques))
 
+  def set_driver(self, driver):
+    super(AUCBanditMetaTechnique, self).set_driver(driver)
+    if (getattr(driver.args, 'batch_bandit', False) and
+            not isinstance(self.bandit, BatchAUCBanditQueue)):
+      self.bandit = BatchAUCBanditQueue(self.bandit.keys,
+                                        **self.bandit_kwargs)
+
+  def on_technique_desired_result(self, technique, desired_result):
+    if isinstance(self.bandit, BatchAUCBanditQueue):
+      self.bandit.on_request(technique.name)
+
   def select_technique_order(self):
     """select the next technique to use"""
     return (self.name_to_technique[k] for k in self.bandit.ordered_keys())
 
   def on_technique_result(self, technique, result):
-    self.bandit.on_result(technique.name, result.was_new_best)
+    if isinstance(self.bandit, BatchAUCBanditQueue):
+      self.bandit.on_result(technique.name, result.was_new_best,
+                            result.collection_cost)
+    else:
+      self.bandit.on_result(technique.name, result.was_new_best)
 
   def on_technique_no_desired_result(self, technique):
     """treat not providing a configuration as not a best"""
-    self.bandit.on_result(technique.name, 0)
+    if isinstance(self.bandit, BatchAUCBanditQueue):
+      self.bandit.on_no_request(technique.name)
+    else:
+      self.bandit.on_result(technique.name, 0)
 
   @classmethod
   def generate_technique(cls, manipulator=None, num_techniques=5, retry_count=3, generator_weight=10, *args, **kwargs):
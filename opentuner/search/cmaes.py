@@ -0,0 +1,198 @@
+import logging
+import math
+import random
+
+import numpy
+
+from opentuner.search import technique
+
+log = logging.getLogger(__name__)
+
+
+class CMAES(technique.SearchTechnique):
+  """
+  covariance matrix adaptation evolution strategy over the unit vector of
+  the PrimitiveParameters (see ConfigurationManipulator.unit_parameters()).
+  Each generation a whole population is sampled and requested at once,
+  integer and log scaled parameters are handled by set_unit_value().  The
+  other parameters are copied from the best configuration found so far.
+
+  When the search stagnates or the step size collapses it restarts from a
+  random point, with a population twice as large for restarts='ipop', or
+  alternating that with small populations and step sizes for
+  restarts='bipop' (Hansen, "Benchmarking a BI-Population CMA-ES", 2009).
+  """
+
+  def __init__(self, sigma0=0.3, restarts='bipop', popsize=None,
+               *pargs, **kwargs):
+    super(CMAES, self).__init__(*pargs, **kwargs)
+    self.sigma0 = sigma0
+    self.restarts = restarts
+    self.popsize = popsize
+    self.n = None
+    self.default_popsize = None
+    self.large_popsize = None
+    # evaluations used by the large and small population regimes of BIPOP
+    self.budget = {'large': 0, 'small': 0}
+    self.regime = 'large'
+    self.restart_count = 0
+    self.population = None
+
+  @classmethod
+  def get_hyper_parameters(cls):
+    return ['sigma0', 'restarts', 'popsize']
+
+  def desired_configuration(self):
+    if self.n is None:
+      self.n = len(self.manipulator.unit_parameters())
+      if self.n == 0:
+        return None
+      self.default_popsize = (self.popsize or
+                              4 + int(3 * math.log(self.n)))
+      self.large_popsize = self.default_popsize
+      self.start(self.default_popsize, self.sigma0)
+      self.sample()
+    if self.n == 0:
+      return None
+    if not self.queue:
+      if len(self.results) < len(self.population):
+        # waiting for the rest of the generation
+        return False
+      self.update()
+      self.sample()
+    return self.queue.pop()
+
+  def start(self, popsize, sigma):
+    """(re)start the strategy from a random mean"""
+    n = self.n
+    self.lam = popsize
+    self.mu = popsize // 2
+    weights = (math.log(self.mu + 0.5) -
+               numpy.log(numpy.arange(1, self.mu + 1)))
+    self.weights = weights / weights.sum()
+    self.mueff = 1.0 / (self.weights ** 2).sum()
+    self.cc = (4.0 + self.mueff / n) / (n + 4.0 + 2.0 * self.mueff / n)
+    self.cs = (self.mueff + 2.0) / (n + self.mueff + 5.0)
+    self.c1 = 2.0 / ((n + 1.3) ** 2 + self.mueff)
+    self.cmu = min(1.0 - self.c1,
+                   2.0 * (self.mueff - 2.0 + 1.0 / self.mueff) /
+                   ((n + 2.0) ** 2 + self.mueff))
+    self.damps = (1.0 + 2.0 * max(0.0, math.sqrt((self.mueff - 1.0) /
+                                                 (n + 1.0)) - 1.0) + self.cs)
+    self.chi_n = math.sqrt(n) * (1.0 - 1.0 / (4.0 * n) + 1.0 / (21.0 * n * n))
+
+    self.mean = numpy.random.random_sample(n)
+    self.sigma = sigma
+    self.pc = numpy.zeros(n)
+    self.ps = numpy.zeros(n)
+    self.B = numpy.eye(n)
+    self.D = numpy.ones(n)
+    self.C = numpy.eye(n)
+    self.generation = 0
+    self.best = None
+    self.stagnant_generations = 0
+
+  def sample(self):
+    """request a new population"""
+    z = numpy.random.standard_normal((self.lam, self.n))
+    samples = self.mean + self.sigma * (z * self.D).dot(self.B.T)
+    # repair to the unit cube, the strategy learns from the repaired points
+    self.population = numpy.clip(samples, 0.0, 1.0)
+    best = self.driver.best_result
+    base = (best.configuration.data if best is not None
+            else self.manipulator.seed_config())
+    cfgs = self.manipulator.configs_from_batch(self.population,
+                                               [base] * self.lam)
+    # configuration hash -> indexes of population, several samples can map
+    # to the same configuration for integer parameters
+    self.pending = dict()
+    self.queue = list()
+    for i, cfg in enumerate(cfgs):
+      config = self.driver.get_configuration(cfg)
+      if config.hash not in self.pending:
+        self.queue.append(config)
+      self.pending.setdefault(config.hash, []).append(i)
+    self.queue.reverse()
+    self.results = dict()
+
+  def handle_requested_result(self, result):
+    for i in self.pending.pop(result.configuration.hash, []):
+      self.results[i] = result
+
+  def update(self):
+    """adapt the distribution to the finished generation"""
+    n = self.n
+    order = sorted(xrange(self.lam), key=self.results.__getitem__,
+                   cmp=self.objective.result_compare)
+    self.budget[self.regime] += self.lam
+    self.generation += 1
+    best = self.results[order[0]]
+    if self.best is None or self.objective.lt(best, self.best):
+      self.best = best
+      self.stagnant_generations = 0
+    else:
+      self.stagnant_generations += 1
+
+    selected = self.population[order[:self.mu]]
+    old_mean = self.mean
+    self.mean = self.weights.dot(selected)
+    step = (self.mean - old_mean) / self.sigma
+    invsqrt_c = (self.B / self.D).dot(self.B.T)
+    self.ps = ((1.0 - self.cs) * self.ps +
+               math.sqrt(self.cs * (2.0 - self.cs) * self.mueff) *
+               invsqrt_c.dot(step))
+    ps_norm = numpy.linalg.norm(self.ps)
+    hsig = (ps_norm / math.sqrt(1.0 - (1.0 - self.cs) **
+                                (2 * self.generation)) / self.chi_n
+            < 1.4 + 2.0 / (n + 1.0))
+    self.pc = ((1.0 - self.cc) * self.pc +
+               hsig * math.sqrt(self.cc * (2.0 - self.cc) * self.mueff) * step)
+    y = (selected - old_mean) / self.sigma
+    self.C = ((1.0 - self.c1 - self.cmu) * self.C +
+              self.c1 * (numpy.outer(self.pc, self.pc) +
+                         (1 - hsig) * self.cc * (2.0 - self.cc) * self.C) +
+              self.cmu * (y.T * self.weights).dot(y))
+    self.sigma *= math.exp((self.cs / self.damps) *
+                           (ps_norm / self.chi_n - 1.0))
+
+    self.C = numpy.triu(self.C) + numpy.triu(self.C, 1).T
+    eigenvalues, self.B = numpy.linalg.eigh(self.C)
+    self.D = numpy.sqrt(numpy.maximum(eigenvalues, 1e-20))
+
+    if self.should_restart():
+      self.restart()
+
+  def should_restart(self):
+    """step size collapsed, ill conditioned or no progress for a while"""
+    return (self.sigma * self.D.max() < 1e-8 or
+            self.D.max() > 1e7 * self.D.min() or
+            self.stagnant_generations > 10 + int(30.0 * self.n / self.lam))
+
+  def restart(self):
+    self.restart_count += 1
+    sigma = self.sigma0
+    if self.restarts == 'ipop':
+      self.large_popsize *= 2
+      popsize = self.large_popsize
+    elif self.restarts == 'bipop':
+      # run the regime that has used fewer evaluations so far
+      if self.budget['large'] <= self.budget['small']:
+        self.regime = 'large'
+        self.large_popsize *= 2
+        popsize = self.large_popsize
+      else:
+        self.regime = 'small'
+        u = random.random()
+        popsize = int(self.default_popsize *
+                      (0.5 * self.large_popsize / self.default_popsize)
+                      ** (u * u))
+        sigma = self.sigma0 * 10 ** (-2 * random.random())
+    else:
+      popsize = self.default_popsize
+    log.debug('%s: restart %d with population %d sigma %.3g', self.name,
+              self.restart_count, popsize, sigma)
+    self.start(max(popsize, 2), sigma)
+
+
+technique.register(CMAES())
+technique.register(CMAES(restarts='ipop', name='IPOPCMAES'))
@@ -1,7 +1,9 @@
 import random
 import time
 import logging
+import numpy
 from fn import _
+from manipulator import ConfigurationManipulator
 from technique import register
 from technique import SearchTechnique
 
@@ -31,6 +33,7 @@ class DifferentialEvolution(SearchTechnique):
                n_cross=1,  # force at least 1 to crossover
                information_sharing=1,  # number token sharing pop members
                duplicate_retries=5,  # how many times to retry on duplicate
+               vectorized=False,  # cross PrimitiveParameters as unit vectors
                *pargs, **kwargs):
 
     self.population_size = population_size
@@ -40,6 +43,7 @@ class DifferentialEvolution(SearchTechnique):
     self.population = None
     self.duplicate_retries = duplicate_retries
     self.limit = None
+    self.vectorized = vectorized
     super(DifferentialEvolution, self).__init__(*pargs, **kwargs)
 
   @classmethod
@@ -114,6 +118,10 @@ class DifferentialEvolution(SearchTechnique):
 
     use_f = random.random() / 2.0 + 0.5
 
+    if self.vectorized and isinstance(self.manipulator,
+                                      ConfigurationManipulator):
+      return self.vector_crossover(cfg, x1, x2, x3, use_f)
+
     params = self.manipulator.param_names(cfg, x1, x2, x3)
     random.shuffle(params)
     for i, k in enumerate(params):
@@ -123,6 +131,27 @@ class DifferentialEvolution(SearchTechnique):
 
     return cfg
 
+  def vector_crossover(self, cfg, x1, x2, x3, use_f):
+    """
+    create_new_configuration with the PrimitiveParameters crossed over as
+    rows of a unit-value batch, ComplexParameters still use op4_set_linear
+    """
+    m = self.manipulator
+    unit_params = m.unit_parameters()
+    other_params = [p for p in m.params if not p.is_primitive()]
+    n = len(unit_params) + len(other_params)
+    cross = numpy.random.random_sample(n) < self.cr
+    cross[numpy.random.permutation(n)[:self.n_cross]] = True
+
+    parent, u1, u2, u3 = m.unit_batch([cfg, x1, x2, x3])
+    trial = m.linear_batch(1.0, u1, use_f, u2, -use_f, u3)
+    m.set_unit_vector(cfg, numpy.where(cross[:len(unit_params)],
+                                       trial, parent))
+    for p, crossed in zip(other_params, cross[len(unit_params):]):
+      if crossed:
+        p.op4_set_linear(cfg, x1, x2, x3, 1.0, use_f, -use_f)
+    return cfg
+
   def handle_requested_result(self, result):
     """called when new results are added"""
     for p in self.population:
@@ -144,5 +173,7 @@ register(DifferentialEvolution())
 register(DifferentialEvolutionAlt())
 register(DifferentialEvolution(population_size=100, cr=0.2,
                                name='DifferentialEvolution_20_100'))
+register(DifferentialEvolution(vectorized=True,
+                               name='DifferentialEvolutionVector'))
 
 
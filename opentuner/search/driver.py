@@ -2,6 +2,7 @@ import argparse
 import copy
 import logging
 import os
+import random
 import sys
 
 from datetime import datetime
@@ -10,11 +11,14 @@ from opentuner.driverbase import DriverBase
 from opentuner.resultsdb.models import Configuration
 from opentuner.resultsdb.models import DesiredResult
 from opentuner.resultsdb.models import Result
+from opentuner.resultsdb.models import BanditArmStats
 from opentuner.resultsdb.models import BanditInfo
 from opentuner.resultsdb.models import BanditSubTechnique
 from opentuner.search import plugin
+from opentuner.search.plugin import FailurePredictor
 from opentuner.search import technique
 from opentuner.search.bandittechniques import AUCBanditMetaTechnique
+from opentuner.search.surrogate import SurrogatePredictor
 
 log = logging.getLogger(__name__)
 
@@ -27,6 +31,33 @@ argparser.add_argument('--parallelism', type=int, default=4,
                        help='how many tests to support at once')
 argparser.add_argument('--pipelining', type=int, default=0,
                        help='how long a delay (in generations) before results are available')
+argparser.add_argument('--async-search', action='store_true',
+                       help=('keep --parallelism tests in flight, requesting '
+                             'a new test as soon as any test finishes instead '
+                             'of waiting for whole generations (use with '
+                             '--parallel-measurement or '
+                             '--distributed-measurement)'))
+argparser.add_argument('--prescreen-factor', type=int, default=1, metavar='K',
+                       help=('request K times more new tests than there are '
+                             'to run and only run the ones a model trained '
+                             'on the results so far predicts to be best, the '
+                             'others are given to their technique as failed'))
+argparser.add_argument('--failure-threshold', type=float, metavar='P',
+                       help=('learn the probability that a configuration '
+                             'fails (ERROR or TIMEOUT) from the results so '
+                             'far, do not run tests predicted to fail with '
+                             'probability above P and run the others most '
+                             'likely to succeed first'))
+argparser.add_argument('--failure-explore', type=float, default=0.05,
+                       metavar='FRACTION',
+                       help=('with --failure-threshold, run this fraction of '
+                             'the tests predicted to fail anyway so wrong '
+                             'predictions are corrected'))
+argparser.add_argument('--bandit-stats-interval', type=int, default=50,
+                       metavar='TESTS',
+                       help=('store the statistics of each technique of a '
+                             'bandit root technique every TESTS tests '
+                             '(table bandit_arm_stats), 0 to disable'))
 argparser.add_argument('--bail-threshold', type=int, default=500,
                        help='abort if no requests have been made in X generations')
 argparser.add_argument('--no-dups', action='store_true',
@@ -70,6 +101,9 @@ class SearchDriver(DriverBase):
     else:
       self.root_technique = copy.deepcopy(technique.get_root(self.args))
 
+    # sub-technique name -> BanditSubTechnique, for record_bandit_stats()
+    self.bandit_subtechniques = dict()
+    self.next_bandit_stats = self.args.bandit_stats_interval
     if isinstance(self.root_technique, AUCBanditMetaTechnique):
       self.session.flush()
       info = BanditInfo(tuning_run=self.tuning_run,
@@ -80,11 +114,20 @@ class SearchDriver(DriverBase):
         subtechnique = BanditSubTechnique(bandit_info=info,
                                           name=t.name)
         self.session.add(subtechnique)
+        self.bandit_subtechniques[t.name] = subtechnique
 
 
     self.objective.set_driver(self)
     self.pending_config_ids = set()
     self.best_result = None
+    # configuration hash -> Configuration, for get_configuration()
+    self.configurations = dict()
+    # configuration hash -> first DesiredResult requested for it
+    self.requested_configurations = dict()
+    # Configuration -> failed stand-in Result given to the requestors of a
+    # configuration rejected without testing, kept out of result_index
+    self.rejected_results = dict()
+    self.seed_requested_configurations()
 
     for t in self.plugins:
       t.set_driver(self)
@@ -98,6 +141,24 @@ class SearchDriver(DriverBase):
 
     self.plugins.sort(key=_.priority)
 
+    self.failure_predictor = None
+    if self.args.failure_threshold is not None:
+      self.failure_predictor = FailurePredictor(self.args.failure_threshold)
+      self.add_plugin(self.failure_predictor)
+
+    self.predictor = None
+    if self.args.prescreen_factor > 1:
+      self.predictor = self.prescreen_predictor()
+      self.predictor.set_driver(self)
+
+  def prescreen_predictor(self):
+    """
+    the model used by --prescreen-factor, an object with set_driver(driver)
+    and score(list of cfg) returning a score for each cfg (lower is better)
+    or None if it cannot predict yet
+    """
+    return SurrogatePredictor()
+
   def add_plugin(self, p):
     if p in self.plugins:
       return
@@ -129,9 +190,12 @@ class SearchDriver(DriverBase):
       if dr.result is not None:
         callback(dr.result)
         continue
+      elif dr.state in ('REQUESTED', 'RUNNING'):
+        # still being measured
+        pass
       elif self.generation - dr.generation > self.args.pipelining:
         # see if we can find a result
-        results = self.results_query(config=dr.configuration).all()
+        results = self.result_index.results(dr.configuration)
         log.warning("Result callback %d (requestor=%s) pending for "
                     "%d generations %d results available",
                     dr.id, dr.requestor, self.generation - dr.generation,
@@ -144,12 +208,49 @@ class SearchDriver(DriverBase):
       self.pending_result_callbacks.append((dr, callback))
 
   def has_results(self, config):
-    return self.results_query(config=config).count() > 0
+    return (self.result_index.has_results(config) or
+            config in self.rejected_results)
+
+  def config_best_result(self, config):
+    """the best Result of config, or its stand-in if it was rejected"""
+    best = self.result_index.best(config)
+    if best is None:
+      return self.rejected_results.get(config)
+    return best
 
-  def run_generation_techniques(self):
+  def seed_requested_configurations(self):
+    """
+    load the DesiredResults already requested in this tuning run (when
+    resuming) into the in-memory duplicate detection table
+    """
+    if self.tuning_run.id is None:
+      return
+    q = (self.session.query(DesiredResult, Configuration.hash)
+         .join(Configuration)
+         .filter(DesiredResult.tuning_run_id == self.tuning_run.id)
+         .filter(DesiredResult.state != 'ABORTED')
+         .order_by(DesiredResult.request_date))
+    for dr, hashv in q:
+      self.configurations.setdefault(hashv, dr.configuration)
+      self.requested_configurations.setdefault(
+        self.request_key(hashv, dr.fidelity), dr)
+
+  @staticmethod
+  def request_key(hashv, fidelity):
+    """key of requested_configurations, a configuration at a fidelity"""
+    if fidelity is None:
+      return hashv
+    return hashv, fidelity
+
+  def run_generation_techniques(self, count=None):
+    """request up to count (default: --parallelism) tests"""
+    if count is None:
+      count = self.args.parallelism
     tests_this_generation = 0
+    requested = list()
     self.plugin_proxy.before_techniques()
-    for z in xrange(self.args.parallelism):
+    candidates = list()
+    for z in xrange(count * self.args.prescreen_factor):
       if self.seed_cfgs:
         config = self.get_configuration(self.seed_cfgs.pop())
         dr = DesiredResult(configuration=config,
@@ -162,43 +263,141 @@ class SearchDriver(DriverBase):
       if dr is None or dr is False:
         log.debug("no desired result, skipping to testing phase")
         break
-      self.session.flush()  # populate configuration_id
-      duplicates = (self.session.query(DesiredResult)
-                    .filter_by(tuning_run=self.tuning_run,
-                               configuration_id=dr.configuration_id)
-                    .filter(DesiredResult.id != dr.id)
-                    .order_by(DesiredResult.request_date)
-                    .limit(1).all())
+      candidates.append(dr)
+    if self.failure_predictor is not None:
+      candidates = self.screen_failures(candidates)
+    if self.predictor is not None:
+      candidates = self.prescreen(candidates, count)
+    for dr in candidates:
       self.session.add(dr)
-      if len(duplicates):
+      key = self.request_key(dr.configuration.hash, dr.fidelity)
+      duplicate = self.requested_configurations.get(key)
+      if duplicate is not None:
         if not self.args.no_dups:
           log.warning("duplicate configuration request #%d %s/%s %s",
                       self.test_count,
                       dr.requestor,
-                      duplicates[0].requestor,
-                      'OLD' if duplicates[0].result else 'PENDING')
-        self.session.flush()
-        desired_result_id = dr.id
+                      duplicate.requestor,
+                      'OLD' if duplicate.result else 'PENDING')
 
-        def callback(result):
-          dr = self.session.query(DesiredResult).get(desired_result_id)
+        def callback(result, dr=dr):
           dr.result = result
           dr.state = 'COMPLETE'
           dr.start_date = datetime.now()
 
-        self.register_result_callback(duplicates[0], callback)
+        self.register_result_callback(duplicate, callback)
       else:
-        log.debug("desired result id=%d, cfg=%d", dr.id, dr.configuration_id)
+        self.requested_configurations[key] = dr
         dr.state = 'REQUESTED'
+        requested.append(dr)
       self.test_count += 1
       tests_this_generation += 1
+    self.session.flush()
+    for dr in requested:
+      log.debug("desired result id=%d, cfg=%d", dr.id, dr.configuration_id)
     self.plugin_proxy.after_techniques()
     return tests_this_generation
 
+  def failure_probability(self, cfg):
+    """
+    predicted probability that cfg fails (see --failure-threshold), None if
+    not predicted
+    """
+    if self.failure_predictor is None:
+      return None
+    return self.failure_predictor.probability(cfg)
+
+  def is_new_request(self, dr):
+    """dr is not a seed and is not a duplicate of an earlier request"""
+    return (dr.requestor != 'seed' and
+            self.request_key(dr.configuration.hash, dr.fidelity)
+            not in self.requested_configurations)
+
+  def screen_failures(self, candidates):
+    """
+    reject the new candidate DesiredResults likely to fail (but for a
+    --failure-explore fraction of them) and prioritize the others by their
+    probability of succeeding
+    """
+    rv = list()
+    for dr in candidates:
+      if self.is_new_request(dr):
+        p = self.failure_probability(dr.configuration.data)
+        if p is not None:
+          if p > self.args.failure_threshold:
+            if random.random() >= self.args.failure_explore:
+              log.debug("rejected request predicted to fail (p=%.2f)", p)
+              self.reject_desired_result(dr)
+              self.failure_predictor.rejected += 1
+              continue
+            self.failure_predictor.explored += 1
+          dr.priority = 1.0 - p
+      rv.append(dr)
+    return rv
+
+  def prescreen(self, candidates, count):
+    """
+    the candidate DesiredResults to request: seeds, duplicates and the count
+    (less the seeds) new ones self.predictor scores best, in their original
+    order.  The others are rejected.
+    """
+    new = filter(self.is_new_request, candidates)
+    keep = max(0, count - sum(1 for dr in candidates
+                              if dr.requestor == 'seed'))
+    if len(new) <= keep:
+      return candidates
+    scores = self.predictor.score([dr.configuration.data for dr in new])
+    order = range(len(new))
+    if scores is not None:
+      order = sorted(order, key=scores.__getitem__)
+    accepted = set(self.request_key(new[i].configuration.hash,
+                                    new[i].fidelity) for i in order[:keep])
+    # candidates repeating an accepted one are kept as its duplicates
+    rejected = [new[i] for i in order[keep:]
+                if self.request_key(new[i].configuration.hash,
+                                    new[i].fidelity) not in accepted]
+    log.debug("prescreen rejected %d of %d candidates", len(rejected),
+              len(candidates))
+    rejected_ids = set(map(id, rejected))
+    for dr in rejected:
+      self.reject_desired_result(dr)
+    return [dr for dr in candidates if id(dr) not in rejected_ids]
+
+  def reject_desired_result(self, desired_result):
+    """
+    abort desired_result without testing it, its requestor is given a
+    failed Result that is not stored in the database or indexed
+    """
+    desired_result.state = 'ABORTED'
+    config = desired_result.configuration
+    result = self.rejected_results.get(config)
+    if result is None:
+      result = Result(configuration=config, state='ERROR',
+                      time=float('inf'), was_new_best=False)
+      # so techniques waiting for results or comparing configurations see it
+      self.rejected_results[config] = result
+    pending = self.pending_result_callbacks
+    self.pending_result_callbacks = list()
+    for dr, callback in pending:
+      if dr is desired_result:
+        callback(result)
+      else:
+        self.pending_result_callbacks.append((dr, callback))
+
   def process_new_results(self):
+    # write the Results reported since the last commit so they are queried
+    self.session.flush()
     for result in (self.results_query()
                        .filter_by(was_new_best=None)
                        .order_by(Result.collection_date)):
+      if result.fidelity is not None:
+        # only given to the technique that requested it
+        result.was_new_best = False
+        continue
+      if not self.result_index.contains(result):
+        # measured by another process
+        self.prepare_result(result)
+      self.result_index.add(result)
       self.plugin_proxy.on_result(result)
       if self.best_result is None:
         self.best_result = result
@@ -210,6 +409,29 @@ class SearchDriver(DriverBase):
       else:
         result.was_new_best = False
     self.result_callbacks()
+    if (self.args.bandit_stats_interval and
+            self.test_count >= self.next_bandit_stats):
+      self.next_bandit_stats = (self.test_count +
+                                self.args.bandit_stats_interval)
+      self.record_bandit_stats()
+
+  def prepare_result(self, result):
+    """
+    let the plugins adjust a new Result before it is indexed and compared,
+    MeasurementDriver calls this for the Results it reports
+    """
+    if result.fidelity is None:
+      self.plugin_proxy.before_result(result)
+
+  def record_bandit_stats(self):
+    """store the BanditArmStats of each technique of a bandit root_technique"""
+    if not self.bandit_subtechniques:
+      return
+    bandit = self.root_technique.bandit
+    for name, subtechnique in self.bandit_subtechniques.iteritems():
+      self.session.add(BanditArmStats(bandit_sub_technique=subtechnique,
+                                      test_count=self.test_count,
+                                      **bandit.arm_stats(name)))
 
   def run_generation_results(self, offset=0):
     self.commit()
@@ -241,13 +463,25 @@ class SearchDriver(DriverBase):
     """called by SearchTechniques to create Configuration objects"""
     self.manipulator.normalize(cfg)
     hashv = self.manipulator.hash_config(cfg)
-    config = Configuration.get(self.session,self.program, hashv, cfg)
+    config = self.configurations.get(hashv)
+    if config is None:
+      # every Configuration created in this run is in self.configurations, so
+      # only previously flushed ones need to be looked up
+      config = Configuration.get(self.session, self.program, hashv, cfg,
+                                 flush=False)
+      self.configurations[hashv] = config
     return config
 
   def main(self):
     self.plugin_proxy.set_driver(self)
     self.plugin_proxy.before_main()
 
+    if self.args.async_search:
+      self.async_main()
+      self.record_bandit_stats()
+      self.plugin_proxy.after_main()
+      return
+
     no_tests_generations = 0
 
     # prime pipeline with tests
@@ -265,8 +499,38 @@ class SearchDriver(DriverBase):
       self.run_generation_results(offset=-self.args.pipelining)
       self.generation += 1
 
+    self.record_bandit_stats()
     self.plugin_proxy.after_main()
 
+  def async_main(self):
+    """
+    keep --parallelism tests in flight, each round requests tests for the
+    free slots and waits for any test to finish.  self.generation counts
+    rounds.
+    """
+    results_wait_any = self.tuning_run_main.results_wait_any
+    in_flight = self.tuning_run_main.measurements_in_flight
+    no_tests_rounds = 0
+    while not self.convergence_criteria():
+      free = self.args.parallelism - in_flight()
+      if free > 0 and self.run_generation_techniques(free) > 0:
+        no_tests_rounds = 0
+      elif in_flight() == 0:
+        if no_tests_rounds > self.args.bail_threshold:
+          break
+        no_tests_rounds += 1
+      self.commit()
+      self.plugin_proxy.before_results_wait()
+      results_wait_any()
+      self.plugin_proxy.after_results_wait()
+      self.process_new_results()
+      self.generation += 1
+
+    # let the tests still running finish
+    while in_flight() > 0:
+      results_wait_any()
+    self.process_new_results()
+
   def external_main_begin(self):
     self.plugin_proxy.set_driver(self)
     self.plugin_proxy.before_main()
@@ -280,6 +544,7 @@ class SearchDriver(DriverBase):
     self.plugin_proxy.before_results_wait()
 
   def external_main_end(self):
+    self.record_bandit_stats()
     self.plugin_proxy.after_main()
 
 
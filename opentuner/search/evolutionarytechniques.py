@@ -1,5 +1,4 @@
 import abc
-import copy
 import random
 from technique import SearchTechnique
 from opentuner.search import technique
@@ -28,7 +27,7 @@ class EvolutionaryTechnique(SearchTechnique):
     #TODO: set limit value
 
     parents = self.selection()
-    parents = map(copy.deepcopy, parents)
+    parents = map(self.manipulator.copy, parents)
     parent_hashes = map(self.manipulator.hash_config, parents)
 
     if len(parents) > 1:
@@ -0,0 +1,97 @@
+import logging
+import math
+
+from opentuner.search import technique
+
+log = logging.getLogger(__name__)
+
+
+class SuccessiveHalving(technique.SearchTechnique):
+  """
+  measures a bracket of random configurations on the cheapest input of the
+  InputManager's fidelity ladder (see FidelityInputManager), then promotes
+  the best 1/eta of them to the next larger input until the survivors reach
+  the full input, and starts a new bracket.  Without reduced fidelity inputs
+  this is random search.
+  """
+
+  def __init__(self, eta=3, *pargs, **kwargs):
+    super(SuccessiveHalving, self).__init__(*pargs, **kwargs)
+    self.eta = eta
+    self.levels = 1
+    self.rung = None
+    self.queue = list()
+    self.outstanding = 0
+    self.rung_results = list()
+    self.brackets = 0
+
+  @classmethod
+  def get_hyper_parameters(cls):
+    return ['eta']
+
+  def set_driver(self, driver):
+    super(SuccessiveHalving, self).set_driver(driver)
+    self.levels = driver.tuning_run_main.input_manager.fidelity_levels()
+
+  def bracket(self):
+    """(first rung, number of configurations) of the next bracket"""
+    return 0, self.eta ** (self.levels - 1)
+
+  def fidelity(self):
+    """DesiredResult.fidelity of the current rung, None for the full input"""
+    if self.rung >= self.levels - 1:
+      return None
+    return self.rung
+
+  def desired_result(self):
+    dr = super(SuccessiveHalving, self).desired_result()
+    if dr:
+      dr.fidelity = self.fidelity()
+      self.outstanding += 1
+    return dr
+
+  def desired_configuration(self):
+    while not self.queue:
+      if self.outstanding:
+        return False
+      self.next_rung()
+    return self.queue.pop()
+
+  def next_rung(self):
+    """promote the best of the finished rung, or start a new bracket"""
+    if self.rung is None or self.rung >= self.levels - 1 or (
+        len(self.rung_results) <= 1):
+      self.rung, count = self.bracket()
+      self.queue = [self.manipulator.random() for i in xrange(count)]
+      self.brackets += 1
+    else:
+      ranked = sorted(self.rung_results, cmp=self.objective.result_compare)
+      keep = ranked[:max(1, len(ranked) // self.eta)]
+      log.debug('%s: promoting %d of %d from rung %d', self.name, len(keep),
+                len(ranked), self.rung)
+      self.rung += 1
+      self.queue = [result.configuration for result in reversed(keep)]
+    self.rung_results = list()
+
+  def handle_requested_result(self, result):
+    self.outstanding -= 1
+    self.rung_results.append(result)
+
+
+class Hyperband(SuccessiveHalving):
+  """
+  successive halving over brackets that trade the number of configurations
+  against the input they start on, from many configurations on the cheapest
+  input to a few on the full input
+  """
+
+  def bracket(self):
+    # bracket s of Hyperband with s_max = levels - 1 starts s rungs below the
+    # full input with ceil((s_max + 1) / (s + 1) * eta^s) configurations
+    s = (self.levels - 1) - (self.brackets % self.levels)
+    count = int(math.ceil(float(self.levels) / (s + 1) * self.eta ** s))
+    return self.levels - 1 - s, count
+
+
+technique.register(SuccessiveHalving())
+technique.register(Hyperband())
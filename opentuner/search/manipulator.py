@@ -6,9 +6,11 @@ import hashlib
 import json
 import logging
 import math
+import operator
 import os
 import pickle
 import random
+import struct
 from fn import _
 import argparse
 from datetime import datetime
@@ -119,19 +121,46 @@ class ConfigurationManipulatorBase(object):
     return
 
 
+class CopyOnWriteConfig(dict):
+  """
+  a dict configuration whose copies share parameter values, for use as
+  ConfigurationManipulator(config_type=CopyOnWriteConfig).  Parameters
+  replace the values they change instead of modifying them in place, so a
+  mutation only copies the value of the touched parameter.
+  """
+
+  def copy(self):
+    return CopyOnWriteConfig(self)
+
+  __copy__ = copy
+
+  def __reduce__(self):
+    return CopyOnWriteConfig, (dict(self),)
+
+
 class ConfigurationManipulator(ConfigurationManipulatorBase):
   """
   a configuration manipulator using a fixed set of parameters and storing
   configs in a dict-like object
   """
 
-  def __init__(self, params=None, config_type=dict, seed_config=None, **kwargs):
+  def __init__(self, params=None, config_type=dict, seed_config=None,
+               hash_function=hashlib.sha256, **kwargs):
+    """
+    hash_function is a hashlib style constructor used by hash_config(), its
+    hexdigest() must fit in resultsdb.models.Configuration.hash (64 chars)
+    """
     if params is None:
       params = []
     self.params = list(params)
     self.config_type = config_type
     self.search_driver = None
+    self.hash_function = hash_function
+    if seed_config is not None and not isinstance(seed_config, config_type):
+      seed_config = config_type(seed_config)
     self._seed_config = seed_config
+    self._unit_params = None
+    self._hash_params = None
     super(ConfigurationManipulator, self).__init__(**kwargs)
     for p in self.params:
       p.parent = self
@@ -139,6 +168,8 @@ class ConfigurationManipulator(ConfigurationManipulatorBase):
   def add_parameter(self, p):
     p.set_parent(self)
     self.params.append(p)
+    self._unit_params = None
+    self._hash_params = None
 
     #TODO sub parameters should be recursed on
     # not currently an issue since no doubly-nested sub-parameters
@@ -153,7 +184,7 @@ class ConfigurationManipulator(ConfigurationManipulatorBase):
   def seed_config(self):
     """produce a fixed seed configuration"""
     if self._seed_config:
-      cfg = copy.deepcopy(self._seed_config)
+      cfg = self.copy(self._seed_config)
     else:
       cfg = self.config_type()
       for p in self.params:
@@ -161,6 +192,22 @@ class ConfigurationManipulator(ConfigurationManipulatorBase):
           cfg[p.name] = p.seed_value()
     return cfg
 
+  def copy(self, config):
+    """produce copy of config, sharing values if it is a CopyOnWriteConfig"""
+    if isinstance(config, CopyOnWriteConfig):
+      return config.copy()
+    return copy.deepcopy(config)
+
+  def load_from_file(self, filename, format=None):
+    """
+    Read cfg from filename.  Guess the format by extension if one is not given.
+    """
+    cfg = super(ConfigurationManipulator, self).load_from_file(filename,
+                                                               format)
+    if not isinstance(cfg, self.config_type):
+      cfg = self.config_type(cfg)
+    return cfg
+
   def random(self):
     """produce a random configuration"""
     cfg = self.seed_config()
@@ -225,15 +272,44 @@ class ConfigurationManipulator(ConfigurationManipulatorBase):
 
   def hash_config(self, config):
     """produce unique hash value for the given config"""
-    m = hashlib.sha256()
-    params = list(self.parameters(config))
-    params.sort(key=_.name)
-    for i, p in enumerate(params):
-      m.update(str(p.name))
-      m.update(p.hash_value(config))
-      m.update(str(i))
-      m.update("|")
-    return m.hexdigest()
+    params = self.parameters(config)
+    if self._hash_params is None:
+      self._hash_params = self._hash_parameters(params)
+    normalize_params, value_getters = self._hash_params
+    for p in normalize_params:
+      p.normalize(config)
+    out = []
+    for name, get_value in value_getters:
+      out.append(name)
+      _canonical_encode(get_value(config), out)
+    return self.hash_function(''.join(out)).hexdigest()
+
+  def _hash_parameters(self, params):
+    """
+    precompute, in name order, the encoded name and value getter of each
+    parameter for hash_config(), plus the parameters needing normalize()
+    """
+    params = sorted(params, key=_.name)
+    normalize_params = [p for p in params
+                        if p.normalize.im_func is not Parameter.normalize.im_func]
+    value_getters = []
+    for p in params:
+      name = []
+      _canonical_encode(p.name, name)
+      if p.hash_value.im_func is PrimitiveParameter.hash_value.im_func:
+        get_value = p.get_value
+        if (p.get_value.im_func is NumericParameter.get_value.im_func and
+                p._is_plain_key()):
+          get_value = operator.itemgetter(p.name)
+      elif p.hash_value.im_func is ComplexParameter.hash_value.im_func:
+        get_value = p._get
+        if p._is_plain_key():
+          get_value = operator.itemgetter(p.name)
+      else:
+        # a custom hash_value()
+        get_value = p.hash_value
+      value_getters.append((''.join(name), get_value))
+    return normalize_params, value_getters
 
   def search_space_size(self):
     """estimate the size of the search space, not precise"""
@@ -249,6 +325,103 @@ class ConfigurationManipulator(ConfigurationManipulatorBase):
         pass
     return cfg
 
+  def linear_config(self, a, cfg_a, b, cfg_b, c, cfg_c):
+    """return a configuration that is a linear combination of 3 other configs"""
+    dst = self.copy(cfg_a)
+    params, linear_params, other_params = self._vector_parameters()
+    if linear_params:
+      v = (a * self.get_unit_vector(cfg_a, linear_params) +
+           b * self.get_unit_vector(cfg_b, linear_params) +
+           c * self.get_unit_vector(cfg_c, linear_params))
+      self.set_unit_vector(dst, numpy.clip(v, 0.0, 1.0), linear_params)
+    for p in other_params:
+      p.op4_set_linear(dst, cfg_a, cfg_b, cfg_c, a, b, c)
+    return dst
+
+  # Array-backed representation: the PrimitiveParameters of a config are the
+  # dimensions of a unit vector (via get_unit_value/set_unit_value), so
+  # operators can work on 2-D numpy arrays with one row per config.
+
+  def _vector_parameters(self):
+    """
+    cached (PrimitiveParameters in vector order, those of them using the
+    default op4_set_linear, all other parameters)
+    """
+    if self._unit_params is None:
+      default_linear = PrimitiveParameter.op4_set_linear.im_func
+      params = []
+      linear_params = []
+      other_params = []
+      for p in self.params:
+        if p.is_primitive():
+          params.append(p)
+        if (p.is_primitive() and
+                p.op4_set_linear.im_func is default_linear):
+          linear_params.append(p)
+        else:
+          other_params.append(p)
+      self._unit_params = (params, linear_params, other_params)
+    return self._unit_params
+
+  def unit_parameters(self):
+    """the PrimitiveParameters that make up the unit vector of a config"""
+    return self._vector_parameters()[0]
+
+  def get_unit_vector(self, cfg, params=None):
+    """the unit values of the PrimitiveParameters of cfg as a numpy array"""
+    if params is None:
+      params = self.unit_parameters()
+    return numpy.array([p.get_unit_value(cfg) for p in params], dtype=float)
+
+  def set_unit_vector(self, cfg, vector, params=None):
+    """set the PrimitiveParameters of cfg from a unit vector"""
+    if params is None:
+      params = self.unit_parameters()
+    for p, v in zip(params, vector):
+      p.set_unit_value(cfg, float(v))
+
+  def unit_batch(self, cfgs):
+    """a 2-D array with the unit vector of each of cfgs as a row"""
+    params = self.unit_parameters()
+    return numpy.array([[p.get_unit_value(cfg) for p in params]
+                        for cfg in cfgs], dtype=float).reshape(len(cfgs),
+                                                               len(params))
+
+  def configs_from_batch(self, batch, base_cfgs=None):
+    """
+    convert each row of batch to a configuration, non-primitive parameters
+    are copied from the matching base_cfgs entry (default: seed_config())
+    """
+    cfgs = []
+    for i, vector in enumerate(batch):
+      if base_cfgs is None:
+        cfg = self.seed_config()
+      else:
+        cfg = self.copy(base_cfgs[i])
+      self.set_unit_vector(cfg, vector)
+      cfgs.append(cfg)
+    return cfgs
+
+  def random_batch(self, n):
+    """n uniformly random unit vectors"""
+    return numpy.random.random_sample((n, len(self.unit_parameters())))
+
+  def mutate_batch(self, batch, sigma=0.1):
+    """
+    apply normally distributed noise to every unit value in batch, reflecting
+    off the edges like op1_normal_mutation
+    """
+    batch = batch + numpy.random.normal(0.0, sigma, batch.shape)
+    batch = numpy.abs(batch)
+    return numpy.where(batch > 1.0, 1.0 - batch % 1, batch)
+
+  def linear_batch(self, a, batch_a, b, batch_b, c, batch_c):
+    """
+    rowwise linear combination :math:`a*batch_a + b*batch_b + c*batch_c`
+    clipped to the unit range
+    """
+    return numpy.clip(a * batch_a + b * batch_b + c * batch_c, 0.0, 1.0)
+
   def applySVs(self, cfg, sv_map, args, kwargs):
     """
     Apply operators to each parameter according to given map. Updates cfg.
@@ -265,6 +438,114 @@ class ConfigurationManipulator(ConfigurationManipulatorBase):
       getattr(param, sv_map[pname])(cfg, *args[pname], **kwargs[pname])
 
 
+_int64 = struct.Struct('<q').pack
+_uint32 = struct.Struct('<I').pack
+_float64 = struct.Struct('<d').pack
+
+
+def _encode_none(value, out):
+  out.append('N')
+
+
+def _encode_bool(value, out):
+  out.append('T' if value else 'F')
+
+
+def _encode_int(value, out):
+  if -2 ** 63 <= value < 2 ** 63:
+    out.append('i')
+    out.append(_int64(value))
+  else:
+    s = str(value)
+    out.append('I')
+    out.append(_uint32(len(s)))
+    out.append(s)
+
+
+def _encode_float(value, out):
+  out.append('f')
+  out.append(_float64(value))
+
+
+def _encode_str(value, out):
+  out.append('s')
+  out.append(_uint32(len(value)))
+  out.append(value)
+
+
+def _encode_unicode(value, out):
+  value = value.encode('utf-8')
+  out.append('u')
+  out.append(_uint32(len(value)))
+  out.append(value)
+
+
+def _encode_sequence(value, out):
+  out.append('l' if isinstance(value, list) else 't')
+  out.append(_uint32(len(value)))
+  for item in value:
+    _canonical_encode(item, out)
+
+
+def _encode_dict(value, out):
+  items = []
+  for k, v in value.iteritems():
+    key = []
+    _canonical_encode(k, key)
+    items.append((''.join(key), v))
+  items.sort(key=lambda item: item[0])
+  out.append('d')
+  out.append(_uint32(len(items)))
+  for key, v in items:
+    out.append(key)
+    _canonical_encode(v, out)
+
+
+def _encode_ndarray(value, out):
+  data = numpy.ascontiguousarray(value).tostring()
+  out.append('a')
+  _canonical_encode((value.dtype.str,) + value.shape, out)
+  out.append(_uint32(len(data)))
+  out.append(data)
+
+
+_the_encoders = {
+  type(None): _encode_none,
+  bool: _encode_bool,
+  int: _encode_int,
+  long: _encode_int,
+  float: _encode_float,
+  str: _encode_str,
+  unicode: _encode_unicode,
+  list: _encode_sequence,
+  tuple: _encode_sequence,
+  dict: _encode_dict,
+  numpy.ndarray: _encode_ndarray,
+}
+
+
+def _canonical_encode(value, out):
+  """
+  append a compact type-tagged binary encoding of value to the list out,
+  equal values of the types found in configurations encode equally
+  """
+  encoder = _the_encoders.get(type(value))
+  if encoder is not None:
+    encoder(value, out)
+  elif isinstance(value, numpy.generic):
+    _canonical_encode(value.item(), out)
+  else:
+    for value_type in (bool, int, long, float, str, unicode, list, tuple,
+                       dict, numpy.ndarray):
+      if isinstance(value, value_type):
+        _the_encoders[value_type](value, out)
+        return
+    s = repr(value)
+    out.append('r')
+    out.append(_uint32(len(s)))
+    out.append(s)
+
+
 class Parameter(object):
   """
   abstract base class for parameters in a ConfigurationManipulator
@@ -289,6 +570,8 @@ class Parameter(object):
     node = config
     if not isinstance(self.name, str):
       return node, self.name
+    if '/' not in self.name and not isinstance(node, list):
+      return node, self.name
     name_parts = self.name.split('/')
     for part in name_parts[:-1]:
       if isinstance(node, list):
@@ -299,6 +582,18 @@ class Parameter(object):
       part = int(part)
     return node, part
 
+  def _is_plain_key(self):
+    """
+    true if _get(config) is config[self.name] for dict-like configurations
+    """
+    config_type = getattr(self.parent, 'config_type', None)
+    return (isinstance(self.name, str) and '/' not in self.name and
+            config_type is not None and issubclass(config_type, dict) and
+            self._get.im_func is Parameter._get.im_func and
+            self._read_node.im_func is Parameter._read_node.im_func and
+            self._from_storage_type.im_func is
+            Parameter._from_storage_type.im_func)
+
   def _get(self, config):
     """hook to support different storage structures"""
     node, part = self._read_node(config)
@@ -306,6 +601,11 @@ class Parameter(object):
 
   def _set(self, config, v):
     """hook to support different storage structures"""
+    if (isinstance(config, CopyOnWriteConfig) and
+            isinstance(self.name, str) and '/' in self.name):
+      # the containing value may be shared with other configs
+      top = self.name.split('/', 1)[0]
+      config[top] = copy.deepcopy(config[top])
     node, part = self._read_node(config)
     node[part] = self._to_storage_type(v)
 
@@ -433,7 +733,7 @@ class Parameter(object):
     c = numpy.array(ratio, dtype=float) / sum(ratio)
     for i in range(len(c)):
       if r < sum(c[:i + 1]):
-        self.copy_value(cfg, cfgs[i])
+        self.copy_value(cfgs[i], cfg)
         break
 
 
@@ -841,7 +1141,10 @@ class ComplexParameter(Parameter):
 
   def copy_value(self, src, dst):
     """copy the value of this parameter from src to dst config"""
-    self._set(dst, copy.deepcopy(self._get(src)))
+    value = self._get(src)
+    if not isinstance(dst, CopyOnWriteConfig):
+      value = copy.deepcopy(value)
+    self._set(dst, value)
 
   def same_value(self, cfg1, cfg2):
     """test if cfg1 and cfg2 have the same value of this parameter"""
@@ -1055,7 +1358,10 @@ class PermutationParameter(ComplexParameter):
 
     :param config: the configuration to be changed
     """
-    random.shuffle(self._get(config))
+    # replace rather than shuffle in place, the value may be shared
+    value = list(self._get(config))
+    random.shuffle(value)
+    self._set(config, value)
     self.normalize(config)
 
   def op1_small_random_change(self, config, p=0.25):
@@ -1066,11 +1372,12 @@ class PermutationParameter(ComplexParameter):
     :param p: probability of swapping an element with the next element
     :param config: the configuration to be changed
     """
-    cfg_item = self._get(config)
+    cfg_item = list(self._get(config))
     for i in xrange(1, len(cfg_item)):
       if random.random() < p:
         # swap
         cfg_item[i - 1], cfg_item[i] = cfg_item[i], cfg_item[i - 1]
+    self._set(config, cfg_item)
     self.normalize(config)
 
   def seed_value(self):
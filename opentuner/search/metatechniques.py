@@ -41,6 +41,7 @@ class MetaSearchTechnique(SearchTechniqueBase):
         if dr is False:
           # technique is waiting for results
           continue
+        self.on_technique_desired_result(technique, dr)
         self.driver.register_result_callback(dr,
             lambda result: self.on_technique_result(technique, result))
         if self.log_freq:
@@ -56,6 +57,10 @@ class MetaSearchTechnique(SearchTechniqueBase):
     """called if a sub-technique returns None"""
     pass
 
+  def on_technique_desired_result(self, technique, desired_result):
+    """called for each DesiredResult requested by a sub-technique"""
+    pass
+
   def on_technique_result(self, technique, result):
     """callback for results of sub-techniques"""
     pass
@@ -2,6 +2,7 @@ import abc
 import logging
 
 from fn import _
+from sqlalchemy import case
 
 import opentuner
 from opentuner.resultsdb.models import *
@@ -15,6 +16,10 @@ class SearchObjective(object):
   """
   __metaclass__ = abc.ABCMeta
 
+  # resource usage columns of Result (see measurement.interface.RUSAGE_FIELDS)
+  # the objective ranks on, MeasurementDriver complains if they are not set
+  rusage_columns = ()
+
   @abc.abstractmethod
   def result_order_by_terms(self):
     """return database columns required to order by the objective"""
@@ -27,8 +32,8 @@ class SearchObjective(object):
 
   def config_compare(self, config1, config2):
     """cmp() compatible comparison of resultsdb.models.Configuration"""
-    return self.result_compare(self.driver.results_query(config=config1).one(),
-                               self.driver.results_query(config=config2).one())
+    return self.result_compare(self.driver.config_best_result(config1),
+                               self.driver.config_best_result(config2))
 
   @abc.abstractmethod
   def result_relative(self, result1, result2):
@@ -37,8 +42,8 @@ class SearchObjective(object):
 
   def config_relative(self, config1, config2):
     """return None, or a relative goodness of resultsdb.models.Configuration"""
-    return self.result_relative(self.driver.results_query(config=config1).one(),
-                                self.driver.results_query(config=config2).one())
+    return self.result_relative(self.driver.config_best_result(config1),
+                                self.driver.config_best_result(config2))
 
 
   def __init__(self):
@@ -99,7 +104,10 @@ class SearchObjective(object):
     """
     a time limit to kill a result after such that it can be compared to config
     """
-    return max(map(_.time, self.driver.results_query(config=config)))
+    results = self.driver.result_index.results(config)
+    if not results:
+      return None
+    return max(map(_.time, results))
 
 
   def project_compare(self, a1, a2, b1, b2, factor=1.0):
@@ -113,6 +121,10 @@ class SearchObjective(object):
     a3.accuracy = _project(a1.accuracy, a2.accuracy, factor)
     a3.energy = _project(a1.energy, a2.energy, factor)
     a3.confidence = _project(a1.confidence, a2.confidence, factor)
+    b3.time = _project(b1.time, b2.time, factor)
+    b3.accuracy = _project(b1.accuracy, b2.accuracy, factor)
+    b3.energy = _project(b1.energy, b2.energy, factor)
+    b3.confidence = _project(b1.confidence, b2.confidence, factor)
     return self.result_compare(a3, b3)
 
   def display(self, result):
@@ -166,8 +178,8 @@ class MinimizeValue(SearchObjective):
 
   def config_compare(self, config1, config2):
     """cmp() compatible comparison of resultsdb.models.Configuration"""
-    return cmp(min(map(_.__dict__[self.value], self.driver.results_query(config=config1))),
-               min(map(_.__dict__[self.value], self.driver.results_query(config=config2))))
+    return cmp(self.driver.config_best_result(config1).__dict__[self.value],
+               self.driver.config_best_result(config2).__dict__[self.value])
 
   def result_relative(self, result1, result2):
     """return None, or a relative goodness of resultsdb.models.Result"""
@@ -281,16 +293,15 @@ class ThresholdAccuracyMinimizeTime(SearchObjective):
 
   def config_compare(self, config1, config2):
     """cmp() compatible comparison of resultsdb.models.Configuration"""
-    return self.result_compare(
-      self.driver.results_query(config=config1, objective_ordered=True)[0],
-      self.driver.results_query(config=config2, objective_ordered=True)[0])
+    return self.result_compare(self.driver.config_best_result(config1),
+                               self.driver.config_best_result(config2))
 
   def limit_from_config(self, config):
     """
     a time limit to kill a result after such that it can be compared to config
     """
-    results = self.driver.results_query(config=config)
-    if results.count() == 0:
+    results = self.driver.result_index.results(config)
+    if not results:
       return None
     if self.accuracy_target > min(map(_.accuracy, results)):
       m = self.low_accuracy_limit_multiplier
@@ -316,6 +327,123 @@ class ThresholdAccuracyMinimizeTime(SearchObjective):
     return None
 
 
+def _or_inf(value):
+  """missing measurements compare as worst"""
+  if value is None:
+    return float('inf')
+  return value
+
+
+def _cpu_time(result):
+  if result.user_time is None or result.system_time is None:
+    return float('inf')
+  return result.user_time + result.system_time
+
+
+class MinimizeCPUTime(SearchObjective):
+  """
+  minimize Result().user_time + Result().system_time, break ties with
+  Result().time
+  """
+  rusage_columns = ('user_time', 'system_time')
+
+  def result_order_by_terms(self):
+    """return database columns required to order by the objective"""
+    return [Result.user_time == None,
+            Result.user_time + Result.system_time,
+            Result.time]
+
+  def result_compare(self, result1, result2):
+    """cmp() compatible comparison of resultsdb.models.Result"""
+    return cmp((_cpu_time(result1), result1.time),
+               (_cpu_time(result2), result2.time))
+
+  def result_relative(self, result1, result2):
+    """return None, or a relative goodness of resultsdb.models.Result"""
+    if _cpu_time(result2) == 0:
+      return float('inf') * _cpu_time(result1)
+    return _cpu_time(result1) / _cpu_time(result2)
+
+  def display(self, result):
+    """
+    produce a string version of a resultsdb.models.Result()
+    """
+    return 'cpu_time=%.4f, time=%.4f' % (_cpu_time(result), result.time)
+
+
+class MinimizeMaxRSS(SearchObjective):
+  """
+  minimize Result().max_rss (peak memory), break ties with Result().time
+  """
+  rusage_columns = ('max_rss',)
+
+  def result_order_by_terms(self):
+    """return database columns required to order by the objective"""
+    return [Result.max_rss == None, Result.max_rss, Result.time]
+
+  def result_compare(self, result1, result2):
+    """cmp() compatible comparison of resultsdb.models.Result"""
+    return cmp((_or_inf(result1.max_rss), result1.time),
+               (_or_inf(result2.max_rss), result2.time))
+
+  def result_relative(self, result1, result2):
+    """return None, or a relative goodness of resultsdb.models.Result"""
+    if not result2.max_rss:
+      return float('inf') * _or_inf(result1.max_rss)
+    return _or_inf(result1.max_rss) / result2.max_rss
+
+  def display(self, result):
+    """
+    produce a string version of a resultsdb.models.Result()
+    """
+    return 'max_rss=%.1fMiB, time=%.4f' % (
+      _or_inf(result.max_rss) / 1024.0 ** 2, result.time)
+
+
+class ThresholdMemoryMinimizeTime(SearchObjective):
+  """
+  if max_rss <= memory_target:
+    minimize time
+  else:
+    minimize max_rss
+  """
+  rusage_columns = ('max_rss',)
+
+  def __init__(self, memory_target):
+    self.memory_target = memory_target
+    super(ThresholdMemoryMinimizeTime, self).__init__()
+
+  def result_order_by_terms(self):
+    """return database columns required to order by the objective"""
+    return [Result.max_rss == None,
+            case([(Result.max_rss > self.memory_target, Result.max_rss)],
+                 else_=self.memory_target),
+            Result.time]
 
+  def result_key(self, result):
+    return (max(self.memory_target, _or_inf(result.max_rss)), result.time)
 
+  def result_compare(self, result1, result2):
+    """cmp() compatible comparison of resultsdb.models.Result"""
+    return cmp(self.result_key(result1), self.result_key(result2))
 
+  def filter_acceptable(self, query):
+    """Return a Result() query that only returns acceptable results"""
+    return query.filter(Result.max_rss <= self.memory_target)
+
+  def is_acceptable(self, result):
+    """Test if a Result() meets thresholds"""
+    return _or_inf(result.max_rss) <= self.memory_target
+
+  def result_relative(self, result1, result2):
+    """return None, or a relative goodness of resultsdb.models.Result"""
+    memory1, time1 = self.result_key(result1)
+    memory2, time2 = self.result_key(result2)
+    if memory1 != memory2:
+      # at least one is over the target, relative peak memory
+      if not memory2:
+        return float('inf') * memory1
+      return float(memory1) / memory2
+    if time2 == 0:
+      return float('inf') * time1
+    return time1 / time2
@@ -1,10 +1,14 @@
 import abc
 import argparse
 import logging
+import math
 import time
 
+import numpy
+
 from datetime import datetime
 from fn import _
+from opentuner.resultsdb.models import DesiredResult, Result
 
 log = logging.getLogger(__name__)
 display_log = logging.getLogger(__name__ + ".DisplayPlugin")
@@ -18,6 +22,14 @@ argparser.add_argument('--quiet', action='store_true',
     help="print less information")
 argparser.add_argument('--display-frequency', default=10, type=int,
     help="how often for DisplayPlugin to print")
+argparser.add_argument('--drift-interval', type=int, metavar='TESTS',
+    help="re-measure the best and a reference configuration every TESTS "
+         "tests and divide times by the estimated drift of the machine")
+argparser.add_argument('--drift-reference', metavar='FILENAME',
+    help="reference configuration for --drift-interval (default: the first "
+         "configuration measured)")
+argparser.add_argument('--drift-smoothing', type=float, default=0.3,
+    help="weight of each new re-measurement in the drift estimate")
 
 class SearchPlugin(object):
   @property
@@ -38,6 +50,13 @@ class SearchPlugin(object):
   def before_results_wait(self): pass
   def after_results_wait(self):  pass
 
+  def before_result(self, result):
+    """
+    called once for every new result before it is indexed and compared with
+    other results, may adjust it
+    """
+    pass
+
   def on_result(self, result):
     """
     called once for every new result
@@ -127,6 +146,202 @@ class FileDisplayPlugin(SearchPlugin):
           result.time
       self.details.flush()
 
+class DriftCorrectionPlugin(SearchPlugin):
+  """
+  interleaves re-measurements of the current best and a reference
+  configuration every interval tests.  Each re-measurement is compared with
+  the earlier (corrected) time of its configuration to estimate how much
+  slower the machine has become, and every new Result is divided by that
+  drift factor before it is compared.  The measured time is kept in
+  Result.raw_time and the factor in Result.drift_factor.
+  """
+
+  def __init__(self, interval, reference_file=None, smoothing=0.3):
+    super(DriftCorrectionPlugin, self).__init__()
+    self.interval = interval
+    self.reference_file = reference_file
+    self.smoothing = smoothing
+    self.drift_factor = 1.0
+    self.reference = None
+    self.reference_time = None
+    self.next_test = interval
+    self.remeasure_best = False
+    # DesiredResult -> corrected time it was expected to take, or None
+    self.pending = dict()
+
+  @property
+  def priority(self):
+    # correct Results before other plugins see them
+    return -10
+
+  def before_main(self):
+    if self.reference_file and self.reference is None:
+      self.reference = self.driver.get_configuration(
+        self.driver.manipulator.load_from_file(self.reference_file))
+
+  def before_techniques(self):
+    if self.pending or self.driver.test_count < self.next_test:
+      return
+    self.next_test = self.driver.test_count + self.interval
+    best = self.driver.best_result
+    if self.remeasure_best and best is not None:
+      self.request(best.configuration, best.time)
+    elif self.reference is not None:
+      self.request(self.reference, self.reference_time)
+    self.remeasure_best = not self.remeasure_best
+
+  def request(self, configuration, expected_time):
+    dr = DesiredResult(configuration=configuration,
+                       requestor='drift',
+                       generation=self.driver.generation,
+                       request_date=datetime.now(),
+                       tuning_run=self.driver.tuning_run,
+                       state='REQUESTED')
+    self.driver.session.add(dr)
+    self.pending[dr] = expected_time
+
+  def before_result(self, result):
+    remeasured = [dr for dr in self.pending if dr.result is result]
+    expected_time = None
+    for dr in remeasured:
+      expected_time = self.pending.pop(dr)
+    measured = (result.state in (None, 'OK') and result.time is not None
+                and result.time < float('inf'))
+    if measured and expected_time:
+      self.add_sample(result.time / expected_time)
+    result.raw_time = result.time
+    result.drift_factor = self.drift_factor
+    if measured:
+      result.time /= self.drift_factor
+      for column in ('confidence', 'time_stddev'):
+        if getattr(result, column) is not None:
+          setattr(result, column, getattr(result, column) / self.drift_factor)
+      if self.reference is None:
+        self.reference = result.configuration
+      if (self.reference_time is None and
+          result.configuration is self.reference):
+        self.reference_time = result.time
+
+  def add_sample(self, sample):
+    """update the drift estimate with the ratio of a re-measurement"""
+    self.drift_factor += self.smoothing * (sample - self.drift_factor)
+    log.debug('drift sample %.3f, drift factor %.3f', sample,
+              self.drift_factor)
+
+
+class FailurePredictor(SearchPlugin):
+  """
+  online logistic regression of the probability that a configuration fails
+  (a Result state of ERROR or TIMEOUT) from its ConfigEncoder encoding,
+  updated with every new Result.  Each Result is predicted before it is
+  learned from, so the precision and recall logged at the end of the run
+  are for configurations the model had not seen.  Tests SearchDriver
+  rejects for --failure-threshold are not measured, except for the
+  --failure-explore fraction that keeps the predictions honest.
+  """
+
+  def __init__(self, threshold=0.9, learning_rate=0.5, regularization=1e-4,
+               initial=20):
+    super(FailurePredictor, self).__init__()
+    self.threshold = threshold
+    self.learning_rate = learning_rate
+    self.regularization = regularization
+    self.initial = initial
+    self.encoder = None
+    self.weights = None
+    self.results = 0
+    self.failures = 0
+    # predicted failure (above threshold) / actual failure counts
+    self.true_positives = 0
+    self.false_positives = 0
+    self.false_negatives = 0
+    self.rejected = 0
+    self.explored = 0
+
+  def set_driver(self, driver):
+    super(FailurePredictor, self).set_driver(driver)
+    if self.encoder is None:
+      # imported here, surrogate imports the techniques which import plugin
+      from opentuner.search.surrogate import ConfigEncoder
+      self.encoder = ConfigEncoder(driver.manipulator)
+      self.weights = numpy.zeros(self.encoder.width + 1)
+
+  def before_main(self):
+    """when resuming a tuning run, learn from the results it already has"""
+    if self.results or self.driver.tuning_run.id is None:
+      return
+    q = (self.driver.results_query()
+         .filter(Result.fidelity == None)
+         .filter(Result.was_new_best != None)
+         .order_by(Result.collection_date))
+    for result in q:
+      self.learn(result)
+    if self.results:
+      log.info('failure predictor trained on %d earlier results',
+               self.results)
+
+  def features(self, cfg):
+    return numpy.append(self.encoder.encode(cfg), 1.0)
+
+  def predict(self, features):
+    z = min(30.0, max(-30.0, features.dot(self.weights)))
+    return 1.0 / (1.0 + math.exp(-z))
+
+  def ready(self):
+    """trained on enough results with both outcomes"""
+    return (self.results >= self.initial and
+            0 < self.failures < self.results)
+
+  def probability(self, cfg):
+    """probability that cfg fails, None if not ready()"""
+    if not self.ready():
+      return None
+    return self.predict(self.features(cfg))
+
+  def on_result(self, result):
+    if self.ready():
+      predicted = self.probability(result.configuration.data) > self.threshold
+      failed = self.failed(result)
+      if predicted:
+        if failed:
+          self.true_positives += 1
+        else:
+          self.false_positives += 1
+      elif failed:
+        self.false_negatives += 1
+    self.learn(result)
+
+  @staticmethod
+  def failed(result):
+    return result.state not in (None, 'OK')
+
+  def learn(self, result):
+    """one gradient step of the regression on result"""
+    features = self.features(result.configuration.data)
+    failed = self.failed(result)
+    p = self.predict(features)
+    self.results += 1
+    self.failures += int(failed)
+    self.weights += self.learning_rate * (
+      (float(failed) - p) * features - self.regularization * self.weights)
+
+  def precision(self):
+    predicted = self.true_positives + self.false_positives
+    return float(self.true_positives) / predicted if predicted else None
+
+  def recall(self):
+    actual = self.true_positives + self.false_negatives
+    return float(self.true_positives) / actual if actual else None
+
+  def after_main(self):
+    def fmt(value):
+      return '%.2f' % value if value is not None else 'n/a'
+    log.info('failure predictor: precision %s recall %s at threshold %.2f '
+             '(%d of %d results failed, %d tests rejected, %d explored)',
+             fmt(self.precision()), fmt(self.recall()), self.threshold,
+             self.failures, self.results, self.rejected, self.explored)
+
+
 def get_enabled(args):
   plugins = []
   if not args.quiet:
@@ -134,6 +349,10 @@ def get_enabled(args):
   if args.results_log or args.results_log_details:
     plugins.append(FileDisplayPlugin(args.results_log,
                                      args.results_log_details))
+  if args.drift_interval:
+    plugins.append(DriftCorrectionPlugin(args.drift_interval,
+                                         args.drift_reference,
+                                         args.drift_smoothing))
   return plugins
 
 def cfg_repr(cfg):
@@ -4,20 +4,33 @@ from manipulator import *
 from opentuner.search import technique
 import random
 import math
+import numpy
 
 class PSO(technique.SequentialSearchTechnique ):
   """ Particle Swarm Optimization """
-  def __init__(self, crossover, N = 30, init_pop=None, *pargs, **kwargs):
+  def __init__(self, crossover, N = 30, init_pop=None, vectorized=False,
+               *pargs, **kwargs):
     """
     crossover: name of crossover operator function
+    vectorized: move the PrimitiveParameters of the swarm as 2-D arrays of
+    unit values instead of one op3_swarm call per parameter
     """
     super(PSO, self).__init__(*pargs, **kwargs)
     self.crossover = crossover
     self.name = 'pso-'+crossover.replace("op3_cross_","")
+    if vectorized:
+      self.name += '-vector'
     self.init_pop = init_pop
     self.N = N
+    self.vectorized = vectorized
 
   def main_generator(self):
+    if self.vectorized and isinstance(self.manipulator,
+                                      ConfigurationManipulator):
+      return self.vector_generator()
+    return self.particle_generator()
+
+  def particle_generator(self):
 
     objective   = self.objective
     driver    = self.driver
@@ -42,6 +55,54 @@ class PSO(technique.SequentialSearchTechnique ):
         if objective.lt(config(particle.position), config(particle.best)):
           particle.best = particle.position
 
+  def vector_generator(self, omega=0.5, phi_l=0.5, phi_g=0.5):
+    """
+    particle_generator with the positions, velocities and best positions of
+    the PrimitiveParameters kept as rows of unit-value batches, so a move is
+    a few array operations: v = omega*v + r1*phi_g*(g - x) + r2*phi_l*(b - x)
+    ComplexParameters still move with op3_swarm
+    """
+    objective = self.objective
+    driver = self.driver
+    m = self.manipulator
+
+    if self.init_pop:
+      positions = [m.copy(p.position) for p in self.init_pop]
+    else:
+      positions = [m.random() for i in range(self.N)]
+    bests = list(positions)
+    x = m.unit_batch(positions)
+    best = x.copy()
+    velocity = numpy.zeros_like(x)
+    other_params = [p for p in m.params if not p.is_primitive()]
+    other_velocity = [dict((p.name, 0) for p in other_params)
+                      for i in range(len(positions))]
+
+    for cfg in positions:
+      yield driver.get_configuration(cfg)
+
+    while True:
+      for i in range(len(positions)):
+        g = driver.best_result.configuration.data
+        r1, r2 = numpy.random.random_sample((2, x.shape[1]))
+        velocity[i] = (omega * velocity[i] +
+                       r1 * phi_g * (m.get_unit_vector(g) - x[i]) +
+                       r2 * phi_l * (best[i] - x[i]))
+        x[i] = numpy.clip(x[i] + velocity[i], 0.0, 1.0)
+
+        cfg = m.configs_from_batch(x[i:i + 1], [positions[i]])[0]
+        for p in other_params:
+          other_velocity[i][p.name] = p.op3_swarm(
+              cfg, g, bests[i], c=omega, c1=phi_g, c2=phi_l,
+              xchoice=self.crossover, velocity=other_velocity[i][p.name])
+        positions[i] = cfg
+        yield driver.get_configuration(cfg)
+        # update individual best
+        if objective.lt(driver.get_configuration(cfg),
+                        driver.get_configuration(bests[i])):
+          bests[i] = cfg
+          best[i] = x[i]
+
 class HybridParticle(object):
   def __init__(self, m, crossover_choice, omega=0.5, phi_l=0.5, phi_g=0.5):
 
@@ -79,3 +140,4 @@ technique.register(PSO(crossover = 'op3_cross_OX1'))
 technique.register(PSO(crossover = 'op3_cross_PMX'))
 technique.register(PSO(crossover = 'op3_cross_PX'))
 technique.register(PSO(crossover = 'op3_cross_CX'))
+technique.register(PSO(crossover = 'op3_cross_OX1', vectorized=True))
@@ -4,6 +4,7 @@ import math
 from collections import defaultdict
 from fn import _
 from fn.iters import map, filter
+from .manipulator import ConfigurationManipulator
 from .manipulator import Parameter
 from .metatechniques import RecyclingMetaTechnique
 from .technique import SequentialSearchTechnique, register
@@ -29,6 +30,13 @@ class SimplexTechnique(SequentialSearchTechnique):
     average of all the PrimitiveParameters in self.simplex_points
     ComplexParameters are copied from self.simplex_points[0]
     """
+    if isinstance(self.manipulator, ConfigurationManipulator):
+      batch = self.manipulator.unit_batch([config.data
+                                           for config in self.simplex_points])
+      centroid = self.manipulator.copy(self.simplex_points[0].data)
+      self.manipulator.set_unit_vector(centroid, batch.mean(axis=0))
+      return centroid
+
     sums = defaultdict(float)
     counts = defaultdict(int)
 
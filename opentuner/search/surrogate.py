@@ -0,0 +1,297 @@
+import logging
+import math
+import random
+
+import numpy
+
+from opentuner.search import differentialevolution
+from opentuner.search import evolutionarytechniques
+from opentuner.search import technique
+from opentuner.search.bandittechniques import AUCBanditMetaTechnique
+from opentuner.search.manipulator import (BooleanParameter, EnumParameter,
+                                          PermutationParameter,
+                                          SwitchParameter)
+
+log = logging.getLogger(__name__)
+
+_erf = numpy.vectorize(math.erf, otypes=[float])
+
+
+class ConfigEncoder(object):
+  """
+  encodes configurations as rows of numbers in [0, 1] for a surrogate model:
+  primitive parameters by get_unit_value(), booleans as 0/1, enums and
+  switches one-hot and permutations by the position of each item.  Other
+  parameters are not encoded.  Candidates can be generated directly as
+  encodings and only the chosen ones decoded back into configurations.
+  """
+
+  def __init__(self, manipulator):
+    # (kind, first column, width, parameter, values) for each parameter
+    self.groups = []
+    self.width = 0
+    for p in manipulator.params:
+      if p.is_primitive():
+        self.add_group('unit', 1, p)
+      elif isinstance(p, BooleanParameter):
+        self.add_group('bool', 1, p)
+      elif isinstance(p, EnumParameter):
+        self.add_group('onehot', len(p.options), p, p.options)
+      elif isinstance(p, SwitchParameter):
+        self.add_group('onehot', p.option_count, p, range(p.option_count))
+      elif isinstance(p, PermutationParameter):
+        self.add_group('position', p.size, p, p._items)
+
+  def add_group(self, kind, width, param, values=None):
+    self.groups.append((kind, self.width, width, param, values))
+    self.width += width
+
+  def encode(self, cfg):
+    row = numpy.zeros(self.width)
+    for kind, start, width, param, values in self.groups:
+      if kind == 'unit':
+        row[start] = param.get_unit_value(cfg)
+      elif kind == 'bool':
+        row[start] = 1.0 if param._get(cfg) else 0.0
+      elif kind == 'onehot':
+        value = param._get(cfg)
+        for i, v in enumerate(values):
+          if v == value:
+            row[start + i] = 1.0
+            break
+      else:
+        index = dict((repr(v), i) for i, v in enumerate(values))
+        scale = 1.0 / max(1, width - 1)
+        for position, item in enumerate(param._get(cfg)):
+          i = index.get(repr(item))
+          if i is not None:
+            row[start + i] = position * scale
+    return row
+
+  def encode_batch(self, cfgs):
+    """a 2-D array with the encoding of each of cfgs as a row"""
+    return numpy.array([self.encode(cfg) for cfg in cfgs],
+                       dtype=float).reshape(len(cfgs), self.width)
+
+  def decode(self, row, cfg):
+    """set the encoded parameters of cfg from row"""
+    for kind, start, width, param, values in self.groups:
+      if kind == 'unit':
+        param.set_unit_value(cfg, float(min(1.0, max(0.0, row[start]))))
+      elif kind == 'bool':
+        param._set(cfg, bool(row[start] > 0.5))
+      elif kind == 'onehot':
+        param._set(cfg, values[int(numpy.argmax(row[start:start + width]))])
+      else:
+        order = numpy.argsort(row[start:start + width], kind='mergesort')
+        param._set(cfg, [values[i] for i in order])
+        param.normalize(cfg)
+    return cfg
+
+  def random_group(self, kind, width, n):
+    """n random encodings of one parameter"""
+    if kind == 'unit':
+      return numpy.random.random_sample((n, 1))
+    if kind == 'bool':
+      return numpy.random.randint(0, 2, (n, 1)).astype(float)
+    if kind == 'onehot':
+      return numpy.eye(width)[numpy.random.randint(0, width, n)]
+    positions = numpy.argsort(numpy.random.random_sample((n, width)), axis=1)
+    return positions / float(max(1, width - 1))
+
+  def random_batch(self, n):
+    """n encodings of uniformly random configurations"""
+    batch = numpy.zeros((n, self.width))
+    for kind, start, width, param, values in self.groups:
+      batch[:, start:start + width] = self.random_group(kind, width, n)
+    return batch
+
+  def mutate_batch(self, batch, sigma=0.1):
+    """
+    normally distributed noise on the unit values (reflected off the edges)
+    and each other parameter randomized with probability 1/len(groups)
+    """
+    batch = batch.copy()
+    n = len(batch)
+    p = 1.0 / max(1, len(self.groups))
+    for kind, start, width, param, values in self.groups:
+      if kind == 'unit':
+        column = numpy.abs(batch[:, start] +
+                           numpy.random.normal(0.0, sigma, n))
+        batch[:, start] = numpy.where(column > 1.0, 1.0 - column % 1, column)
+      else:
+        rows = numpy.random.random_sample(n) < p
+        batch[rows, start:start + width] = self.random_group(kind, width,
+                                                             rows.sum())
+    return batch
+
+
+class GaussianProcess(object):
+  """
+  gaussian process regression with a squared exponential kernel, the length
+  scale is a fraction of the median distance between training points
+  """
+
+  def __init__(self, noise=0.01, length_scale_fraction=0.5):
+    self.noise = noise
+    self.length_scale_fraction = length_scale_fraction
+
+  def fit(self, X, y):
+    self.X = X
+    self.y_mean = y.mean()
+    self.y_std = y.std() or 1.0
+    y = (y - self.y_mean) / self.y_std
+    distances = numpy.sqrt(self.sq_distances(X, X))
+    distances = distances[distances > 0]
+    self.length_scale = self.length_scale_fraction * (
+      numpy.median(distances) if len(distances) else 1.0)
+    K = self.kernel(X, X) + self.noise * numpy.eye(len(X))
+    self.L = numpy.linalg.cholesky(K)
+    self.alpha = numpy.linalg.solve(self.L.T, numpy.linalg.solve(self.L, y))
+    return self
+
+  @staticmethod
+  def sq_distances(A, B):
+    d = ((A * A).sum(1)[:, None] + (B * B).sum(1)[None, :] -
+         2.0 * A.dot(B.T))
+    return numpy.maximum(d, 0.0)
+
+  def kernel(self, A, B):
+    return numpy.exp(-0.5 * self.sq_distances(A, B) / self.length_scale ** 2)
+
+  def predict(self, X):
+    """mean and standard deviation of the predictions for the rows of X"""
+    Ks = self.kernel(X, self.X)
+    mean = Ks.dot(self.alpha)
+    v = numpy.linalg.solve(self.L, Ks.T)
+    var = numpy.maximum(1.0 - (v * v).sum(0), 1e-12)
+    return (mean * self.y_std + self.y_mean,
+            numpy.sqrt(var) * self.y_std)
+
+
+def fit_surrogate(driver, encoder, initial=10, max_points=200):
+  """
+  (configurations best first, their encodings, GaussianProcess) fit to the
+  ranks (by the objective) of the configurations measured so far, or None
+  with fewer than initial of them.  Above max_points the best half of them
+  and a random sample of the rest are used.
+  """
+  configs = [config for config, result
+             in driver.result_index.best_by_config.items()
+             if result.time is not None and result.time < float('inf')]
+  if len(configs) < initial:
+    return None
+  configs.sort(cmp=driver.objective.config_compare)
+  # ranks are comparable for any objective and insensitive to outliers
+  ranks = numpy.arange(len(configs), dtype=float) / len(configs)
+  if len(configs) > max_points:
+    keep = range(max_points // 2) + sorted(random.sample(
+      xrange(max_points // 2, len(configs)), max_points // 2))
+    configs = [configs[i] for i in keep]
+    ranks = ranks[keep]
+  X = encoder.encode_batch([c.data for c in configs])
+  return configs, X, GaussianProcess().fit(X, ranks)
+
+
+def expected_improvement(mean, std, best):
+  """expected improvement below best of normally distributed predictions"""
+  z = (best - mean) / std
+  cdf = 0.5 * (1.0 + _erf(z / math.sqrt(2.0)))
+  pdf = numpy.exp(-0.5 * z * z) / math.sqrt(2.0 * math.pi)
+  return (best - mean) * cdf + std * pdf
+
+
+class SurrogateSearch(technique.SearchTechnique):
+  """
+  fits a gaussian process to the ranks (by the objective) of the
+  configurations measured so far and requests the candidate with the
+  highest expected improvement out of candidates random and near the best
+  """
+
+  def __init__(self, candidates=1000, initial=10, max_points=200,
+               local_fraction=0.5, *pargs, **kwargs):
+    super(SurrogateSearch, self).__init__(*pargs, **kwargs)
+    self.candidates = candidates
+    self.initial = initial
+    self.max_points = max_points
+    self.local_fraction = local_fraction
+    self.encoder = None
+    # hashes of configurations requested but not yet measured
+    self.pending = set()
+
+  @classmethod
+  def get_hyper_parameters(cls):
+    return ['candidates', 'initial', 'max_points', 'local_fraction']
+
+  def desired_configuration(self):
+    if self.encoder is None:
+      self.encoder = ConfigEncoder(self.manipulator)
+    fit = fit_surrogate(self.driver, self.encoder, self.initial,
+                        self.max_points)
+    if fit is None:
+      return self.manipulator.random()
+    configs, X, model = fit
+    best = configs[0].data
+
+    local = int(self.candidates * self.local_fraction)
+    candidates = numpy.vstack([
+      self.encoder.random_batch(self.candidates - local),
+      self.encoder.mutate_batch(numpy.tile(X[0], (local, 1)))])
+    mean, std = model.predict(candidates)
+    measured = set(c.hash for c in self.driver.result_index.best_by_config)
+    # decode only until a candidate that is not measured or requested
+    for i in numpy.argsort(-expected_improvement(mean, std, 0.0)):
+      cfg = self.encoder.decode(candidates[i], self.manipulator.copy(best))
+      hashv = self.manipulator.hash_config(cfg)
+      if hashv not in measured and hashv not in self.pending:
+        self.pending.add(hashv)
+        return cfg
+    return self.manipulator.random()
+
+  def handle_requested_result(self, result):
+    self.pending.discard(result.configuration.hash)
+
+
+class SurrogatePredictor(object):
+  """
+  the default predictor of SearchDriver for --prescreen-factor, scores
+  candidate configurations by the expected improvement of the surrogate
+  model of SurrogateSearch, refit when new results arrive
+  """
+
+  def __init__(self, initial=10, max_points=200):
+    self.initial = initial
+    self.max_points = max_points
+    self.driver = None
+    self.encoder = None
+    self.model = None
+    self.fit_size = None
+
+  def set_driver(self, driver):
+    self.driver = driver
+    self.encoder = ConfigEncoder(driver.manipulator)
+
+  def score(self, cfgs):
+    """
+    a score for each of cfgs (lower is better), None until there are enough
+    results to fit a model
+    """
+    size = len(self.driver.result_index.best_by_config)
+    if size != self.fit_size:
+      self.fit_size = size
+      fit = fit_surrogate(self.driver, self.encoder, self.initial,
+                          self.max_points)
+      self.model = fit[2] if fit is not None else None
+    if self.model is None:
+      return None
+    mean, std = self.model.predict(self.encoder.encode_batch(cfgs))
+    return list(-expected_improvement(mean, std, 0.0))
+
+
+technique.register(SurrogateSearch())
+technique.register(AUCBanditMetaTechnique([
+        SurrogateSearch(),
+        differentialevolution.DifferentialEvolutionAlt(),
+        evolutionarytechniques.UniformGreedyMutation(),
+        evolutionarytechniques.NormalGreedyMutation(mutation_rate=0.3),
+      ], name='SurrogateBandit'))
@@ -22,6 +22,11 @@ argparser.add_argument('--list-techniques','-lt', action='store_true',
                        help="list techniques available and exit")
 argparser.add_argument('--generate-bandit-technique','-gbt', action='store_true',
                        help="randomly generate a bandit to use")
+argparser.add_argument('--batch-bandit', action='store_true',
+                       help="bandits count pending requests against a "
+                            "technique and credit new bests per second of "
+                            "measurement rather than per test, spreading "
+                            "each generation over several techniques")
 
 class SearchTechniqueBase(object):
   """
@@ -1,17 +1,23 @@
 # vim: tabstop=2 shiftwidth=2 softtabstop=2 expandtab autoindent smarttab
 import argparse
+import atexit
 import copy
 import inspect
 import logging
 import math
 import os
+import signal
 import socket
 import sys
 import time
 import uuid
-from datetime import datetime
+import weakref
+from datetime import datetime, timedelta
 
 from opentuner import resultsdb
+from opentuner.driverbase import ResultIndex
+from opentuner.resultsdb.persistence import WriteStats
+from opentuner.resultsdb.persistence import commit_policy_from_args
 from opentuner.search.driver import SearchDriver
 from opentuner.measurement.driver import MeasurementDriver
 
@@ -25,8 +31,28 @@ argparser.add_argument('--print-search-space-size', action='store_true',
 argparser.add_argument('--database',
                        help=("database to store tuning results in, see: "
                              "http://docs.sqlalchemy.org/en/rel_0_8/core/engines.html#database-urls"))
+argparser.add_argument('--db-profile',
+                       choices=sorted(resultsdb.SQLITE_PROFILES),
+                       help=("sqlite settings: safe (WAL journal, full sync), "
+                             "fast (WAL journal, normal sync, larger caches) "
+                             "or memory-then-dump (run in memory, copy to "
+                             "the database file periodically and at exit)"))
+argparser.add_argument('--db-dump-interval', type=float, default=60.0,
+                       metavar='SECONDS',
+                       help=("with --db-profile=memory-then-dump, how often "
+                             "to copy new results to the database file"))
 argparser.add_argument('--print-params','-pp',action='store_true',
                        help='show parameters of the configuration being tuned')
+argparser.add_argument('--distributed-measurement', action='store_true',
+                       help=("leave measuring to opentuner-worker processes "
+                             "sharing --database instead of measuring in "
+                             "this process"))
+argparser.add_argument('--distributed-claim-timeout', type=float,
+                       metavar='SECONDS',
+                       help=("with --distributed-measurement, assume a worker "
+                             "that has been measuring a test for longer than "
+                             "SECONDS died and let another worker measure it "
+                             "(must be longer than any test takes)"))
 
 
 class CleanStop(Exception):
@@ -87,7 +113,8 @@ class TuningRunMain(object):
                measurement_interface,
                args,
                search_driver=SearchDriver,
-               measurement_driver=MeasurementDriver):
+               measurement_driver=MeasurementDriver,
+               commit_policy=None):
     init_logging()
 
     manipulator = measurement_interface.manipulator()
@@ -130,13 +157,27 @@ class TuningRunMain(object):
     if not args.label:
       args.label = 'unnamed'
 
-    #self.fake_commit = ('sqlite' in args.database)
-    self.fake_commit = True
+    if commit_policy is None:
+      commit_policy = commit_policy_from_args(args)
+    self.commit_policy = commit_policy
 
     self.args = args
 
-    self.engine, self.Session = resultsdb.connect(args.database)
+    if (args.db_profile == 'memory-then-dump' and
+        args.distributed_measurement):
+      raise Exception('--db-profile=memory-then-dump cannot be used with '
+                      '--distributed-measurement')
+    self.engine, self.Session = resultsdb.connect(args.database,
+                                                  args.db_profile)
+    # objects are not expired on commit since measurement slot threads read
+    # DesiredResults while this thread commits and the ResultIndex keeps
+    # Results across commits.  Rows other processes change are expired
+    # explicitly (see distributed_results_wait() and claim_desired_result()).
     self.session = self.Session()
+    self.session.expire_on_commit = False
+    self.write_stats = WriteStats(self.session)
+    self.closed = False
+    self.last_dump = time.time()
     self.tuning_run = None
     self.search_driver_cls = search_driver
     self.measurement_driver_cls = measurement_driver
@@ -145,13 +186,17 @@ class TuningRunMain(object):
     self.manipulator = manipulator
     self.objective = objective
     self.objective_copy = copy.copy(objective)
-    self.last_commit_time = time.time()
+    self.distributed_poll_interval = 0.1
+    # seconds without a finished measurement before warning about workers
+    self.distributed_warn_interval = 60.0
+    self.install_shutdown_handlers()
 
   def init(self):
     if self.tuning_run is None:
       program_version = (self.measurement_interface
                          .db_program_version(self.session))
       self.session.flush()
+      self.rehash_configurations(program_version.program)
       self.measurement_interface.prefix_hook(self.session)
       self.tuning_run = (
         resultsdb.models.TuningRun(
@@ -170,6 +215,7 @@ class TuningRunMain(object):
         'manipulator': self.manipulator,
         'measurement_interface': self.measurement_interface,
         'objective': self.objective,
+        'result_index': ResultIndex(self.objective),
         'session': self.session,
         'tuning_run_main': self,
         'tuning_run': self.tuning_run,
@@ -179,19 +225,126 @@ class TuningRunMain(object):
       self.search_driver = self.search_driver_cls(**driver_kwargs)
 
       self.measurement_driver = self.measurement_driver_cls(**driver_kwargs)
+      self.measurement_driver.result_hooks.append(
+        self.search_driver.prepare_result)
       self.measurement_interface.set_driver(self.measurement_driver)
       self.input_manager.set_driver(self.measurement_driver)
 
       self.tuning_run.machine_class = self.measurement_driver.get_machine_class()
       self.tuning_run.input_class = self.input_manager.get_input_class()
 
+      if self.args.distributed_measurement:
+        log.info('waiting for workers: opentuner-worker --database %s '
+                 '--tuning-run %s --interface MODULE:CLASS',
+                 self.args.database, self.tuning_run.uuid)
+
+  def rehash_configurations(self, program):
+    """
+    recompute the legacy Configuration.hash values of program left by a
+    database migration.  Configurations this manipulator cannot hash keep
+    their legacy hash, ones that now collide with another configuration are
+    merged into it.
+    """
+    Configuration = resultsdb.models.Configuration
+    configs = (self.session.query(Configuration)
+               .filter_by(program=program)
+               .filter(Configuration.legacy_hash != None)
+               .filter(Configuration.data != None)
+               .order_by(Configuration.id).all())
+    if not configs:
+      return
+    by_hash = dict((config.hash, config) for config in
+                   self.session.query(Configuration)
+                   .filter_by(program=program, legacy_hash=None)
+                   .filter(Configuration.hash != None))
+    rehashed = skipped = merged = 0
+    for config in configs:
+      try:
+        hashv = self.manipulator.hash_config(config.data)
+      except Exception:
+        # from a program version with different parameters
+        log.debug('cannot rehash configuration %d, keeping its legacy hash',
+                  config.id, exc_info=True)
+        skipped += 1
+        continue
+      existing = by_hash.get(hashv)
+      if existing is None:
+        config.hash = hashv
+        config.legacy_hash = None
+        by_hash[hashv] = config
+        rehashed += 1
+      else:
+        log.debug('configuration %d is a duplicate of %d under the new hash, '
+                  'merging', config.id, existing.id)
+        self.merge_configuration(config, existing)
+        merged += 1
+    log.info('rehashed %d of %d configurations', rehashed, len(configs))
+    if skipped or merged:
+      log.warning('%d configurations could not be rehashed, %d duplicates '
+                  'were merged', skipped, merged)
+    self.commit(force=True)
+    # existing rows were changed, which an incremental dump misses
+    self.dump(full=True)
+
+  def merge_configuration(self, duplicate, configuration):
+    """point everything referencing duplicate to configuration, delete it"""
+    models = resultsdb.models
+    for model, column in ((models.Result, 'configuration_id'),
+                          (models.DesiredResult, 'configuration_id'),
+                          (models.TuningRun, 'final_config_id')):
+      (self.session.query(model)
+       .filter(getattr(model, column) == duplicate.id)
+       .update({column: configuration.id}, synchronize_session=False))
+    self.session.delete(duplicate)
+
   def commit(self, force=False):
-    if (force or not self.fake_commit or
-            time.time() - self.last_commit_time > 30):
+    """
+    commit if forced or self.commit_policy says so, otherwise new objects
+    are left in the session to be written in a later batch
+    """
+    if force or self.commit_policy.should_commit(self.write_stats):
       self.session.commit()
-      self.last_commit_time = time.time()
-    else:
-      self.session.flush()
+      if time.time() - self.last_dump >= self.args.db_dump_interval:
+        self.dump()
+
+  def dump(self, full=False):
+    """checkpoint a --db-profile=memory-then-dump database to its file"""
+    resultsdb.dump(self.engine, full)
+    self.last_dump = time.time()
+
+  def close(self):
+    """commit anything pending and close the session"""
+    if self.closed:
+      return
+    self.closed = True
+    try:
+      self.session.commit()
+      self.dump()
+    finally:
+      self.session.close()
+      self.measurement_interface.close()
+      log.debug('database writes: %s', self.write_stats.summary())
+
+  def install_shutdown_handlers(self):
+    """
+    make sure pending results are written if the process exits without
+    calling close(), including on SIGTERM
+    """
+    # a weak reference, atexit cannot unregister in python 2 and would keep
+    # every TuningRunMain alive
+    atexit.register(_close_at_exit, weakref.ref(self))
+    try:
+      if signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+        signal.signal(signal.SIGTERM, _sigterm_handler)
+    except ValueError:
+      pass  # not the main thread
+
+  def close_at_exit(self):
+    if not self.closed:
+      try:
+        self.close()
+      except Exception:
+        log.error('error writing results at exit', exc_info=True)
 
   def main(self):
     self.init()
@@ -209,13 +362,99 @@ class TuningRunMain(object):
       raise
     finally:
       self.tuning_run.end_date = datetime.now()
-      self.commit(force=True)
-      self.session.close()
+      self.close()
 
   def results_wait(self, generation):
     """called by search_driver to wait for results"""
-    #single process version:
-    self.measurement_driver.process_all()
+    if self.args.distributed_measurement:
+      self.distributed_results_wait()
+    else:
+      #single process version:
+      self.measurement_driver.process_all()
+
+  def results_wait_any(self):
+    """
+    called by search_driver in --async-search mode to start the pending
+    DesiredResults and wait for at least one measurement to finish
+    """
+    if self.args.distributed_measurement:
+      self.distributed_results_wait(wait_for_all=False)
+    else:
+      self.measurement_driver.process_some()
+
+  def measurements_in_flight(self):
+    """number of DesiredResults being measured"""
+    if self.args.distributed_measurement:
+      return self.outstanding_requests_query().count()
+    return self.measurement_driver.in_flight
+
+  def outstanding_requests_query(self):
+    DesiredResult = resultsdb.models.DesiredResult
+    return (self.search_driver.requests_query()
+            .filter(DesiredResult.state.in_(['REQUESTED', 'RUNNING'])))
+
+  def distributed_results_wait(self, wait_for_all=True):
+    """
+    wait for opentuner-worker processes to measure all outstanding
+    DesiredResults (or just one of them)
+    """
+    self.commit(force=True)
+    q = self.outstanding_requests_query()
+    outstanding = q.all()
+    target = 0 if wait_for_all else len(outstanding) - 1
+    remaining = len(outstanding)
+    last_progress = time.time()
+    while outstanding:
+      self.reclaim_stale_requests()
+      count = q.count()
+      if count <= target:
+        break
+      now = time.time()
+      if count < remaining:
+        remaining = count
+        last_progress = now
+      elif now - last_progress > self.distributed_warn_interval:
+        log.warning('no test finished in %.0f seconds, %d outstanding, are '
+                    'opentuner-worker processes running for tuning run %s?',
+                    now - last_progress, count, self.tuning_run.uuid)
+        last_progress = now
+      # end the transaction so the next count sees the workers' commits
+      self.session.commit()
+      time.sleep(self.distributed_poll_interval)
+    # these were completed by other processes, reload them on next access
+    for desired_result in outstanding:
+      self.session.expire(desired_result)
+
+  def reclaim_stale_requests(self):
+    """
+    return DesiredResults claimed longer than --distributed-claim-timeout
+    ago to REQUESTED, their workers are assumed to have died
+    """
+    timeout = getattr(self.args, 'distributed_claim_timeout', None)
+    if not timeout:
+      return
+    DesiredResult = resultsdb.models.DesiredResult
+    cutoff = datetime.now() - timedelta(seconds=timeout)
+    reclaimed = (self.search_driver.requests_query()
+                 .filter_by(state='RUNNING')
+                 .filter(DesiredResult.start_date < cutoff)
+                 .update({'state': 'REQUESTED', 'start_date': None},
+                         synchronize_session='fetch'))
+    if reclaimed:
+      log.warning('requesting %d tests again, claimed by workers more than '
+                  '%.0f seconds ago', reclaimed, timeout)
+      self.session.commit()
+
+
+def _close_at_exit(ref):
+  main = ref()
+  if main is not None:
+    main.close_at_exit()
+
+
+def _sigterm_handler(signum, frame):
+  # unwind normally so TuningRunMain.main() marks the run ABORTED and commits
+  sys.exit(128 + signum)
 
 
 def main(interface, args, *pargs, **kwargs):
@@ -30,4 +30,9 @@ setup(
     packages=['opentuner', 'opentuner.resultsdb', 'opentuner.utils',
               'opentuner.measurement', 'opentuner.search'],
     install_requires=required,
+    entry_points={
+        'console_scripts': [
+            'opentuner-worker = opentuner.measurement.worker:main',
+        ],
+    },
 )
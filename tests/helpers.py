@@ -0,0 +1,35 @@
+import argparse
+
+import opentuner
+from opentuner.search.manipulator import ConfigurationManipulator
+from opentuner.search.manipulator import IntegerParameter
+from opentuner.tuningrunmain import TuningRunMain
+
+
+def integer_space(high, low=0, name='x'):
+  """a ConfigurationManipulator with a single IntegerParameter"""
+  space = ConfigurationManipulator()
+  space.add_parameter(IntegerParameter(name, low, high))
+  return space
+
+
+def tuning_run_main(interface_cls, space, *extra_args, **kwargs):
+  """
+  a TuningRunMain (not yet initialized) of interface_cls searching space,
+  with an in-memory database unless extra_args give a --database.  kwargs
+  are passed to TuningRunMain.
+  """
+  parser = argparse.ArgumentParser(parents=opentuner.argparsers())
+  args = parser.parse_args(['--database', 'sqlite://'] + list(extra_args))
+  interface = interface_cls(args=args, manipulator=space,
+                            project_name='test',
+                            program_name=interface_cls.__name__,
+                            program_version='0.1')
+  return TuningRunMain(interface, args, **kwargs)
+
+
+def tune(interface_cls, space, *extra_args, **kwargs):
+  """run a tuning_run_main() to completion and return it"""
+  main = tuning_run_main(interface_cls, space, *extra_args, **kwargs)
+  main.main()
+  return main
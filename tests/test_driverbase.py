@@ -0,0 +1,24 @@
+import unittest
+
+from opentuner.driverbase import ResultIndex
+from opentuner.resultsdb.models import Configuration, Result
+from opentuner.search.objective import MinimizeTime
+
+
+class ResultIndexTests(unittest.TestCase):
+
+  def setUp(self):
+    self.index = ResultIndex(MinimizeTime())
+    self.config1 = Configuration(hash='1', data={})
+    self.config2 = Configuration(hash='2', data={})
+
+  def test_best(self):
+    slow = Result(configuration=self.config1, time=2.0)
+    fast = Result(configuration=self.config1, time=1.0)
+    self.index.add(slow)
+    self.index.add(fast)
+    self.index.add(slow)
+    self.assertEqual(self.index.count(self.config1), 2)
+    self.assertIs(self.index.best(self.config1), fast)
+    self.assertFalse(self.index.has_results(self.config2))
+    self.assertIsNone(self.index.best(self.config2))
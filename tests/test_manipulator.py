@@ -1,6 +1,7 @@
 import unittest
 import opentuner
 import mock
+import pickle
 import random
 import numpy
 from opentuner.search import manipulator
@@ -268,3 +269,116 @@ class FloatArrayOperatorTests(unittest.TestCase):
 
 
 
+
+
+class UnitVectorTests(unittest.TestCase):
+
+    def setUp(self):
+        self.manipulator = manipulator.ConfigurationManipulator()
+        self.manipulator.add_parameter(manipulator.IntegerParameter("i", 0, 10))
+        self.manipulator.add_parameter(manipulator.FloatParameter("f", -1.0, 1.0))
+        self.manipulator.add_parameter(manipulator.EnumParameter("e", "abc"))
+
+    def test_round_trip(self):
+        cfg = self.manipulator.random()
+        vector = self.manipulator.get_unit_vector(cfg)
+        self.assertEqual(vector.shape, (2,))
+        copy = self.manipulator.seed_config()
+        self.manipulator.set_unit_vector(copy, vector)
+        self.assertEqual(copy["i"], cfg["i"])
+        self.assertAlmostEqual(copy["f"], cfg["f"])
+
+    def test_linear_config_matches_parameters(self):
+        cfgs = [self.manipulator.random() for z in xrange(3)]
+        random.seed(0)
+        expected = self.manipulator.copy(cfgs[0])
+        for p in self.manipulator.params:
+            p.op4_set_linear(expected, cfgs[0], cfgs[1], cfgs[2], 1.0, 0.5, -0.5)
+        random.seed(0)
+        self.assertEqual(
+            self.manipulator.linear_config(1.0, cfgs[0], 0.5, cfgs[1], -0.5, cfgs[2]),
+            expected)
+
+    def test_batches(self):
+        batch = self.manipulator.random_batch(5)
+        self.assertEqual(batch.shape, (5, 2))
+        mutated = self.manipulator.mutate_batch(batch, sigma=0.5)
+        self.assertTrue(((mutated >= 0.0) & (mutated <= 1.0)).all())
+        linear = self.manipulator.linear_batch(1.0, batch, 2.0, mutated, -1.0, batch)
+        self.assertTrue(((linear >= 0.0) & (linear <= 1.0)).all())
+        cfgs = self.manipulator.configs_from_batch(linear)
+        self.assertEqual(len(cfgs), 5)
+        numpy.testing.assert_allclose(self.manipulator.unit_batch(cfgs), linear,
+                                      atol=0.1)
+
+
+class HashConfigTests(unittest.TestCase):
+
+    def setUp(self):
+        self.manipulator = manipulator.ConfigurationManipulator()
+        self.manipulator.add_parameter(manipulator.IntegerParameter("i", 0, 10))
+        self.manipulator.add_parameter(manipulator.LogFloatParameter("f", 1.0, 9.0))
+        self.manipulator.add_parameter(manipulator.PermutationParameter("p", range(5)))
+        self.manipulator.add_parameter(manipulator.FloatArray("a", 4, 1.0, 0.0))
+
+    def test_equal_configs_hash_equal(self):
+        cfg = self.manipulator.random()
+        copy = self.manipulator.copy(cfg)
+        self.assertEqual(self.manipulator.hash_config(cfg),
+                         self.manipulator.hash_config(copy))
+        self.assertEqual(len(self.manipulator.hash_config(cfg)), 64)
+
+    def test_changed_configs_hash_differently(self):
+        cfg = self.manipulator.seed_config()
+        hashes = set([self.manipulator.hash_config(cfg)])
+        cfg["i"] = 1
+        hashes.add(self.manipulator.hash_config(cfg))
+        cfg["p"] = [1, 0, 2, 3, 4]
+        hashes.add(self.manipulator.hash_config(cfg))
+        cfg["a"] = cfg["a"] + 0.5
+        hashes.add(self.manipulator.hash_config(cfg))
+        self.assertEqual(len(hashes), 4)
+
+    def test_hash_function(self):
+        import hashlib
+        m = manipulator.ConfigurationManipulator(hash_function=hashlib.md5)
+        m.add_parameter(manipulator.IntegerParameter("i", 0, 10))
+        self.assertEqual(len(m.hash_config(m.seed_config())), 32)
+
+
+class CopyOnWriteConfigTests(unittest.TestCase):
+
+    def setUp(self):
+        self.manipulator = manipulator.ConfigurationManipulator(
+            config_type=manipulator.CopyOnWriteConfig)
+        self.perm = manipulator.PermutationParameter("perm", range(10))
+        self.selector = manipulator.SelectorParameter("sel", range(4), 64)
+        self.manipulator.add_parameter(self.perm)
+        self.manipulator.add_parameter(self.selector)
+        self.manipulator.add_parameter(manipulator.FloatArray("floats", 4, 1.0, 0.0))
+
+    def test_copy_shares_values(self):
+        cfg = self.manipulator.random()
+        copy = self.manipulator.copy(cfg)
+        self.assertIsInstance(copy, manipulator.CopyOnWriteConfig)
+        self.assertIs(copy["perm"], cfg["perm"])
+
+    def test_mutation_does_not_change_original(self):
+        cfg = self.manipulator.random()
+        original = pickle.loads(pickle.dumps(cfg))
+        copy = self.manipulator.copy(cfg)
+        self.perm.op1_randomize(copy)
+        self.perm.op1_small_random_change(copy, p=1.0)
+        for p in self.selector.sub_parameters():
+            p.op1_randomize(copy)
+        self.manipulator.parameters_dict(copy)["floats"].op1_randomize(copy)
+        self.assertEqual(cfg["perm"], original["perm"])
+        self.assertEqual(cfg["sel"], original["sel"])
+        numpy.testing.assert_array_equal(cfg["floats"], original["floats"])
+
+    def test_pickle(self):
+        cfg = self.manipulator.random()
+        loaded = pickle.loads(pickle.dumps(cfg, 2))
+        self.assertIsInstance(loaded, manipulator.CopyOnWriteConfig)
+        self.assertEqual(self.manipulator.hash_config(loaded),
+                         self.manipulator.hash_config(cfg))
@@ -0,0 +1,477 @@
+import argparse
+import gc
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import weakref
+
+import mock
+
+from opentuner import resultsdb
+from opentuner.measurement.artifactcache import ArtifactCache
+from opentuner.measurement.interface import DefaultMeasurementInterface
+from opentuner.measurement.interface import ProcessRunner
+from opentuner.measurement.interface import ProgressMonitor
+from opentuner.measurement.interface import parse_cpu_list
+from opentuner.measurement.repeat import RepeatedMeasurement
+from opentuner.measurement.server import ServerMeasurementInterface
+from opentuner.measurement.worker import load_interface
+from opentuner.resultsdb.models import DesiredResult, Result
+from opentuner.search.objective import MinimizeMaxRSS
+from opentuner.search.objective import MinimizeTime
+
+from helpers import integer_space, tune, tuning_run_main
+
+
+class CpuListTests(unittest.TestCase):
+
+  def test_parse_cpu_list(self):
+    self.assertEqual(parse_cpu_list('3'), [3])
+    self.assertEqual(parse_cpu_list('0-3'), [0, 1, 2, 3])
+    self.assertEqual(parse_cpu_list('0,2,4-5'), [0, 2, 4, 5])
+
+
+class ProcessRunnerTests(unittest.TestCase):
+
+  def test_output_and_returncode(self):
+    runner = ProcessRunner()
+    child = runner.start('echo out; echo err >&2; exit 3')
+    runner.wait()
+    result = child.result()
+    self.assertEqual(result['stdout'], 'out\n')
+    self.assertEqual(result['stderr'], 'err\n')
+    self.assertEqual(result['returncode'], 3)
+    self.assertFalse(result['timeout'])
+
+  def test_timeout_and_output_limit(self):
+    runner = ProcessRunner(output_limit=10)
+    slow = runner.start('sleep 10', limit=0.1)
+    chatty = runner.start('yes | head -c 100000')
+    runner.wait()
+    self.assertTrue(slow.result()['timeout'])
+    self.assertEqual(slow.result()['time'], float('inf'))
+    self.assertEqual(chatty.result()['stdout'], 'y\n' * 5)
+    self.assertEqual(chatty.result()['returncode'], 0)
+
+  def measure_closed_output(self):
+    """time a process that closes its output, and the number of polls"""
+    runner = ProcessRunner()
+    polls = []
+    poll = runner.poll
+    runner.poll = lambda timeout: polls.append(timeout) or poll(timeout)
+    child = runner.start('exec 1>&- 2>&-; sleep 0.3')
+    runner.wait()
+    return child.result()['time'], len(polls)
+
+  def test_time_after_closing_output(self):
+    closed, polls = self.measure_closed_output()
+    self.assertGreaterEqual(closed, 0.3)
+    self.assertLess(closed, 0.3 + 0.05)
+    # woken by the exit instead of polling for it
+    self.assertLess(polls, 10)
+
+  def test_sigchld_without_pidfd(self):
+    with mock.patch('opentuner.measurement.interface._the_pidfd_support',
+                    False):
+      closed, polls = self.measure_closed_output()
+    self.assertLess(closed, 0.3 + 0.05)
+    self.assertLess(polls, 10)
+    self.assertEqual(signal.getsignal(signal.SIGCHLD), signal.SIG_DFL)
+
+  def test_rusage(self):
+    runner = ProcessRunner()
+    child = runner.start(['python', '-c', 'x = " " * 50000000'])
+    runner.wait()
+    result = child.result()
+    self.assertGreater(result['max_rss'], 50000000)
+    self.assertGreater(result['user_time'] + result['system_time'], 0)
+    self.assertGreater(result['page_faults'], 0)
+
+
+class ProgressMonitorTests(unittest.TestCase):
+
+  def test_projection(self):
+    monitor = ProgressMonitor(MinimizeTime(), Result(time=1.0), margin=1.2)
+    self.assertTrue(monitor.update(0.05, Result(time=0.9)))
+    self.assertTrue(monitor.update(0.5, Result(time=0.55)))
+    self.assertFalse(monitor.update(0.5, Result(time=0.65)))
+    # stays stopped
+    self.assertFalse(monitor.update(0.9, Result(time=0.1)))
+
+  def test_raw_time(self):
+    # best took 2.0s on a machine that has become twice as slow
+    best = Result(time=1.0, raw_time=2.0, drift_factor=2.0)
+    monitor = ProgressMonitor(MinimizeTime(), best)
+    self.assertTrue(monitor.update(0.5, Result(time=0.9)))
+    self.assertFalse(monitor.update(0.5, Result(time=1.1)))
+
+  def test_kills_process(self):
+    runner = ProcessRunner()
+    monitor = ProgressMonitor(MinimizeTime(), Result(time=0.05))
+    child = runner.start('for i in 1 2 3 4 5 6 7 8 9 10; do '
+                         'echo $i; sleep 0.1; done',
+                         progress=lambda line: int(line) / 10.0,
+                         monitor=monitor)
+    runner.wait()
+    result = child.result()
+    self.assertTrue(result['terminated'])
+    self.assertTrue(result['timeout'])
+    self.assertLess(child.end_time - child.start_time, 0.5)
+
+
+class RepeatedMeasurementTests(unittest.TestCase):
+
+  def measure(self, times, best=None, **kwargs):
+    times = iter(times)
+    repeater = RepeatedMeasurement(MinimizeTime(), **kwargs)
+    return repeater.measure(lambda: Result(time=next(times)), best)
+
+  def test_until_confident(self):
+    result = self.measure([1.0, 1.1, 1.0, 1.02, 1.0, 0.99, 1.0],
+                          target=0.05, max_repeats=10)
+    self.assertEqual(result.repeats, 6)
+    self.assertAlmostEqual(result.time, 1.0183333, 6)
+    self.assertLess(result.confidence, 0.05 * result.time)
+    self.assertGreater(result.time_stddev, 0)
+
+  def test_race(self):
+    best = Result(time=1.0, confidence=0.01)
+    result = self.measure([1.5, 1.7, 1.6] + [1.0] * 10, best=best,
+                          target=0.001, max_repeats=10)
+    self.assertEqual(result.repeats, 3)
+
+  def test_failures_not_repeated(self):
+    result = self.measure([None, 1.0], max_repeats=10)
+    self.assertIsNone(result.time)
+    self.assertIsNone(result.repeats)
+
+  def test_keeps_samples_before_failure(self):
+    result = self.measure([1.0, 1.2, None, 1.0], max_repeats=10)
+    self.assertAlmostEqual(result.time, 1.1)
+    self.assertEqual(result.repeats, 2)
+    self.assertEqual(result.failed_repeats, 1)
+
+
+# sleeps for config['sleep'] seconds, exits if it is negative.  Speaks the
+# protocol directly as importing opentuner takes most of a second.
+TEST_SERVER = """
+import json, os, struct, sys, time
+while True:
+  header = sys.stdin.read(4)
+  if not header:
+    break
+  config = json.loads(sys.stdin.read(struct.unpack('>I', header)[0]))['config']
+  if config['sleep'] < 0:
+    os._exit(1)
+  time.sleep(config['sleep'])
+  reply = json.dumps({'time': config['sleep'], 'accuracy': 1.0, 'unknown': 2})
+  sys.stdout.write(struct.pack('>I', len(reply)) + reply)
+  sys.stdout.flush()
+"""
+
+
+class SleepServerInterface(ServerMeasurementInterface):
+  def server_command(self):
+    return [sys.executable, '-c', TEST_SERVER]
+
+
+class FakeConfiguration(object):
+  def __init__(self, data):
+    self.configuration = self
+    self.data = data
+
+
+class ServerMeasurementTests(unittest.TestCase):
+
+  def setUp(self):
+    self.interface = SleepServerInterface(
+      args=argparse.Namespace(parallelism=1), manipulator=None)
+
+  def tearDown(self):
+    self.interface.close_servers()
+
+  def run_sleep(self, seconds, limit=None):
+    return self.interface.run(FakeConfiguration({'sleep': seconds}), None,
+                              limit)
+
+  def test_reuses_server(self):
+    self.assertEqual(self.run_sleep(0.0).time, 0.0)
+    result = self.run_sleep(0.01)
+    self.assertEqual((result.time, result.accuracy), (0.01, 1.0))
+    self.assertEqual(self.interface.servers[None].requests, 2)
+
+  def test_restarts(self):
+    self.assertEqual(self.run_sleep(-1).state, 'ERROR')
+    self.assertEqual(self.run_sleep(10, limit=0.1).state, 'TIMEOUT')
+    self.assertEqual(self.interface.pids, [])
+    self.assertEqual(self.run_sleep(0.0).time, 0.0)
+    self.assertEqual(len(self.interface.pids), 1)
+
+  def test_closed_with_tuning_run(self):
+    main = tune(SleepServerInterface, integer_space(0, name='sleep'),
+                '--test-limit', '2')
+    interface = main.measurement_interface
+    self.assertEqual((interface.servers, interface.pids), ({}, []))
+    ref = weakref.ref(interface)
+    del main, interface
+    gc.collect()
+    self.assertIsNone(ref())
+
+
+class PipelineInterface(DefaultMeasurementInterface):
+  """records when each id is compiled and run, every fourth compile is slow"""
+
+  def __init__(self, *pargs, **kwargs):
+    super(PipelineInterface, self).__init__(*pargs, **kwargs)
+    self.parallel_compile = True
+    self.events = []
+    self.events_lock = threading.Lock()
+
+  def record(self, event, id):
+    with self.events_lock:
+      self.events.append((time.time(), event, id))
+
+  def compile(self, config_data, id):
+    self.record('compile', id)
+    time.sleep(0.1 if id % 4 == 0 else 0.01)
+    self.record('compiled', id)
+    return id
+
+  def run_precompiled(self, desired_result, input, limit, compile_result, id):
+    self.record('run', compile_result)
+    return Result(time=float(desired_result.configuration.data['x']))
+
+
+class PipelineTests(unittest.TestCase):
+
+  def test_runs_start_as_compiles_finish(self):
+    main = tune(PipelineInterface, integer_space(1000), '--test-limit', '8',
+                '--no-dups')
+    events = sorted(main.measurement_interface.events)
+    order = [(event, id) for t, event, id in events]
+    runs = [id for event, id in order if event == 'run']
+    self.assertGreaterEqual(len(runs), 8)
+    for id in runs:
+      self.assertLess(order.index(('compiled', id)), order.index(('run', id)))
+    # some run did not wait for a slow compile of its generation
+    self.assertTrue(any(
+      order.index(('run', id)) < order.index(('compiled', slow))
+      for id in runs for slow in runs if slow % 4 == 0))
+
+
+class CountingInterface(DefaultMeasurementInterface):
+  def __init__(self, *pargs, **kwargs):
+    super(CountingInterface, self).__init__(*pargs, **kwargs)
+    self.runs = 0
+
+  def run(self, desired_result, input, limit):
+    self.runs += 1
+    return Result(time=float(desired_result.configuration.data['x'] + 1))
+
+  def seed_configurations(self):
+    # both configurations of integer_space(1), so every run tests each
+    return [{'x': 0}, {'x': 1}]
+
+
+class ReuseResultsTests(unittest.TestCase):
+
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.database = 'sqlite:///' + os.path.join(self.tmpdir, 'test.db')
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def tune(self, *extra_args):
+    main = tune(CountingInterface, integer_space(1), '--database',
+                self.database, '--test-limit', '4', '--no-dups', *extra_args)
+    results = main.session.query(Result).filter_by(
+      tuning_run=main.tuning_run).all()
+    return main.measurement_interface.runs, results
+
+  def test_reuse(self):
+    runs, results = self.tune()
+    self.assertEqual(runs, 2)
+    runs, results = self.tune('--reuse-results')
+    self.assertEqual(runs, 0)
+    self.assertEqual(len(results), 2)
+    for result in results:
+      self.assertIsNotNone(result.reused_from)
+      self.assertIsNone(result.reused_from.reused_from)
+      self.assertEqual(result.time, result.reused_from.time)
+      self.assertEqual(result.collection_cost, 0.0)
+
+  def test_reuse_drift_corrected(self):
+    runs, results = self.tune()
+    engine, Session = resultsdb.connect(self.database)
+    # as if measured twice as slow and corrected by DriftCorrectionPlugin
+    engine.execute('UPDATE result SET raw_time = 2 * time, drift_factor = 2')
+    engine.dispose()
+    runs, results = self.tune('--reuse-results')
+    self.assertEqual(runs, 0)
+    for result in results:
+      self.assertEqual(result.time, result.reused_from.raw_time)
+      self.assertEqual(result.time, 2 * result.reused_from.time)
+
+  def test_ttl_and_revalidate(self):
+    self.tune()
+    self.assertEqual(self.tune('--reuse-results', '--reuse-ttl', '0')[0], 2)
+    self.assertEqual(self.tune('--reuse-results',
+                               '--reuse-revalidate', '1')[0], 2)
+
+
+class AllocatingInterface(DefaultMeasurementInterface):
+  def objective(self):
+    return MinimizeMaxRSS()
+
+  def run(self, desired_result, input, limit):
+    # large enough to stand out over the forked test runner's own rss
+    size = (desired_result.configuration.data['x'] + 1) * 100000000
+    run_result = self.call_program(['python', '-c', 'x = " " * %d' % size])
+    return Result(time=run_result['time'])
+
+  def seed_configurations(self):
+    return [{'x': 0}, {'x': 1}]
+
+
+class ResourceUsageTests(unittest.TestCase):
+
+  def test_filled_from_call_program(self):
+    main = tune(AllocatingInterface, integer_space(1), '--test-limit', '4',
+                '--no-dups')
+    results = main.session.query(Result).filter_by(
+      tuning_run=main.tuning_run).all()
+    self.assertEqual(len(results), 2)
+    for result in results:
+      self.assertGreater(result.max_rss, 100000000)
+      self.assertIsNotNone(result.user_time)
+    best = main.search_driver.best_result
+    self.assertEqual(best.configuration.data['x'], 0)
+
+
+class ArtifactCacheTests(unittest.TestCase):
+
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def write(self, name, size):
+    path = os.path.join(self.tmpdir, name)
+    with open(path, 'wb') as fd:
+      fd.write('x' * size)
+    return path
+
+  def test_get_put(self):
+    cache = ArtifactCache(os.path.join(self.tmpdir, 'cache'))
+    key = cache.key(('gcc', ['-O2']))
+    dest = os.path.join(self.tmpdir, 'out', 'a.out')
+    self.assertEqual(cache.get(key, dest), (False, None))
+    cache.put(key, self.write('a.out', 10), 'ok')
+    self.assertEqual(cache.get(key, dest), (True, 'ok'))
+    self.assertEqual(os.path.getsize(dest), 10)
+
+  def test_lru_eviction(self):
+    # 10 bytes of artifact and 4 of pickled None per entry
+    cache = ArtifactCache(os.path.join(self.tmpdir, 'cache'), max_bytes=30)
+    for name in 'abc':
+      cache.put(cache.key(name), self.write(name, 10))
+      # distinct mtimes
+      os.utime(cache.path(cache.key(name)), (0, ord(name)))
+    # b and c fit
+    self.assertFalse(cache.get(cache.key('a'), self.write('x', 0))[0])
+    self.assertTrue(cache.get(cache.key('b'), self.write('x', 0))[0])
+    cache.put(cache.key('d'), self.write('d', 10))
+    # c is now the least recently used
+    self.assertFalse(cache.get(cache.key('c'), self.write('x', 0))[0])
+    self.assertTrue(cache.get(cache.key('b'), self.write('x', 0))[0])
+
+  def test_value_size(self):
+    cache = ArtifactCache(os.path.join(self.tmpdir, 'cache'), max_bytes=100)
+    cache.put(cache.key('a'), self.write('a', 10), 'y' * 100)
+    self.assertEqual(cache.entries(), [])
+
+  def test_fingerprint_manipulator(self):
+    interface = DefaultMeasurementInterface(manipulator=integer_space(10))
+    with mock.patch.object(interface, 'manipulator',
+                           wraps=interface.manipulator) as manipulator:
+      for x in xrange(3):
+        interface.build_fingerprint({'x': x})
+    self.assertEqual(manipulator.call_count, 1)
+
+
+class LoggingInterface(DefaultMeasurementInterface):
+  """appends the pid and DesiredResult id of each test to database.log"""
+
+  def run(self, desired_result, input, limit):
+    path = self.args.database.split('///', 1)[1] + '.log'
+    with open(path, 'a') as fd:
+      fd.write('%d %d\n' % (os.getpid(), desired_result.id))
+    time.sleep(0.01)
+    return Result(time=float(desired_result.configuration.data['x']))
+
+
+class WorkerTests(unittest.TestCase):
+
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.path = os.path.join(self.tmpdir, 'test.db')
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def test_load_interface(self):
+    self.assertIs(load_interface('opentuner.measurement.interface:'
+                                 'DefaultMeasurementInterface'),
+                  DefaultMeasurementInterface)
+    self.assertRaises(ValueError, load_interface, 'DefaultMeasurementInterface')
+
+  def test_two_workers(self):
+    database = 'sqlite:///' + self.path
+    main = tuning_run_main(LoggingInterface, integer_space(1000),
+                           '--database', database, '--db-profile', 'safe',
+                           '--distributed-measurement', '--test-limit', '40',
+                           '--parallelism', '8', '--no-dups', '--quiet')
+    main.init()
+    main.commit(force=True)
+    source = os.path.splitext(os.path.abspath(__file__))[0] + '.py'
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(sys.path)
+    workers = [subprocess.Popen([sys.executable, '-m',
+                                 'opentuner.measurement.worker',
+                                 '--database', database,
+                                 '--tuning-run', main.tuning_run.uuid,
+                                 '--interface', source + ':LoggingInterface',
+                                 '--poll-interval', '0.02',
+                                 '--exit-when-idle', '60'], env=env)
+               for z in xrange(2)]
+    try:
+      main.main()
+      for worker in workers:
+        self.assertEqual(worker.wait(), 0)
+    finally:
+      for worker in workers:
+        if worker.poll() is None:
+          worker.kill()
+    with open(self.path + '.log') as fd:
+      measured = [int(line.split()[1]) for line in fd]
+    engine, Session = resultsdb.connect(database)
+    run_id = main.tuning_run.id
+    drs = Session.query(DesiredResult).filter_by(tuning_run_id=run_id).all()
+    results = Session.query(Result).filter_by(tuning_run_id=run_id).all()
+    self.assertGreaterEqual(len(drs), 40)
+    self.assertTrue(all(dr.state == 'COMPLETE' for dr in drs))
+    # every test was claimed and measured by exactly one worker
+    self.assertEqual(len(measured), len(set(measured)))
+    self.assertEqual(len(measured), len(results))
+    self.assertEqual(set(dr.result_id for dr in drs if dr.id in measured),
+                     set(r.id for r in results))
+    Session.remove()
+    engine.dispose()
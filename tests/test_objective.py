@@ -0,0 +1,55 @@
+import unittest
+
+from opentuner.resultsdb.models import Result
+from opentuner.search.objective import (MinimizeCPUTime, MinimizeMaxRSS,
+                                        MinimizeTime,
+                                        ThresholdMemoryMinimizeTime)
+
+
+class ResourceObjectiveTests(unittest.TestCase):
+
+  def setUp(self):
+    self.small_slow = Result(time=2.0, user_time=1.0, system_time=0.5,
+                             max_rss=100.0)
+    self.big_fast = Result(time=1.0, user_time=0.5, system_time=0.5,
+                           max_rss=300.0)
+    self.unmeasured = Result(time=0.5)
+
+  def test_minimize_cpu_time(self):
+    objective = MinimizeCPUTime()
+    self.assertTrue(objective.lt(self.big_fast, self.small_slow))
+    self.assertTrue(objective.lt(self.small_slow, self.unmeasured))
+
+  def test_minimize_max_rss(self):
+    objective = MinimizeMaxRSS()
+    self.assertTrue(objective.lt(self.small_slow, self.big_fast))
+    self.assertTrue(objective.lt(self.big_fast, self.unmeasured))
+
+  def test_threshold_memory(self):
+    objective = ThresholdMemoryMinimizeTime(200.0)
+    self.assertTrue(objective.lt(self.small_slow, self.big_fast))
+    self.assertTrue(objective.is_acceptable(self.small_slow))
+    self.assertFalse(objective.is_acceptable(self.unmeasured))
+    objective = ThresholdMemoryMinimizeTime(400.0)
+    self.assertTrue(objective.lt(self.big_fast, self.small_slow))
+
+  def test_threshold_memory_relative(self):
+    objective = ThresholdMemoryMinimizeTime(200.0)
+    # small_slow is within the target, big_fast is not
+    self.assertAlmostEqual(objective.relative(self.small_slow, self.big_fast),
+                           200.0 / 300.0)
+    self.assertEqual(objective.relative(self.big_fast, self.unmeasured), 0.0)
+    objective = ThresholdMemoryMinimizeTime(400.0)
+    self.assertAlmostEqual(objective.relative(self.big_fast, self.small_slow),
+                           0.5)
+
+
+class ProjectCompareTests(unittest.TestCase):
+
+  def test_projects_both(self):
+    objective = MinimizeTime()
+    # a is ahead now, but b is improving faster
+    a1, a2 = Result(time=2.0), Result(time=1.0)
+    b1, b2 = Result(time=4.0), Result(time=1.5)
+    self.assertLess(objective.project_compare(a1, a2, b1, b2, 0.0), 0)
+    self.assertGreater(objective.project_compare(a1, a2, b1, b2, 1.0), 0)
@@ -0,0 +1,148 @@
+import gc
+import os
+import shutil
+import tempfile
+import unittest
+import weakref
+
+import sqlalchemy
+from sqlalchemy.orm import sessionmaker
+
+from opentuner import resultsdb
+from opentuner.measurement.interface import DefaultMeasurementInterface
+from opentuner.resultsdb.models import (Base, Configuration, DesiredResult,
+                                       Result)
+from opentuner.resultsdb.persistence import (AnyCommitPolicy,
+                                             ResultCountCommitPolicy,
+                                             RowCountCommitPolicy,
+                                             TimeCommitPolicy, WriteStats)
+
+from helpers import integer_space, tuning_run_main
+
+
+class WriteStatsTests(unittest.TestCase):
+
+  def setUp(self):
+    engine = sqlalchemy.create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    self.session = sessionmaker(bind=engine, autoflush=False)()
+    self.stats = WriteStats(self.session)
+
+  def test_counters(self):
+    config = Configuration(hash='1', data={})
+    self.session.add(config)
+    self.session.add(Result(configuration=config, time=1.0))
+    self.assertEqual(self.stats.pending_results, 1)
+    self.assertEqual(self.stats.pending_rows, 2)
+    self.session.flush()
+    self.assertEqual(self.stats.flushes, 1)
+    self.assertEqual(self.stats.rows_written, 2)
+    self.session.commit()
+    self.assertEqual(self.stats.commits, 1)
+    self.assertEqual(self.stats.pending_rows, 0)
+
+  def test_policies(self):
+    self.stats.pending_results = 3
+    self.stats.pending_rows = 10
+    self.assertTrue(ResultCountCommitPolicy(3).should_commit(self.stats))
+    self.assertFalse(ResultCountCommitPolicy(4).should_commit(self.stats))
+    self.assertFalse(RowCountCommitPolicy(11).should_commit(self.stats))
+    self.assertFalse(TimeCommitPolicy(60).should_commit(self.stats))
+    self.assertTrue(TimeCommitPolicy(-1).should_commit(self.stats))
+    self.assertTrue(AnyCommitPolicy([TimeCommitPolicy(60),
+                                     RowCountCommitPolicy(10)])
+                    .should_commit(self.stats))
+
+
+class DbProfileTests(unittest.TestCase):
+
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.dbstr = 'sqlite:///' + os.path.join(self.tmpdir, 'test.db')
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def count_configurations(self, profile=None):
+    engine, Session = resultsdb.connect(self.dbstr, profile)
+    count = Session.query(Configuration).count()
+    Session.remove()
+    engine.dispose()
+    return count
+
+  def test_memory_then_dump(self):
+    engine, Session = resultsdb.connect(self.dbstr, 'memory-then-dump')
+    Session.add(Configuration(hash='1', data={'x': 1}))
+    Session.commit()
+    self.assertEqual(self.count_configurations(), 0)
+    resultsdb.dump(engine)
+    Session.remove()
+    self.assertEqual(self.count_configurations(), 1)
+    # loaded back into memory by the next run
+    self.assertEqual(self.count_configurations('memory-then-dump'), 1)
+
+  def test_incremental_dump(self):
+    engine, Session = resultsdb.connect(self.dbstr, 'memory-then-dump')
+    config = Configuration(hash='1', data={'x': 1})
+    dr = DesiredResult(configuration=config, state='REQUESTED')
+    Session.add(dr)
+    Session.commit()
+    resultsdb.dump(engine)
+    file_engine = sqlalchemy.create_engine(self.dbstr)
+    file_engine.execute("UPDATE configuration SET hash = 'file'")
+    dr.state = 'COMPLETE'
+    Session.add(Configuration(hash='2', data={'x': 2}))
+    Session.commit()
+    resultsdb.dump(engine)
+    # the changed DesiredResult and the new Configuration are written, the
+    # unchanged Configuration is not copied again
+    self.assertEqual(
+      file_engine.execute('SELECT hash FROM configuration ORDER BY id')
+      .fetchall(), [('file',), ('2',)])
+    self.assertEqual(
+      file_engine.execute('SELECT state FROM desired_result').scalar(),
+      'COMPLETE')
+    resultsdb.dump(engine, full=True)
+    self.assertEqual(
+      file_engine.execute('SELECT hash FROM configuration ORDER BY id')
+      .fetchall(), [('1',), ('2',)])
+    Session.remove()
+    file_engine.dispose()
+
+  def test_fast(self):
+    engine, Session = resultsdb.connect(self.dbstr, 'fast')
+    self.assertEqual(engine.execute('PRAGMA journal_mode').scalar(), 'wal')
+    Session.remove()
+
+
+class TuningRunMainTests(unittest.TestCase):
+
+  def test_rehash_legacy_configurations(self):
+    space = integer_space(10)
+    main = tuning_run_main(DefaultMeasurementInterface, space)
+    session = main.session
+    program = main.measurement_interface.db_program_version(session).program
+    configs = [Configuration(program=program, hash=h, legacy_hash=h, data=d)
+               for h, d in (('a', {'x': 1}), ('b', {'x': 1}), ('c', {'y': 1}))]
+    session.add_all(configs)
+    result = Result(configuration=configs[1], time=1.0)
+    session.add(result)
+    session.commit()
+    main.rehash_configurations(program)
+    session.expire_all()
+    a, c = session.query(Configuration).order_by(Configuration.id).all()
+    self.assertEqual((a.hash, a.legacy_hash),
+                     (space.hash_config({'x': 1}), None))
+    # a duplicate of a under the new hash, merged into it
+    self.assertIs(result.configuration, a)
+    # cannot be hashed by this manipulator
+    self.assertEqual((c.hash, c.legacy_hash), ('c', 'c'))
+    main.close()
+
+  def test_closed_main_not_kept_alive(self):
+    main = tuning_run_main(DefaultMeasurementInterface, integer_space(10))
+    main.close()
+    ref = weakref.ref(main)
+    del main
+    gc.collect()
+    self.assertIsNone(ref())
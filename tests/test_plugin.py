@@ -0,0 +1,177 @@
+import unittest
+
+import mock
+from opentuner.measurement.interface import DefaultMeasurementInterface
+from opentuner.resultsdb.models import Configuration, DesiredResult, Result
+from opentuner.search.manipulator import BooleanParameter
+from opentuner.search.manipulator import ConfigurationManipulator
+from opentuner.search.manipulator import IntegerParameter
+from opentuner.search.plugin import DriftCorrectionPlugin, FailurePredictor
+
+from helpers import integer_space, tune
+
+
+class FakeSession(object):
+  def __init__(self):
+    self.added = []
+
+  def add(self, obj):
+    self.added.append(obj)
+
+
+class FakeDriver(object):
+  def __init__(self):
+    self.session = FakeSession()
+    self.tuning_run = None
+    self.generation = 0
+    self.test_count = 0
+    self.best_result = None
+
+
+class DriftCorrectionTests(unittest.TestCase):
+
+  def setUp(self):
+    self.driver = FakeDriver()
+    self.plugin = DriftCorrectionPlugin(2, smoothing=0.5)
+    self.plugin.set_driver(self.driver)
+    self.reference = Configuration(hash='r', data={})
+
+  def remeasure(self, time):
+    self.driver.test_count += 2
+    self.plugin.before_techniques()
+    dr, = self.driver.session.added[-1:]
+    self.assertEqual(dr.requestor, 'drift')
+    dr.result = Result(configuration=dr.configuration, time=time)
+    self.plugin.before_result(dr.result)
+    return dr
+
+  def test_reference_drift(self):
+    first = Result(configuration=self.reference, time=1.0)
+    self.plugin.before_result(first)
+    self.assertEqual((first.time, first.raw_time, first.drift_factor),
+                     (1.0, 1.0, 1.0))
+    dr = self.remeasure(2.0)
+    self.assertIs(dr.configuration, self.reference)
+    self.assertEqual(self.plugin.drift_factor, 1.5)
+    self.assertEqual(dr.result.raw_time, 2.0)
+    later = Result(configuration=Configuration(hash='a', data={}), time=3.0)
+    self.plugin.before_result(later)
+    self.assertEqual((later.time, later.raw_time, later.drift_factor),
+                     (2.0, 3.0, 1.5))
+
+  def test_alternates_with_best(self):
+    self.plugin.before_result(Result(configuration=self.reference, time=1.0))
+    best = Result(configuration=Configuration(hash='b', data={}), time=0.5)
+    self.plugin.before_result(best)
+    self.driver.best_result = best
+    self.assertIs(self.remeasure(1.0).configuration, self.reference)
+    self.assertIs(self.remeasure(0.5).configuration, best.configuration)
+    # nothing new is requested until the interval passes
+    self.plugin.before_techniques()
+    self.assertEqual(len(self.driver.session.added), 2)
+
+  def test_failures_not_corrected(self):
+    self.plugin.drift_factor = 2.0
+    timeout = Result(state='TIMEOUT', time=float('inf'))
+    self.plugin.before_result(timeout)
+    self.assertEqual(timeout.time, float('inf'))
+    self.assertIsNone(self.plugin.reference)
+
+
+class SlowingInterface(DefaultMeasurementInterface):
+  """every test runs 5% slower than the one before"""
+
+  def __init__(self, *pargs, **kwargs):
+    super(SlowingInterface, self).__init__(*pargs, **kwargs)
+    self.runs = 0
+
+  def run(self, desired_result, input, limit):
+    self.runs += 1
+    x = desired_result.configuration.data['x']
+    return Result(time=(x + 1.0) * 1.05 ** self.runs)
+
+
+class DriftCorrectionTuningTests(unittest.TestCase):
+
+  def test_index_ranks_corrected_times(self):
+    main = tune(SlowingInterface, integer_space(20), '--test-limit', '40',
+                '--drift-interval', '4', '--quiet')
+    driver = main.search_driver
+    results = main.session.query(Result).filter_by(
+      tuning_run=main.tuning_run).all()
+    self.assertTrue(any(r.drift_factor != 1.0 for r in results))
+    for result in results:
+      self.assertAlmostEqual(result.time,
+                             result.raw_time / result.drift_factor)
+    self.assertIs(driver.result_index.best_result, driver.best_result)
+    self.assertEqual(driver.best_result.time, min(r.time for r in results))
+
+
+class FailingInterface(DefaultMeasurementInterface):
+  """configurations with x above 700 fail"""
+
+  def run(self, desired_result, input, limit):
+    x = desired_result.configuration.data['x']
+    if x > 700:
+      return Result(state='ERROR', time=float('inf'))
+    return Result(time=float(x))
+
+
+class FailurePredictorTests(unittest.TestCase):
+
+  def setUp(self):
+    self.manipulator = ConfigurationManipulator()
+    self.manipulator.add_parameter(IntegerParameter('x', 0, 1000))
+    self.manipulator.add_parameter(BooleanParameter('b'))
+
+  def results(self, count):
+    rv = []
+    for i in xrange(count):
+      cfg = self.manipulator.random()
+      rv.append(Result(configuration=Configuration(data=cfg),
+                       state='ERROR' if cfg['x'] > 700 else 'OK'))
+    return rv
+
+  def tune(self, *extra_args):
+    return tune(FailingInterface, self.manipulator, '--test-limit', '200',
+                '--no-dups', '--technique', 'PureRandom',
+                '--failure-threshold', '0.5', '--quiet', *extra_args)
+
+  def test_online_training(self):
+    predictor = FailurePredictor(threshold=0.5)
+    predictor.set_driver(mock.Mock(manipulator=self.manipulator))
+    self.assertIsNone(predictor.probability({'x': 900, 'b': False}))
+    for result in self.results(1000):
+      predictor.on_result(result)
+    self.assertGreater(predictor.probability({'x': 950, 'b': True}), 0.5)
+    self.assertLess(predictor.probability({'x': 100, 'b': True}), 0.5)
+    self.assertGreater(predictor.precision(), 0.5)
+    self.assertGreater(predictor.recall(), 0.5)
+
+  def test_resume(self):
+    predictor = FailurePredictor(threshold=0.5)
+    driver = mock.Mock(manipulator=self.manipulator)
+    query = driver.results_query.return_value.filter.return_value
+    query.filter.return_value.order_by.return_value = self.results(1000)
+    predictor.set_driver(driver)
+    predictor.before_main()
+    self.assertEqual(predictor.results, 1000)
+    self.assertGreater(predictor.probability({'x': 950, 'b': True}), 0.5)
+    # earlier results are not predictions
+    self.assertIsNone(predictor.precision())
+
+  def test_rejects_failures(self):
+    main = self.tune()
+    aborted = [dr.configuration.data['x'] for dr in
+               main.session.query(DesiredResult).filter_by(state='ABORTED')]
+    self.assertTrue(aborted)
+    # mostly configurations that would have failed
+    self.assertGreater(sum(1 for x in aborted if x > 700), len(aborted) / 2)
+    self.assertIsNotNone(main.search_driver.failure_probability({'x': 0,
+                                                                 'b': True}))
+
+  def test_explore(self):
+    main = self.tune('--failure-explore', '1')
+    self.assertEqual(main.session.query(DesiredResult)
+                     .filter_by(state='ABORTED').count(), 0)
+    self.assertGreater(main.search_driver.failure_predictor.explored, 0)
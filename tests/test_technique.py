@@ -1,8 +1,22 @@
 import unittest
 import opentuner
 import mock
+import numpy
+import sqlalchemy
+from opentuner.measurement.inputmanager import FidelityInputManager
+from opentuner.measurement.interface import DefaultMeasurementInterface
+from opentuner.resultsdb.models import (BanditArmStats, Configuration,
+                                       DesiredResult, Result)
 from opentuner.search.composableevolutionarytechniques import ComposableEvolutionaryTechnique
 from opentuner.search import manipulator
+from opentuner.search.bandittechniques import BatchAUCBanditQueue
+from opentuner.search.cmaes import CMAES
+from opentuner.search.differentialevolution import DifferentialEvolution
+from opentuner.search.driver import SearchDriver
+from opentuner.search.surrogate import (ConfigEncoder, GaussianProcess,
+                                        expected_improvement)
+
+from helpers import integer_space, tune
 
 def faked_random(nums):
   f = fake_random(nums)
@@ -75,3 +89,281 @@ class ComposableSearchTechniqueTests(unittest.TestCase):
     op3_cross_func.assert_called_once_with('p1', 'p2', 'p3', xchoice='op3_cross_CX')
 
 #TODO tests for RandomThreeParentsComposableTechnique
+
+
+class FidelityInterface(DefaultMeasurementInterface):
+  """x is best at 3, the ranking is the same on all input sizes"""
+
+  def input_manager(self):
+    return FidelityInputManager([1, 3, 9])
+
+  def run(self, desired_result, input, limit):
+    x = desired_result.configuration.data['x']
+    return Result(time=float(abs(x - 3) + 1) * input.input_class.size)
+
+
+class DistanceInterface(DefaultMeasurementInterface):
+  """x is best at 3"""
+
+  def run(self, desired_result, input, limit):
+    return Result(time=float(abs(desired_result.configuration.data['x'] - 3)))
+
+
+class HyperbandTests(unittest.TestCase):
+
+  def tune(self, technique_name):
+    return tune(FidelityInterface, integer_space(100), '--test-limit', '40',
+                '--no-dups', '--technique', technique_name)
+
+  def test_successive_halving(self):
+    main = self.tune('SuccessiveHalving')
+    counts = dict(main.session.query(Result.fidelity,
+                                     sqlalchemy.func.count(Result.id))
+                  .group_by(Result.fidelity))
+    # brackets of 9 configurations on the smallest input, 3 on the middle
+    # and 1 on the full input
+    self.assertGreater(counts[0], counts[1])
+    self.assertGreater(counts[1], counts[None])
+    self.assertGreaterEqual(counts[None], 2)
+    best = main.search_driver.best_result
+    self.assertIsNone(best.fidelity)
+    self.assertEqual(best.input.input_class.size, 9)
+    self.assertEqual(main.search_driver.results_query(objective_ordered=True)
+                     .first().time, best.time)
+
+  def test_hyperband(self):
+    main = self.tune('Hyperband')
+    fidelities = set(fidelity for fidelity, in
+                     main.session.query(DesiredResult.fidelity))
+    self.assertEqual(fidelities, set([0, 1, None]))
+
+
+class SurrogateTests(unittest.TestCase):
+
+  def setUp(self):
+    self.manipulator = manipulator.ConfigurationManipulator()
+    self.manipulator.add_parameter(manipulator.FloatParameter('f', 0.0, 1.0))
+    self.manipulator.add_parameter(manipulator.BooleanParameter('b'))
+    self.manipulator.add_parameter(manipulator.EnumParameter('e', 'xyz'))
+    self.manipulator.add_parameter(
+      manipulator.PermutationParameter('p', [0, 1, 2, 3]))
+    self.encoder = ConfigEncoder(self.manipulator)
+
+  def test_encoding(self):
+    cfg = {'f': 0.25, 'b': True, 'e': 'y', 'p': [3, 0, 1, 2]}
+    row = self.encoder.encode(cfg)
+    self.assertEqual(list(row), [0.25, 1.0, 0.0, 1.0, 0.0,
+                                 1.0 / 3, 2.0 / 3, 1.0, 0.0])
+    self.assertEqual(self.encoder.decode(row, self.manipulator.random()), cfg)
+
+  def test_random_batch_decodes(self):
+    for row in self.encoder.random_batch(20):
+      cfg = self.encoder.decode(row, self.manipulator.random())
+      self.assertEqual(sorted(cfg['p']), [0, 1, 2, 3])
+      self.assertTrue(numpy.allclose(self.encoder.encode(cfg), row))
+
+  def test_gaussian_process(self):
+    X = numpy.linspace(0, 1, 11).reshape(11, 1)
+    model = GaussianProcess(noise=1e-6).fit(X, (X[:, 0] - 0.5) ** 2)
+    mean, std = model.predict(numpy.array([[0.5], [0.55], [3.0]]))
+    self.assertAlmostEqual(mean[0], 0.0, places=3)
+    self.assertLess(std[1], std[2])
+    ei = expected_improvement(mean, std, 0.01)
+    self.assertGreater(ei[0], ei[2])
+
+
+class DistancePredictor(object):
+  """predicts x is best at 3"""
+
+  def set_driver(self, driver):
+    pass
+
+  def score(self, cfgs):
+    return [abs(cfg['x'] - 3) for cfg in cfgs]
+
+
+class DistancePredictorDriver(SearchDriver):
+
+  def prescreen_predictor(self):
+    return DistancePredictor()
+
+
+class PrescreenTests(unittest.TestCase):
+
+  def tune(self, technique_name, search_driver=SearchDriver):
+    space = integer_space(1000)
+    for name in 'abcd':
+      space.add_parameter(manipulator.IntegerParameter(name, 0, 10))
+    return tune(DistanceInterface, space, '--test-limit', '20', '--no-dups',
+                '--technique', technique_name, '--prescreen-factor', '4',
+                search_driver=search_driver)
+
+  def states(self, main):
+    return dict(main.session.query(DesiredResult.state,
+                                   sqlalchemy.func.count(DesiredResult.id))
+                .group_by(DesiredResult.state))
+
+  def test_predictor_picks_tests(self):
+    main = self.tune('PureRandom', DistancePredictorDriver)
+    states = self.states(main)
+    # 4 candidates per test
+    self.assertGreaterEqual(states['ABORTED'], 2 * states['COMPLETE'])
+    self.assertEqual(main.session.query(Result).count(), states['COMPLETE'])
+    # each generation runs the best 4 of 16 random candidates
+    distances = dict()
+    for dr in main.session.query(DesiredResult):
+      distances.setdefault((dr.generation, dr.state), []).append(
+        abs(dr.configuration.data['x'] - 3))
+    for (generation, state), run in distances.items():
+      if state == 'COMPLETE':
+        self.assertLessEqual(max(run), min(distances.get(
+          (generation, 'ABORTED'), [float('inf')])))
+
+  def test_sequential_technique(self):
+    # rejected tests must not stall techniques waiting for their results
+    main = self.tune('PatternSearch')
+    self.assertIn('ABORTED', self.states(main))
+    self.assertGreater(main.search_driver.test_count, 20)
+
+  def test_rejected_not_indexed(self):
+    main = self.tune('PureRandom', DistancePredictorDriver)
+    driver = main.search_driver
+    self.assertTrue(driver.rejected_results)
+    for config, result in driver.rejected_results.items():
+      self.assertTrue(driver.has_results(config))
+      if not driver.result_index.has_results(config):
+        self.assertIs(driver.config_best_result(config), result)
+    indexed = sum(driver.result_index.results_by_config.values(), [])
+    self.assertEqual(len(indexed), main.session.query(Result).count())
+    self.assertTrue(all(result.id is not None for result in indexed))
+
+
+class QuadraticInterface(DefaultMeasurementInterface):
+  """sum of (x - 0.3)^2 over the float parameters"""
+
+  def run(self, desired_result, input, limit):
+    cfg = desired_result.configuration.data
+    return Result(time=sum((v - 0.3) ** 2 for k, v in cfg.items()
+                           if k.startswith('f')))
+
+
+class CMAESTests(unittest.TestCase):
+
+  def tune(self, space, technique_name='CMAES', test_limit=200):
+    return tune(QuadraticInterface, space, '--test-limit', str(test_limit),
+                '--no-dups', '--technique', technique_name)
+
+  def test_converges(self):
+    space = manipulator.ConfigurationManipulator()
+    for i in xrange(3):
+      space.add_parameter(manipulator.FloatParameter('f%d' % i, -1.0, 1.0))
+    main = self.tune(space)
+    self.assertLess(main.search_driver.best_result.time, 1e-3)
+
+  def test_mixed_parameters(self):
+    # integer samples map to the same configurations, and the enum is
+    # copied from the best configuration
+    space = manipulator.ConfigurationManipulator()
+    space.add_parameter(manipulator.FloatParameter('f0', -1.0, 1.0))
+    space.add_parameter(manipulator.IntegerParameter('i', 0, 3))
+    space.add_parameter(manipulator.EnumParameter('e', 'abc'))
+    main = self.tune(space, 'IPOPCMAES', 100)
+    self.assertGreater(main.search_driver.test_count, 100)
+    self.assertLess(main.search_driver.best_result.time, 1e-2)
+
+  def test_restarts(self):
+    technique = CMAES(restarts='ipop')
+    technique.n = 4
+    technique.default_popsize = technique.large_popsize = 8
+    technique.start(8, 0.3)
+    technique.restart()
+    self.assertEqual(technique.lam, 16)
+    technique = CMAES(restarts='bipop')
+    technique.n = 4
+    technique.default_popsize = technique.large_popsize = 8
+    technique.budget = {'large': 100, 'small': 0}
+    technique.restart()
+    self.assertEqual(technique.regime, 'small')
+    self.assertLessEqual(technique.lam, 8)
+
+
+class VectorizedTechniqueTests(unittest.TestCase):
+
+  def space(self):
+    space = manipulator.ConfigurationManipulator()
+    for i in xrange(3):
+      space.add_parameter(manipulator.FloatParameter('f%d' % i, -1.0, 1.0))
+    space.add_parameter(manipulator.EnumParameter('e', 'abc'))
+    return space
+
+  def tune(self, technique_name):
+    return tune(QuadraticInterface, self.space(), '--test-limit', '300',
+                '--no-dups', '--technique', technique_name)
+
+  def test_crossover(self):
+    technique = DifferentialEvolution(cr=0.0, n_cross=1, vectorized=True)
+    technique.manipulator = self.space()
+    x1, x2, x3 = [technique.manipulator.random() for z in xrange(3)]
+    for z in xrange(20):
+      parent = technique.manipulator.random()
+      cfg = technique.vector_crossover(technique.manipulator.copy(parent),
+                                       x1, x2, x3, 0.5)
+      changed = [k for k in parent if cfg[k] != parent[k]]
+      self.assertLessEqual(len(changed), 1)
+
+  def test_differential_evolution(self):
+    main = self.tune('DifferentialEvolutionVector')
+    self.assertLess(main.search_driver.best_result.time, 0.05)
+
+  def test_pso(self):
+    main = self.tune('pso-OX1-vector')
+    self.assertLess(main.search_driver.best_result.time, 0.05)
+
+
+class BatchBanditTests(unittest.TestCase):
+
+  def test_pending_requests(self):
+    bandit = BatchAUCBanditQueue(['a', 'b'], C=0.05)
+    for z in xrange(5):
+      bandit.on_result('a', True)
+      bandit.on_result('b', z < 2)
+    self.assertEqual(list(bandit.ordered_keys())[0], 'a')
+    # a is discounted by requests still in flight
+    for z in xrange(10):
+      bandit.on_request('a')
+    self.assertEqual(list(bandit.ordered_keys())[0], 'b')
+    bandit.on_result('a', True)
+    self.assertEqual(bandit.pending['a'], 9)
+    bandit.on_no_request('a')
+    self.assertEqual(bandit.pending['a'], 9)
+    self.assertEqual(bandit.use_counts['a'], 7)
+
+  def test_cost(self):
+    bandit = BatchAUCBanditQueue(['a', 'b'], C=0.0)
+    for z in xrange(5):
+      bandit.on_result('a', z % 2 == 0, 10.0)
+      bandit.on_result('b', z % 2 == 0, 1.0)
+    self.assertEqual(bandit.exploitation_term_slow('a'),
+                     bandit.exploitation_term_slow('b'))
+    # the same credit per test is worth more per second for b
+    self.assertGreater(bandit.exploitation_term('b'),
+                       bandit.exploitation_term('a'))
+    self.assertEqual(bandit.arm_stats('b')['mean_cost'], 1.0)
+    # reused results are free, which is not a cost of b
+    bandit.on_result('b', False, 0.0)
+    self.assertEqual(bandit.arm_stats('b')['mean_cost'], 1.0)
+
+  def test_arm_stats(self):
+    space = manipulator.ConfigurationManipulator()
+    space.add_parameter(manipulator.FloatParameter('f0', -1.0, 1.0))
+    main = tune(QuadraticInterface, space, '--test-limit', '60', '--no-dups',
+                '--parallelism', '8', '--technique', 'AUCBanditMetaTechniqueA',
+                '--batch-bandit', '--bandit-stats-interval', '20')
+    self.assertIsInstance(main.search_driver.root_technique.bandit,
+                          BatchAUCBanditQueue)
+    stats = main.session.query(BanditArmStats).all()
+    # 4 techniques every 20 tests and at the end
+    self.assertGreaterEqual(len(stats), 4 * 3)
+    self.assertEqual(set(s.bandit_sub_technique.name for s in stats),
+                     set(main.search_driver.bandit_subtechniques))
+    self.assertTrue(any(s.mean_cost is not None for s in stats))